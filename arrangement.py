@@ -0,0 +1,263 @@
+# Song arrangement: patterns played at given bars
+import heapq
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from sequencer_engine import (
+    TIME_UNIT,
+    ChannelEvent,
+    Event,
+    EventList,
+    NoteOffEvent,
+    NoteOnEvent,
+    ScheduledEvent,
+    ScheduledTimeline,
+    TimelineEntry,
+    TimeUnit,
+)
+
+# Sequence numbers of the events of placement i start at i * _SEQUENCE_STRIDE,
+# so that entries of a song are unique and always sorted the same way
+_SEQUENCE_STRIDE = 1 << 32
+
+
+class Pattern:
+    """Events of a pattern, stored once whatever the number of placements"""
+
+    def __init__(self, length: TimeUnit) -> None:
+        self.length = length
+        self.events = EventList()
+        self.timeline = ScheduledTimeline()
+
+    def add_event(self, channel: int, start_time: TimeUnit, event: Event) -> None:
+        sequence = self.events.add_event(ChannelEvent(channel, event), start_time)
+        self.timeline.add(channel, start_time, event, sequence)
+
+    def remove_event(self, channel: int, start_time: TimeUnit, event: Event) -> None:
+        sequence = self.events.remove_event(ChannelEvent(channel, event), start_time)
+        self.timeline.remove(channel, start_time, event, sequence)
+
+
+class Placement:
+    """A pattern played from a bar, with its channels remapped and its notes
+    transposed"""
+
+    __slots__ = ["pattern", "start_bar", "channel_map", "transpose"]
+
+    def __init__(
+        self,
+        pattern: str,
+        start_bar: int,
+        channel_map: Optional[Dict[int, int]] = None,
+        transpose: int = 0,
+    ) -> None:
+        self.pattern = pattern
+        self.start_bar = start_bar
+        self.channel_map = channel_map or {}
+        self.transpose = transpose
+
+    def __repr__(self):
+        return "Placement({}, bar={}, channels={}, transpose={})".format(
+            self.pattern, self.start_bar, self.channel_map, self.transpose
+        )
+
+
+class Arrangement:
+    """
+    A song: patterns, stored once, and placements of these patterns.
+
+    Placements are expanded lazily while the song is walked: the entries of
+    each placement are read from the timeline of its pattern and merged on
+    the fly, placements being opened only when their start is reached.
+    Memory thus depends on the patterns, not on the length of the song.
+
+    Like a ScheduledTimeline, it can be played by a SequencerEngine through
+    next_entry().
+    """
+
+    def __init__(self) -> None:
+        self.patterns: Dict[str, Pattern] = {}
+        self.__placements: List[Placement] = []
+        self.time_signature = (4, 4)
+        # Iterator of the last next_entry() call, with the cursor it was
+        # called with and the entry it returned
+        self.__iterator: Optional[Iterator[TimelineEntry]] = None
+        self.__last: Tuple[Optional[tuple], Optional[TimelineEntry]] = (None, None)
+
+    @property
+    def bar_length(self) -> TimeUnit:
+        number_of_notes, unit = self.time_signature
+        return TimeUnit(number_of_notes * TIME_UNIT / unit)
+
+    def __edited(self) -> None:
+        self.__iterator = None
+
+    def set_pattern(self, name: str, pattern: Pattern) -> None:
+        self.patterns[name] = pattern
+        self.__edited()
+
+    def remove_pattern(self, name: str) -> None:
+        """Removes a pattern and its placements"""
+        del self.patterns[name]
+        self.__placements = [p for p in self.__placements if p.pattern != name]
+        self.__edited()
+
+    def add_placement(self, placement: Placement) -> int:
+        """Returns the index of the placement. Its pattern must exist"""
+        if placement.pattern not in self.patterns:
+            raise ValueError("Unknown pattern {}".format(placement.pattern))
+        self.__placements.append(placement)
+        self.__edited()
+        return len(self.__placements) - 1
+
+    def remove_placement(self, index: int) -> None:
+        del self.__placements[index]
+        self.__edited()
+
+    def placements(self) -> List[Placement]:
+        return list(self.__placements)
+
+    def clear(self) -> None:
+        self.patterns.clear()
+        self.__placements.clear()
+        self.__edited()
+
+    def length(self) -> TimeUnit:
+        """End of the last placement"""
+        return max(
+            (
+                p.start_bar * self.bar_length + self.patterns[p.pattern].length
+                for p in self.__placements
+            ),
+            default=TimeUnit(0),
+        )
+
+    def __placement_entries(
+        self, index: int, placement: Placement, after: tuple
+    ) -> Iterator[TimelineEntry]:
+        """Entries of a placement after cursor, in the time base of the song.
+        Notes still sounding at the end of the pattern are cut there and
+        notes transposed out of the MIDI range are dropped"""
+        pattern = self.patterns[placement.pattern]
+        offset = placement.start_bar * self.bar_length
+        sequence_offset = index * _SEQUENCE_STRIDE
+        channel_map = placement.channel_map
+        transpose = placement.transpose
+        # the note offs past the end of the pattern are read from the end
+        start = min(after[0] - offset, pattern.length)
+        # (sequence, channel, note) of the note offs to move to the end
+        cut: List[Tuple[int, int, int]] = []
+        # sequences of the notes starting past the end
+        ignored: Set[int] = set()
+        for time, order, sequence, channel, event in pattern.timeline.entries_after(
+            (start,)
+        ):
+            note = event.note + transpose
+            if not 0 <= note <= 127:
+                continue
+            if time >= pattern.length:
+                if isinstance(event, NoteOnEvent):
+                    ignored.add(sequence)
+                elif sequence not in ignored:
+                    cut.append((sequence, channel, note))
+                continue
+            # entries are compared in the time base of the song
+            if (time + offset, order, sequence_offset + sequence) <= after[:3]:
+                continue
+            if isinstance(event, NoteOnEvent):
+                event = NoteOnEvent(time + offset, note, event.velocity)
+            else:
+                event = NoteOffEvent(time + offset, note)
+            yield (
+                time + offset,
+                order,
+                sequence_offset + sequence,
+                channel_map.get(channel, channel),
+                event,
+            )
+        end = pattern.length + offset
+        for sequence, channel, note in sorted(cut):
+            if (end, 0, sequence_offset + sequence) <= after[:3]:
+                continue
+            yield (
+                end,
+                0,
+                sequence_offset + sequence,
+                channel_map.get(channel, channel),
+                NoteOffEvent(end, note),
+            )
+
+    def entries_after(self, cursor: tuple) -> Iterator[TimelineEntry]:
+        """Iterates over the entries of the song after cursor, an entry or a
+        (time,) tuple"""
+        bar_length = self.bar_length
+        placements = sorted(
+            (p.start_bar * bar_length, i, p) for i, p in enumerate(self.__placements)
+        )
+        # heap of (entry, iterator of the placement)
+        heap: List[Tuple[TimelineEntry, Iterator[TimelineEntry]]] = []
+        next_placement = 0
+        while True:
+            # open the placements that start before the next entry
+            while next_placement < len(placements) and (
+                not heap or placements[next_placement][0] <= heap[0][0][0]
+            ):
+                _, index, placement = placements[next_placement]
+                next_placement += 1
+                entries = self.__placement_entries(index, placement, cursor)
+                entry = next(entries, None)
+                if entry is not None:
+                    heapq.heappush(heap, (entry, entries))
+            if not heap:
+                return
+            entry, entries = heap[0]
+            yield entry
+            following = next(entries, None)
+            if following is None:
+                heapq.heappop(heap)
+            else:
+                heapq.heapreplace(heap, (following, entries))
+
+    def next_entry(self, cursor: tuple, end_time: TimeUnit) -> Optional[TimelineEntry]:
+        """Returns the first entry after cursor and before end_time.
+        Walking the song entry by entry reuses the same iterator"""
+        last_cursor, last_entry = self.__last
+        if self.__iterator is None or cursor is not last_cursor:
+            if self.__iterator is not None and cursor is last_entry:
+                entry = next(self.__iterator, None)
+            else:
+                self.__iterator = self.entries_after(cursor)
+                entry = next(self.__iterator, None)
+            self.__last = (cursor, entry)
+        else:
+            entry = last_entry
+        if entry is not None and entry[0] < end_time:
+            return entry
+        return None
+
+    def iterate_scheduled_events(
+        self,
+        start_time: Optional[TimeUnit] = None,
+        stop_time: Optional[TimeUnit] = None,
+    ) -> Iterator[Tuple[TimeUnit, Tuple[int, ScheduledEvent]]]:
+        """Yields the ScheduledEvents of the song between start_time and
+        stop_time, by time, like SequencerEngine.iterate_scheduled_events"""
+        # (channel, note) -> number of notes started and not released
+        sounding: Dict[Tuple[int, int], int] = {}
+        for time, _, _, channel, event in self.entries_after((start_time or 0,)):
+            if stop_time is not None and time >= stop_time:
+                if not sounding:
+                    return
+                if isinstance(event, NoteOnEvent):
+                    continue
+            if isinstance(event, NoteOnEvent):
+                key = (channel, event.note)
+                sounding[key] = sounding.get(key, 0) + 1
+            elif isinstance(event, NoteOffEvent):
+                key = (channel, event.note)
+                if key not in sounding:
+                    # note started before start_time
+                    continue
+                sounding[key] -= 1
+                if not sounding[key]:
+                    del sounding[key]
+            yield time, (channel, event)
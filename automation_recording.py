@@ -0,0 +1,122 @@
+# Recording of controller streams as automation breakpoints
+from typing import Dict, List, Optional, Tuple
+
+from sequencer_engine import ParameterEvent, TimeUnit
+
+# (time, value)
+Point = Tuple[TimeUnit, float]
+
+
+class CurveThinner:
+    """
+    Reduces a stream of (time, value) points, as they arrive, to the
+    breakpoints needed to reproduce it with linear segments.
+
+    Points received since the last breakpoint are kept until the segment
+    from that breakpoint to the newest point deviates from one of them by
+    more than tolerance. The previous point then becomes a breakpoint. This
+    is the sliding window variant of Ramer-Douglas-Peucker: the error bound
+    is the same, but breakpoints are known as soon as the curve bends and
+    the window is bounded by max_window points.
+    """
+
+    def __init__(self, tolerance: float, max_window: int = 64) -> None:
+        self.tolerance = tolerance
+        self.max_window = max_window
+        # last breakpoint and points received since
+        self.__anchor: Optional[Point] = None
+        self.__window: List[Point] = []
+
+    def __fits(self, time: TimeUnit, value: float) -> bool:
+        """True if the segment from the anchor to (time, value) approximates
+        every point of the window"""
+        t0, v0 = self.__anchor
+        slope = (value - v0) / (time - t0)
+        return all(
+            abs(v0 + slope * (t - t0) - v) <= self.tolerance for t, v in self.__window
+        )
+
+    def add(self, time: TimeUnit, value: float) -> List[Point]:
+        """Adds a point and returns the breakpoints it makes final"""
+        if self.__anchor is None:
+            self.__anchor = (time, value)
+            return [self.__anchor]
+        last_time = self.__window[-1][0] if self.__window else self.__anchor[0]
+        if time < last_time:
+            # the playback looped: the curve starts again
+            breakpoints = self.flush()
+            return breakpoints + self.add(time, value)
+        if time == last_time:
+            # points of the same time are merged, the last one wins
+            if self.__window:
+                self.__window[-1] = (time, value)
+            return []
+        breakpoints = []
+        if self.__window and (
+            len(self.__window) >= self.max_window or not self.__fits(time, value)
+        ):
+            self.__anchor = self.__window[-1]
+            self.__window = []
+            breakpoints.append(self.__anchor)
+        self.__window.append((time, value))
+        return breakpoints
+
+    def flush(self) -> List[Point]:
+        """Ends the stream and returns its last breakpoint, if any"""
+        breakpoints = self.__window[-1:]
+        self.__anchor = None
+        self.__window = []
+        return breakpoints
+
+
+class AutomationRecorder:
+    """
+    Turns the values of plugin parameters received during a playback into
+    ParameterEvents, with a CurveThinner per (channel, parameter).
+
+    Tolerance is relative to the range of a parameter, from its minimum to its
+    maximum, as parameters have different scales.
+    """
+
+    def __init__(self, tolerance: float = 0.01) -> None:
+        self.tolerance = tolerance
+        self.__thinners: Dict[Tuple[int, str], CurveThinner] = {}
+        # number of values received and of breakpoints kept
+        self.n_values = 0
+        self.n_breakpoints = 0
+
+    def __events(
+        self, channel: int, parameter: str, breakpoints: List[Point]
+    ) -> List[Tuple[int, TimeUnit, ParameterEvent]]:
+        self.n_breakpoints += len(breakpoints)
+        return [
+            (channel, time, ParameterEvent(parameter, value))
+            for time, value in breakpoints
+        ]
+
+    def add(
+        self,
+        channel: int,
+        parameter: str,
+        time: TimeUnit,
+        value: float,
+        minimum: float,
+        maximum: float,
+    ) -> List[Tuple[int, TimeUnit, ParameterEvent]]:
+        """Records a value of a parameter ranging from minimum to maximum and
+        returns the (channel, time, ParameterEvent) to add to the sequencer"""
+        self.n_values += 1
+        key = (channel, parameter)
+        thinner = self.__thinners.get(key)
+        if thinner is None:
+            thinner = self.__thinners[key] = CurveThinner(0)
+        thinner.tolerance = self.tolerance * abs(maximum - minimum)
+        return self.__events(channel, parameter, thinner.add(time, value))
+
+    def flush(self) -> List[Tuple[int, TimeUnit, ParameterEvent]]:
+        """Ends the recording and returns the last breakpoints"""
+        events = []
+        for (channel, parameter), thinner in self.__thinners.items():
+            events.extend(self.__events(channel, parameter, thinner.flush()))
+        self.__thinners.clear()
+        return events
@@ -44,10 +44,22 @@ Item {
         nBarsKnob.value = state.n_bars;
         cursorWidth.value = state.cursor_width;
         velocityKnob.value = state.velocity;
+        // note events are added in one call, as parallel arrays
+        let channels = [], times = [], notes = [], velocities = [], durations = [];
         for (var i = 0; i < state.steps.length; i++) {
             var e = state.steps[i];
-            gSequencer.add_event(e.channel, e.time, e.event);
+            if (e.event.event_type == "note_event") {
+                channels.push(e.channel);
+                times.push(e.time);
+                notes.push(e.event.note);
+                velocities.push(e.event.velocity);
+                durations.push(e.event.duration);
+            }
+            else {
+                gSequencer.add_event(e.channel, e.time, e.event);
+            }
         }
+        gSequencer.add_events(channels, times, notes, velocities, durations);
     }
 
     Common.PlacedDial {
@@ -531,10 +543,10 @@ Item {
                 let start = pianoRoll.cursor_start()
                 let stop = pianoRoll.cursor_end()
 
-                let events = gSequencer.list_events(start, stop);
+                let events = gSequencer.list_events(start, stop, ~~voiceKnob.value);
                 for (var i=0; i < events.length; i++) {
                     let event = events[i];
-                    if (event.channel == voiceKnob.value && event.event.event_type == "note_event" && event.event.note == note)
+                    if (event.event.event_type == "note_event" && event.event.note == note)
                         pianoRoll.toggleNoteSelection(event.channel, event.time_amount, event.time_unit, note);
                 }
                 pianoRoll.update();
@@ -598,6 +610,18 @@ Item {
                 PropertyAnimation { to: true }
             }
         }
+        Text {
+            text: "UNDO"
+            font.pixelSize: 10
+            x: (parent.keyWidth - width) / 2 + 3 * parent.keyWidth
+            opacity: gSequencer.can_undo ? 1.0 : 0.3
+        }
+        Text {
+            text: "REDO"
+            font.pixelSize: 10
+            x: (parent.keyWidth - width) / 2 + 4 * parent.keyWidth
+            opacity: gSequencer.can_redo ? 1.0 : 0.3
+        }
     }
 
     Connections {
@@ -625,6 +649,8 @@ Item {
 
     property var notes: []
     property var noteStarts: []
+    // the notes of a step record make one undo level
+    property bool stepEditOpen: false
     property real previousNoteOnTs: 0
     property real previousNoteOffTs: 0
     readonly property int chordTimeout: 200 // milliseconds
@@ -636,6 +662,10 @@ Item {
             if (!board.isShiftPressed) {
                 if ((~~modeKnob.value == 2) && recAnimation.running) { // step record
                     let ts = Date.now();
+                    if (!stepEditOpen) {
+                        gSequencer.beginEdit();
+                        stepEditOpen = true;
+                    }
                     notes.push(note);
                     noteStarts.push({"time": pianoRoll.cursor_start()});
                     if ((previousNoteOnTs != 0) && (ts - previousNoteOnTs > chordTimeout))
@@ -675,6 +705,33 @@ Item {
                 else if (note % 12 == 4) {
                     // Third note : record
                     recAnimation.running = ! recAnimation.running;
+                    if (!recAnimation.running && stepEditOpen) {
+                        // notes still held are not recorded
+                        notes = [];
+                        noteStarts = [];
+                        gSequencer.endEdit();
+                        stepEditOpen = false;
+                    }
+                    if (recAnimation.running && (~~modeKnob.value == 3)) { // live record
+                        // notes are timestamped and quantized on the Python side
+                        gSequencer.startLiveRecording(~~voiceKnob.value, pianoRoll.cursor_end() - pianoRoll.cursor_start());
+                        // as well as the moves of the instrument knobs
+                        gSequencer.setRecording(true);
+                    }
+                    else {
+                        gSequencer.setRecording(false);
+                        gSequencer.stopLiveRecording();
+                    }
+                }
+                else if (note % 12 == 5) {
+                    // Fourth note : undo
+                    gSequencer.undo();
+                    pianoRoll.update();
+                }
+                else if (note % 12 == 7) {
+                    // Fifth note : redo
+                    gSequencer.redo();
+                    pianoRoll.update();
                 }
             }
             else {
@@ -707,8 +764,13 @@ Item {
                     if ((pianoRoll.note_offset <= note - 12) || (pianoRoll.note_offset >= note)) {
                         pianoRoll.note_offset = note
                     }
-                    if (notes.length == 0)
+                    if (notes.length == 0) {
                         pianoRoll.increment_cursor_x();
+                        if (stepEditOpen) {
+                            gSequencer.endEdit();
+                            stepEditOpen = false;
+                        }
+                    }
                 }
             }
 
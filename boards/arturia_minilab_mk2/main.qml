@@ -239,6 +239,8 @@ Item {
                 children.push(obj);
                 voiceInstrument[voiceNumber] = {"instrument": obj, "index": instrumentIndex};
                 voiceStackLayoutIndex[voiceNumber] = children.length - 1;
+                // route the sequencer output of this voice (lookahead mode)
+                gSequencer.connectChannel(~~voiceNumber, lv2Host.midiInputPort(lv2Id));
             }
             return obj;
         }
@@ -712,16 +714,26 @@ Item {
     // route note from the sequencer to instruments
     Connections {
         target: gSequencer
-        onNoteOn: {
-            let instr = instrumentStack.instrumentAt(channel);
-            if (instr != null) {
-                lv2Host.noteOn(instr.instrument.lv2Id, note, velocity);
+        onNotes: {
+            // notes is a batch of [channel, note, velocity]
+            let hostNotes = [];
+            for (var i = 0; i < notes.length; i++) {
+                let instr = instrumentStack.instrumentAt(notes[i][0]);
+                if (instr != null) {
+                    hostNotes.push([instr.instrument.lv2Id, notes[i][1], notes[i][2]]);
+                }
+            }
+            if (hostNotes.length > 0) {
+                lv2Host.sendNotes(hostNotes);
             }
         }
-        onNoteOff: {
-            let instr = instrumentStack.instrumentAt(channel);
-            if (instr != null) {
-                lv2Host.noteOff(instr.instrument.lv2Id, note);
+        onParameters: {
+            // parameters is a batch of [channel, parameter name, value]
+            for (var i = 0; i < parameters.length; i++) {
+                let instr = instrumentStack.instrumentAt(parameters[i][0]);
+                if (instr != null) {
+                    lv2Host.setParameterValue(instr.instrument.lv2Id, parameters[i][1], parameters[i][2]);
+                }
             }
         }
     }
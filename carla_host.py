@@ -1,13 +1,20 @@
 import json
 import os
 import sys
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 import xml.etree.ElementTree as ET
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass
 from pathlib import Path
 
 import jack
-from PyQt5.QtCore import pyqtSlot, QObject, QCoreApplication, QVariant
+from PyQt5.QtCore import (
+    pyqtSignal,
+    pyqtSlot,
+    QObject,
+    QCoreApplication,
+    QTimer,
+    QVariant,
+)
 
 
 class JackClient:
@@ -44,6 +51,12 @@ PARAMETER_BALANCE_LEFT = -5
 # Range -1.0...1.0; default is 1.0.
 PARAMETER_BALANCE_RIGHT = -6
 
+# Parameter writes are sent to Carla at most once per UI frame, in ms
+PARAMETER_FLUSH_INTERVAL = 16
+# Interval of the engine_idle() calls that deliver the Carla engine
+# callbacks, in ms
+ENGINE_IDLE_INTERVAL = 30
+
 
 @dataclass
 class Preset:
@@ -57,88 +70,281 @@ class PresetBank:
     presets: Dict[str, Preset]
 
 
-def load_lv2_presets() -> Dict[str, Dict[str, PresetBank]]:
-    import rdflib
-    from rdflib import RDF, RDFS, Namespace
-
-    pset = Namespace("http://lv2plug.in/ns/ext/presets#")
-    lv2 = Namespace("http://lv2plug.in/ns/lv2core#")
-
-    # Reload all LV2 presets from disk
-    lv2_path = Path.home() / ".lv2"
-
-    sub_folders = [f.path for f in os.scandir(lv2_path) if f.is_dir()]
-    g = rdflib.Graph()
-    for sub_folder in sub_folders:
-        manifest = Path(sub_folder) / "manifest.ttl"
-        if not os.path.exists(manifest):
-            continue
+def _cache_dir() -> Path:
+    """The cache directory of the application, in the XDG cache directory,
+    created if needed"""
+    cache_home = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache"))
+    cache_dir = cache_home / "noisyq"
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return cache_dir
+
+
+class PresetIndex:
+    """
+    Index of the LV2 presets of ~/.lv2, stored in an SQLite database.
+
+    Files are known by path, modification time and size: only the bundles
+    with a changed file are parsed again. The manifests give the banks and
+    the presets of each plugin, while preset files are only parsed the first
+    time the presets of their plugin are asked for.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY, bundle TEXT, mtime INTEGER, size INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS banks (
+            bank TEXT, plugin TEXT, label TEXT, bundle TEXT
+        );
+        CREATE TABLE IF NOT EXISTS presets (
+            preset TEXT, bank TEXT, file TEXT, bundle TEXT,
+            name TEXT, parameters TEXT
+        );
+        CREATE INDEX IF NOT EXISTS banks_plugin ON banks (plugin);
+        CREATE INDEX IF NOT EXISTS presets_bank ON presets (bank);
+    """
+
+    def __init__(self, db_file: Optional[Path] = None, lv2_path: Optional[Path] = None):
+        import sqlite3
+
+        if db_file is None:
+            db_file = _cache_dir() / "presets.sqlite"
+        self.__lv2_path = lv2_path if lv2_path is not None else Path.home() / ".lv2"
+        self.__db = sqlite3.connect(str(db_file))
+        self.__db.executescript(self.SCHEMA)
+        # plugin uri => bank name => PresetBank, for the plugins asked for
+        self.__presets: Dict[str, Dict[str, PresetBank]] = {}
+        self.update()
+
+    @staticmethod
+    def __bundle_files(bundle: str) -> Dict[str, Tuple[int, int]]:
+        """path => (mtime, size) of the turtle files of a bundle"""
+        files = {}
+        for f in os.scandir(bundle):
+            if f.name.endswith(".ttl") and f.is_file():
+                st = f.stat()
+                files[f.path] = (st.st_mtime_ns, st.st_size)
+        return files
+
+    def update(self) -> None:
+        """Indexes the bundles that changed since the last update"""
+        bundles = set()
+        if self.__lv2_path.is_dir():
+            bundles = {f.path for f in os.scandir(self.__lv2_path) if f.is_dir()}
+        indexed: Dict[str, Dict[str, Tuple[int, int]]] = {}
+        for path, bundle, mtime, size in self.__db.execute("SELECT * FROM files"):
+            indexed.setdefault(bundle, {})[path] = (mtime, size)
+
+        changed = False
+        for bundle in indexed.keys() - bundles:
+            self.__forget(bundle)
+            changed = True
+        for bundle in sorted(bundles):
+            files = self.__bundle_files(bundle)
+            if files != indexed.get(bundle, {}):
+                self.__index_bundle(bundle, files)
+                changed = True
+        self.__db.commit()
+        if changed:
+            self.__presets.clear()
+
+    def __forget(self, bundle: str) -> None:
+        for table in ("files", "banks", "presets"):
+            self.__db.execute(f"DELETE FROM {table} WHERE bundle = ?", (bundle,))
+
+    def __index_bundle(self, bundle: str, files: Dict[str, Tuple[int, int]]):
+        import rdflib
+        from rdflib import RDF, RDFS, Namespace
+
+        pset = Namespace("http://lv2plug.in/ns/ext/presets#")
+        lv2 = Namespace("http://lv2plug.in/ns/lv2core#")
+
+        print("** index lv2 presets of", bundle)
+        self.__forget(bundle)
+        self.__db.executemany(
+            "INSERT INTO files VALUES (?, ?, ?, ?)",
+            [(path, bundle, mtime, size) for path, (mtime, size) in files.items()],
+        )
+        manifest = Path(bundle) / "manifest.ttl"
+        if str(manifest) not in files:
+            return
+        g = rdflib.Graph()
         g.parse(manifest)
-
-    # plugin uri => bank name => PresetBank
-    presets: Dict[str, Dict[str, PresetBank]] = {}
-    for bank in g.subjects(RDF.type, pset.bank):
-        plugin_uri = str(g.value(bank, lv2.appliesTo))
-        bank_name = str(g.value(bank, RDFS.label))
-
-        bank_presets = {}
-        for preset in g.subjects(pset.bank, bank):
-            # load preset definition
-            p = rdflib.Graph()
-            p.parse(g.value(preset, RDFS.seeAlso))
-            preset_name = str(p.value(preset, RDFS.label))
-            ports = p.objects(preset, lv2.port)
-            parameters = {}
-            for port in ports:
-                symbol = str(p.value(port, lv2.symbol))
-                value = p.value(port, pset.value).toPython()
-                parameters[symbol] = value
-            bank_presets[preset_name] = Preset(preset_name, parameters)
-            print("Loaded", plugin_uri, bank_name, preset_name)
-
-        presets.setdefault(plugin_uri, {}).setdefault(
-            bank_name, PresetBank(bank_name, bank_presets)
+        self.__db.executemany(
+            "INSERT INTO banks VALUES (?, ?, ?, ?)",
+            [
+                (
+                    str(bank),
+                    str(g.value(bank, lv2.appliesTo)),
+                    str(g.value(bank, RDFS.label)),
+                    bundle,
+                )
+                for bank in g.subjects(RDF.type, pset.bank)
+            ],
+        )
+        # preset definitions are read later, by presets()
+        self.__db.executemany(
+            "INSERT INTO presets VALUES (?, ?, ?, ?, NULL, NULL)",
+            [
+                (str(preset), str(bank), str(g.value(preset, RDFS.seeAlso)), bundle)
+                for preset, bank in g.subject_objects(pset.bank)
+            ],
         )
 
-    return presets
-
-
-def load_presets():
-    """Load presets from cache if it exists, or load them from disk"""
-    import pickle
+    def __load_preset(self, preset: str, file: str) -> Optional[Preset]:
+        import decimal
 
-    presets_cache_file = Path("presets_cache.bin")
-    if os.path.exists(presets_cache_file):
-        with open(presets_cache_file, "rb") as f:
-            print("** load lv2 presets from cache")
-            return pickle.load(f)
+        import rdflib
+        from rdflib import RDFS, Namespace, URIRef
+
+        pset = Namespace("http://lv2plug.in/ns/ext/presets#")
+        lv2 = Namespace("http://lv2plug.in/ns/lv2core#")
+
+        p = rdflib.Graph()
+        try:
+            p.parse(URIRef(file))
+        except Exception as e:
+            print("** cannot load preset", preset, e)
+            return None
+        preset = URIRef(preset)
+        parameters = {}
+        for port in p.objects(preset, lv2.port):
+            symbol = str(p.value(port, lv2.symbol))
+            value = p.value(port, pset.value).toPython()
+            if isinstance(value, decimal.Decimal):
+                value = float(value)
+            parameters[symbol] = value
+        return Preset(str(p.value(preset, RDFS.label)), parameters)
+
+    def presets(self, plugin_uri: str) -> Dict[str, PresetBank]:
+        """Banks of presets of a plugin, by name"""
+        if plugin_uri in self.__presets:
+            return self.__presets[plugin_uri]
+        rows = self.__db.execute(
+            "SELECT b.label, p.rowid, p.preset, p.file, p.name, p.parameters "
+            "FROM banks AS b JOIN presets AS p ON p.bank = b.bank "
+            "WHERE b.plugin = ? ORDER BY p.rowid",
+            (plugin_uri,),
+        ).fetchall()
+        banks: Dict[str, PresetBank] = {}
+        for bank_name, rowid, preset_uri, file, name, parameters in rows:
+            if parameters is None:
+                preset = self.__load_preset(preset_uri, file)
+                if preset is None:
+                    continue
+                self.__db.execute(
+                    "UPDATE presets SET name = ?, parameters = ? WHERE rowid = ?",
+                    (preset.name, json.dumps(preset.parameters), rowid),
+                )
+                print("Loaded", plugin_uri, bank_name, preset.name)
+            else:
+                preset = Preset(name, json.loads(parameters))
+            bank = banks.setdefault(bank_name, PresetBank(bank_name, {}))
+            bank.presets[preset.name] = preset
+        self.__db.commit()
+        self.__presets[plugin_uri] = banks
+        return banks
 
-    presets = load_lv2_presets()
-    with open(presets_cache_file, "wb") as fo:
-        pickle.dump(presets, fo)
 
-    return presets
+@dataclass
+class ParameterInfo:
+    id: int
+    symbol: str
+    name: str
+    minimum: float
+    maximum: float
+    default: float
+    unit: str
+
+
+class ParameterCache:
+    """
+    Parameter metadata of the plugins, by URI, saved to a file.
+
+    An entry is valid as long as the binary of the plugin has the same
+    modification time and size. The metadata of a plugin is shared by all
+    its instances.
+    """
+
+    def __init__(self, file_name: Optional[Path] = None):
+        if file_name is None:
+            file_name = _cache_dir() / "parameters.json"
+        self.__file_name = file_name
+        # uri -> {"binary": signature, "parameters": list of dict}
+        self.__entries: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(file_name):
+            try:
+                with open(file_name, "r") as fi:
+                    self.__entries = json.load(fi)
+            except ValueError:
+                print("** ignore invalid parameter cache", file_name)
+        # uri -> shared list of ParameterInfo
+        self.__parameters: Dict[str, List[ParameterInfo]] = {}
+
+    @staticmethod
+    def signature(binary: str) -> Optional[List[Any]]:
+        try:
+            st = os.stat(binary)
+        except OSError:
+            return None
+        return [binary, st.st_mtime_ns, st.st_size]
+
+    def get(self, uri: str, binary: str) -> Optional[List[ParameterInfo]]:
+        signature = self.signature(binary)
+        entry = self.__entries.get(uri)
+        if signature is None or entry is None or entry["binary"] != signature:
+            return None
+        if uri not in self.__parameters:
+            self.__parameters[uri] = [
+                ParameterInfo(**parameter) for parameter in entry["parameters"]
+            ]
+        return self.__parameters[uri]
+
+    def set(self, uri: str, binary: str, parameters: List[ParameterInfo]) -> None:
+        self.__parameters[uri] = parameters
+        signature = self.signature(binary)
+        if signature is None:
+            return
+        self.__entries[uri] = {
+            "binary": signature,
+            "parameters": [asdict(parameter) for parameter in parameters],
+        }
+        with open(self.__file_name, "w") as fo:
+            json.dump(self.__entries, fo)
 
 
 class CarlaHost(QObject):
+    # A parameter changed on the plugin side (its UI, a program change, ...)
+    parameterValueChanged = pyqtSignal(
+        str, str, float, arguments=["lv2_id", "parameter_name", "value"]
+    )
+
     class Instance:
         def __init__(self):
             self.uri = ""
             self.id = 0
             # name -> Parameter
             self.parameters = {}
+            # Parameters, by id
+            self.parameters_by_id = []
 
-            self.presets: Dict[str, PresetBank] = {}
+            # name of the JACK MIDI input port of the plugin
+            self.midi_in = ""
 
     class Parameter:
         def __init__(self):
             self.name = ""
             self.id = 0
+            # metadata, shared between instances
+            self.info: Optional[ParameterInfo] = None
+            # mirror of the value in the plugin
+            self.value = 0.0
 
     def __init__(self, carla_install_path, parent=None):
         super().__init__(parent)
 
-        self.__presets = load_presets()
+        self.__preset_index = PresetIndex()
+        self.__parameter_cache = ParameterCache()
 
         # initialize Carla
         if carla_install_path is None:
@@ -177,6 +383,25 @@ class CarlaHost(QObject):
         else:
             raise RuntimeError("Cannot find system output audio ports !")
 
+        # name -> Instance
+        self.__instances = {}
+
+        self.__solo: Optional[str] = None
+        self.__mute_state: Dict[str, bool] = {}
+
+        # Parameter writes not sent yet: (plugin id, parameter id) -> value.
+        # Only the last value of a parameter is sent, once per frame
+        self.__pending_writes: Dict[Tuple[int, int], float] = {}
+        self.__flush_timer = QTimer()
+        self.__flush_timer.setSingleShot(True)
+        self.__flush_timer.setInterval(PARAMETER_FLUSH_INTERVAL)
+        self.__flush_timer.timeout.connect(self.flushParameterValues)
+        # number of writes requested, and of writes replaced by a later one
+        self.__n_writes = 0
+        self.__n_collapsed_writes = 0
+
+        # callbacks are also sent during engine_init()
+        self.__host.set_engine_callback(self.__on_engine_callback)
         if not self.__host.engine_init("JACK", "MIDI control host"):
             print(
                 "Engine failed to initialize, possible reasons:\n%s"
@@ -190,11 +415,95 @@ class CarlaHost(QObject):
         self.__last_jack_client: Optional[JackClient] = None
         self.__jack.activate()
 
-        # name -> Instance
-        self.__instances = {}
+        self.__idle_timer = QTimer()
+        self.__idle_timer.setInterval(ENGINE_IDLE_INTERVAL)
+        self.__idle_timer.timeout.connect(self.__host.engine_idle)
+        self.__idle_timer.start()
 
-        self.__solo: Optional[str] = None
-        self.__mute_state: Dict[str, bool] = {}
+    def __on_engine_callback(
+        self, handle, action, plugin_id, value1, value2, value3, valuef, value_str
+    ):
+        """Keeps the parameter values in sync with the changes made by the
+        plugins"""
+        from carla_backend import (
+            ENGINE_CALLBACK_MIDI_PROGRAM_CHANGED,
+            ENGINE_CALLBACK_PARAMETER_VALUE_CHANGED,
+            ENGINE_CALLBACK_PROGRAM_CHANGED,
+            ENGINE_CALLBACK_RELOAD_ALL,
+            ENGINE_CALLBACK_RELOAD_PARAMETERS,
+        )
+
+        lv2_id = str(plugin_id)
+        instance = self.__instances.get(lv2_id)
+        if instance is None:
+            return
+        if action == ENGINE_CALLBACK_PARAMETER_VALUE_CHANGED:
+            # negative ids are internal parameters (volume, ...)
+            if 0 <= value1 < len(instance.parameters_by_id):
+                parameter = instance.parameters_by_id[value1]
+                # a pending write is more recent
+                if (instance.id, parameter.id) not in self.__pending_writes:
+                    self.__set_mirror(lv2_id, parameter, valuef)
+        elif action in (
+            ENGINE_CALLBACK_PROGRAM_CHANGED,
+            ENGINE_CALLBACK_MIDI_PROGRAM_CHANGED,
+            ENGINE_CALLBACK_RELOAD_PARAMETERS,
+            ENGINE_CALLBACK_RELOAD_ALL,
+        ):
+            self.__read_parameter_values(lv2_id)
+
+    def __set_mirror(self, lv2_id, parameter, value):
+        if parameter.value != value:
+            parameter.value = value
+            self.parameterValueChanged.emit(lv2_id, parameter.name, value)
+
+    def __parameter_infos(self, instance):
+        """Parameter metadata of a plugin, queried only if it is not cached"""
+        binary = self.__host.get_plugin_info(instance.id)["filename"]
+        infos = self.__parameter_cache.get(instance.uri, binary)
+        if infos is not None:
+            return infos
+        infos = []
+        pcount = self.__host.get_parameter_count_info(instance.id)
+        for i in range(pcount["ins"]):
+            pinfo = self.__host.get_parameter_info(instance.id, i)
+            ranges = self.__host.get_parameter_ranges(instance.id, i)
+            infos.append(
+                ParameterInfo(
+                    i,
+                    pinfo["symbol"],
+                    pinfo["name"],
+                    ranges["min"],
+                    ranges["max"],
+                    ranges["def"],
+                    pinfo["unit"],
+                )
+            )
+        self.__parameter_cache.set(instance.uri, binary, infos)
+        return infos
+
+    def __read_parameters(self, instance):
+        """Collects the parameters of a new instance. They have their default
+        value, the engine callback reports the changes"""
+        for info in self.__parameter_infos(instance):
+            p = CarlaHost.Parameter()
+            p.id = info.id
+            p.name = info.symbol
+            p.value = info.default
+            p.info = info
+            instance.parameters[p.name] = p
+            instance.parameters_by_id.append(p)
+
+    def __read_parameter_values(self, lv2_id):
+        """Reads all the parameter values of an instance again, e.g. after its
+        state has been loaded"""
+        instance = self.__instances[lv2_id]
+        for parameter in instance.parameters_by_id:
+            self.__set_mirror(
+                lv2_id,
+                parameter,
+                self.__host.get_current_parameter_value(instance.id, parameter.id),
+            )
 
     def on_port_register(self, port, register):
         client_name, port_name = port.shortname.split(":")
@@ -249,6 +558,7 @@ class CarlaHost(QObject):
                 self.__jack.connect(
                     self.__last_jack_client.audio_out[i], self.__system_audio_out[i]
                 )
+        midi_in = self.__last_jack_client.midi_in
         self.__last_jack_client = None
 
         # DEBUG
@@ -258,16 +568,10 @@ class CarlaHost(QObject):
         instance = CarlaHost.Instance()
         instance.id = self.__next_id
         instance.uri = lv2_name
-        instance.presets = self.__presets.get(lv2_name, {})
+        if midi_in is not None:
+            instance.midi_in = midi_in.name
 
-        # collect parameters id
-        pcount = self.__host.get_parameter_count_info(self.__next_id)
-        for i in range(pcount["ins"]):
-            pinfo = self.__host.get_parameter_info(self.__next_id, i)
-            p = CarlaHost.Parameter()
-            p.id = i
-            p.name = pinfo["symbol"]
-            instance.parameters[p.name] = p
+        self.__read_parameters(instance)
 
         self.__instances[lv2_id] = instance
 
@@ -309,20 +613,16 @@ class CarlaHost(QObject):
             self.__jack.connect(
                 self.__last_jack_client.audio_out[i], self.__system_audio_out[i]
             )
+        midi_in = self.__last_jack_client.midi_in
         self.__last_jack_client = None
 
         instance = CarlaHost.Instance()
         instance.id = self.__next_id
         instance.uri = filename
+        if midi_in is not None:
+            instance.midi_in = midi_in.name
 
-        # collect parameters id
-        pcount = self.__host.get_parameter_count_info(self.__next_id)
-        for i in range(pcount["ins"]):
-            pinfo = self.__host.get_parameter_info(self.__next_id, i)
-            p = CarlaHost.Parameter()
-            p.id = i
-            p.name = pinfo["symbol"]
-            instance.parameters[p.name] = p
+        self.__read_parameters(instance)
 
         self.__instances[lv2_id] = instance
 
@@ -332,21 +632,56 @@ class CarlaHost(QObject):
 
     @pyqtSlot(str, str, float)
     def setParameterValue(self, lv2_id, parameter_name, value):
+        """The value is sent to the plugin with the next flush, if it is not
+        replaced before"""
         instance = self.__instances[lv2_id]
-        print(">>> setParameterValue", lv2_id, parameter_name, value)
-        self.__host.set_parameter_value(
-            instance.id, instance.parameters[parameter_name].id, value
-        )
+        parameter = instance.parameters[parameter_name]
+        parameter.value = value
+        key = (instance.id, parameter.id)
+        self.__n_writes += 1
+        if key in self.__pending_writes:
+            self.__n_collapsed_writes += 1
+        self.__pending_writes[key] = value
+        if not self.__flush_timer.isActive():
+            self.__flush_timer.start()
+
+    @pyqtSlot()
+    def flushParameterValues(self):
+        """Sends the pending parameter writes to the plugins"""
+        self.__flush_timer.stop()
+        pending, self.__pending_writes = self.__pending_writes, {}
+        for (plugin_id, parameter_id), value in pending.items():
+            self.__host.set_parameter_value(plugin_id, parameter_id, value)
+
+    @pyqtSlot(str, str, result=QVariant)
+    def parameterInfo(self, lv2_id, parameter_name):
+        """Name, range, default value and unit of a parameter"""
+        return asdict(self.__instances[lv2_id].parameters[parameter_name].info)
+
+    @pyqtSlot(str, list, result=QVariant)
+    def getParameters(self, lv2_id, parameter_names):
+        """Values of several parameters, as {name: value}, in one call"""
+        parameters = self.__instances[lv2_id].parameters
+        return {name: parameters[name].value for name in parameter_names}
+
+    @pyqtSlot(str, QVariant)
+    def setParameters(self, lv2_id, values):
+        """Sets several parameters from {name: value}, in one call"""
+        for name, value in values.toVariant().items():
+            self.setParameterValue(lv2_id, name, float(value))
+
+    @pyqtSlot(result=QVariant)
+    def parameterWriteStatistics(self):
+        return {
+            "writes": self.__n_writes,
+            "collapsed_writes": self.__n_collapsed_writes,
+            "pending_writes": len(self.__pending_writes),
+        }
 
     @pyqtSlot(str, str, result=float)
     def getParameterValue(self, lv2_id, parameter_name):
-        instance = self.__instances[lv2_id]
-        value = self.__host.get_current_parameter_value(
-            instance.id,
-            instance.parameters[parameter_name].id,
-        )
-        print(">>> getParameterValue", lv2_id, parameter_name, value)
-        return value
+        """Read from the mirror of the parameter values"""
+        return self.__instances[lv2_id].parameters[parameter_name].value
 
     @pyqtSlot(str, result=float)
     def getVolume(self, lv2_id):
@@ -429,9 +764,22 @@ class CarlaHost(QObject):
         channel = 0
         self.__host.send_midi_note(self.__instances[lv2_id].id, channel, note, 0)
 
+    @pyqtSlot(list)
+    def sendNotes(self, notes):
+        """Sends a batch of [lv2_id, note, velocity], a velocity of 0 is a note off"""
+        channel = 0
+        for lv2_id, note, velocity in notes:
+            self.__host.send_midi_note(
+                self.__instances[lv2_id].id, channel, int(note), int(velocity)
+            )
+
+    @pyqtSlot(str, result=str)
+    def midiInputPort(self, lv2_id):
+        return self.__instances[lv2_id].midi_in
+
     @pyqtSlot(str, result=list)
     def presets(self, lv2_id):
-        presets = self.__instances[lv2_id].presets
+        presets = self.__preset_index.presets(self.__instances[lv2_id].uri)
         return [
             {"bank": bank_name, "presets": list(bank.presets.keys())}
             for bank_name, bank in presets.items()
@@ -443,13 +791,15 @@ class CarlaHost(QObject):
 
         print("** set preset", lv2_id, bank_name, preset_name)
         instance = self.__instances[lv2_id]
-        presets = instance.presets
+        presets = self.__preset_index.presets(instance.uri)
         bank = presets.get(bank_name)
         if not bank:
             return
         preset = bank.presets.get(preset_name)
         if not preset:
             return
+        # pending writes must not override the preset
+        self.flushParameterValues()
         for _ in range(2):
             for parameter, value in preset.parameters.items():
                 if parameter in instance.parameters:
@@ -458,6 +808,7 @@ class CarlaHost(QObject):
                     self.__host.set_parameter_value(
                         instance.id, instance.parameters[parameter].id, value
                     )
+                    instance.parameters[parameter].value = value
 
     @pyqtSlot(str, result=list)
     def programs(self, lv2_id):
@@ -507,6 +858,7 @@ class CarlaHost(QObject):
     @pyqtSlot(str, bool, result=str)
     def save_state(self, lv2_id, convert_xml_to_json=False):
         id = self.__instances[lv2_id].id
+        self.flushParameterValues()
         fn = "/tmp/save_state_tmp"
         self.__host.prepare_for_save(id)
         self.__host.save_plugin_state(id, fn)
@@ -534,6 +886,7 @@ class CarlaHost(QObject):
     @pyqtSlot(str, str, bool)
     def load_state(self, lv2_id, state, convert_json_to_xml=False):
         id = self.__instances[lv2_id].id
+        self.flushParameterValues()
         fn = "/tmp/load_state_tmp"
 
         def python_to_tree(p):
@@ -555,6 +908,7 @@ class CarlaHost(QObject):
             with open(fn, "wb") as fo:
                 fo.write(state.encode("utf-8"))
         self.__host.load_plugin_state(id, fn)
+        self.__read_parameter_values(lv2_id)
 
     # FIXME to be tested
     @pyqtSlot(str, list, list)
@@ -562,6 +916,7 @@ class CarlaHost(QObject):
         instance = self.__instances[lv2_id]
         id = instance.id
         fn = "/tmp/load_state_tmp"
+        self.flushParameterValues()
         # self.__host.prepare_for_save(id)
         self.__host.save_plugin_state(id, fn)
         with open(fn, "rb") as fi:
@@ -603,3 +958,4 @@ class CarlaHost(QObject):
         with open(fn, "wb") as fo:
             fo.write(state)
         self.__host.load_plugin_state(instance.id, fn)
+        self.__read_parameter_values(lv2_id)
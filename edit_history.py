@@ -0,0 +1,146 @@
+# Undo/redo history of the sequencer edits
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Deque, Iterator, List, Optional, Tuple
+
+from sequencer_engine import Event, TimeUnit
+
+ADD = 0
+REMOVE = 1
+
+# (ADD or REMOVE, channel, time, event)
+Operation = Tuple[int, int, TimeUnit, Event]
+
+
+class EditHistory:
+    """
+    Journal of the edits, to undo and redo them.
+
+    Each undo level is the list of the elementary operations (additions and
+    removals of events) of one edit. Undoing applies their inverse, in
+    reverse order, so that the cost only depends on the size of the edit.
+    Events are not copied, they are shared with the event list.
+
+    Memory is bounded by a maximum number of levels and of operations: the
+    oldest levels are forgotten first.
+    """
+
+    def __init__(
+        self,
+        max_levels: int = 500,
+        max_operations: int = 200000,
+        on_change: Optional[Callable[[], None]] = None,
+    ) -> None:
+        # called when the undo or redo levels change
+        self.__on_change = on_change
+        self.__max_levels = max_levels
+        self.__max_operations = max_operations
+        self.__undo: Deque[List[Operation]] = deque()
+        self.__redo: List[List[Operation]] = []
+        self.__n_operations = 0
+        # operations of the edit being recorded
+        self.__current: List[Operation] = []
+        self.__depth = 0
+        self.__replaying = False
+
+    def begin(self) -> None:
+        """Starts grouping the next operations into one undo level, until
+        end(). Groups can be nested, the outermost one makes the level"""
+        self.__depth += 1
+
+    def end(self) -> None:
+        self.__depth = max(0, self.__depth - 1)
+        if self.__depth == 0:
+            self.__commit()
+
+    @contextmanager
+    def edit(self) -> Iterator[None]:
+        """Groups the operations recorded in the block into one undo level"""
+        self.begin()
+        try:
+            yield
+        finally:
+            self.end()
+
+    def record(self, operation: int, channel: int, time: TimeUnit, event: Event):
+        if self.__replaying:
+            return
+        self.__current.append((operation, channel, time, event))
+        if self.__depth == 0:
+            self.__commit()
+
+    def __commit(self) -> None:
+        if not self.__current:
+            return
+        self.__undo.append(self.__current)
+        self.__n_operations += len(self.__current)
+        self.__current = []
+        self.__redo.clear()
+        while len(self.__undo) > 1 and (
+            len(self.__undo) > self.__max_levels
+            or self.__n_operations > self.__max_operations
+        ):
+            self.__n_operations -= len(self.__undo.popleft())
+        self.__changed()
+
+    def __changed(self) -> None:
+        if self.__on_change is not None:
+            self.__on_change()
+
+    def can_undo(self) -> bool:
+        return bool(self.__undo)
+
+    def can_redo(self) -> bool:
+        return bool(self.__redo)
+
+    def clear(self) -> None:
+        self.__undo.clear()
+        self.__redo.clear()
+        self.__n_operations = 0
+        self.__changed()
+
+    def __replay(
+        self,
+        operations: List[Operation],
+        add: Callable[[int, TimeUnit, Event], None],
+        remove: Callable[[int, TimeUnit, Event], None],
+    ) -> None:
+        self.__replaying = True
+        try:
+            for operation, channel, time, event in operations:
+                (add if operation == ADD else remove)(channel, time, event)
+        finally:
+            self.__replaying = False
+
+    def undo(
+        self,
+        add: Callable[[int, TimeUnit, Event], None],
+        remove: Callable[[int, TimeUnit, Event], None],
+    ) -> bool:
+        """Reverts the last edit with the given add and remove functions.
+        Returns False if there is nothing to undo"""
+        if not self.__undo:
+            return False
+        operations = self.__undo.pop()
+        self.__n_operations -= len(operations)
+        # the inverse of each operation, in reverse order
+        self.__replay(reversed(operations), remove, add)
+        self.__redo.append(operations)
+        self.__changed()
+        return True
+
+    def redo(
+        self,
+        add: Callable[[int, TimeUnit, Event], None],
+        remove: Callable[[int, TimeUnit, Event], None],
+    ) -> bool:
+        """Applies again the last undone edit. Returns False if there is
+        nothing to redo"""
+        if not self.__redo:
+            return False
+        operations = self.__redo.pop()
+        self.__replay(operations, add, remove)
+        self.__undo.append(operations)
+        self.__n_operations += len(operations)
+        self.__changed()
+        return True
@@ -123,14 +123,20 @@ Item {
     // Initialize a state, reading from the living LV2 process
     function init() {
         console.log("init");
-        let children = Utils.findChildren(root);
-        for (var i = 0; i < children.length; i++) {
-            let child = children[i];
-            if (child.saveState != undefined) {
-                let parameterName = Utils.objectId(child);
-                child.setFromLV2(lv2Host.getParameterValue(lv2Id, parameterName));
+        let children = [];
+        let parameterNames = [];
+        let allChildren = Utils.findChildren(root);
+        for (var i = 0; i < allChildren.length; i++) {
+            if (allChildren[i].saveState != undefined) {
+                children.push(allChildren[i]);
+                parameterNames.push(Utils.objectId(allChildren[i]));
             }
         }
+        // all the parameters are read in one call
+        let values = lv2Host.getParameters(lv2Id, parameterNames);
+        for (var i = 0; i < children.length; i++) {
+            children[i].setFromLV2(values[parameterNames[i]]);
+        }
 
         const raw_state = Qt.atob(lv2Host.custom_data(lv2Id, "http://lv2plug.in/ns/ext/atom#Chunk", "urn:juce:stateBinary"));
         if (raw_state) {
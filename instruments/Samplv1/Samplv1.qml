@@ -56,16 +56,22 @@ Item {
 
     function loadState(state) {
         _loadSample(state.sampleFileName);
+        let values = {};
         let children = Utils.findChildren(root);
         for (var i = 0; i < children.length; i++) {
             let child = children[i];
             if (child.parameterName != undefined) {
                 if (child.parameterName in state.parameters) {
                     child.value = state.parameters[child.parameterName];
+                    if (child.parameterName) {
+                        values[child.parameterName] = child.value;
+                    }
                     continue;
                 }
             }
         }
+        // all the parameters are sent in one call
+        lv2Host.setParameters(lv2Id, values);
     }
 
     // Initialize a state, reading from the living LV2 process
@@ -54,30 +54,40 @@ Item {
     }
 
     function loadState(state) {
+        let values = {};
         let children = Utils.findChildren(root);
         for (var i = 0; i < children.length; i++) {
             let child = children[i];
             if (child.parameterName != undefined) {
                 if (child.parameterName && child.parameterName in state.parameters) {
                     child.value = state.parameters[child.parameterName];
-                    lv2Host.setParameterValue(lv2Id, child.parameterName, child.value);
+                    values[child.parameterName] = child.value;
                     continue;
                 }
             }
         }
+        // all the parameters are sent in one call
+        lv2Host.setParameters(lv2Id, values);
     }
 
     // Initialize a state, reading from the living LV2 process
     function init() {
         console.log("synthv1 init");
 
-        let children = Utils.findChildren(root);
-        for (var i = 0; i < children.length; i++) {
-            let child = children[i];
-            if (child.parameterName) {
-                child.value = lv2Host.getParameterValue(lv2Id, child.parameterName);
+        let children = [];
+        let parameterNames = [];
+        let allChildren = Utils.findChildren(root);
+        for (var i = 0; i < allChildren.length; i++) {
+            if (allChildren[i].parameterName) {
+                children.push(allChildren[i]);
+                parameterNames.push(allChildren[i].parameterName);
             }
         }
+        // all the parameters are read in one call
+        let values = lv2Host.getParameters(lv2Id, parameterNames);
+        for (var i = 0; i < children.length; i++) {
+            children[i].value = values[parameterNames[i]];
+        }
     }
 
     /*Item {
@@ -42,12 +42,31 @@ Item {
                 infoScreen.flash(root.parameterDisplay + " = " + valueToString(amount));
                 if (root.parameterName) {
                     lv2Host.setParameterValue(lv2Id, root.parameterName, root.value);
+                    // recorded as automation of the voice being edited, if enabled
+                    if (gSequencer.recording) {
+                        let info = lv2Host.parameterInfo(lv2Id, root.parameterName);
+                        gSequencer.recordParameter(instrumentStack._currentVoice, root.parameterName, root.value,
+                                                   info.minimum, info.maximum);
+                    }
                 }
             }
         }
         enabled: root.visible && root.enabled
     }
 
+    // follow the changes made on the plugin side
+    Connections {
+        target: lv2Host
+        onParameterValueChanged: {
+            if ((lv2_id == lv2Id) && (parameter_name == root.parameterName)) {
+                root.value = value;
+                if (root.visible) {
+                    board.setKnobValue(root.knobNumber, fromParameter(value));
+                }
+            }
+        }
+    }
+
     function _initIfVisible() {
         if (visible) {
             board.setKnobIsInteger(root.knobNumber, root.isInteger);
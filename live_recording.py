@@ -0,0 +1,76 @@
+# Live recording of notes played during a playback
+from typing import Dict, List, Tuple
+
+from sequencer_engine import NoteEvent, TimeUnit
+
+NOTE_OFF = 0x80
+NOTE_ON = 0x90
+
+
+class NoteRecorder:
+    """
+    Builds NoteEvents from the note on and note off messages received while
+    a pattern is played.
+
+    Messages come with the position (loop iteration, time) they were played
+    at, so that notes held across the end of a looped pattern get the right
+    duration. If quantize is set, start times and durations are rounded to
+    this grid.
+    """
+
+    def __init__(
+        self, loop_start: TimeUnit, loop_stop: TimeUnit, quantize: TimeUnit = 0
+    ) -> None:
+        self.loop_start = loop_start
+        self.loop_length = loop_stop - loop_start
+        self.quantize = quantize
+        # note -> (position from the start of the playback, velocity)
+        self.__held: Dict[int, Tuple[float, int]] = {}
+
+    def __offset(self, loop_index: int, time: float) -> float:
+        return loop_index * self.loop_length + time - self.loop_start
+
+    def __note(self, start: float, end: float, note: int, velocity: int):
+        grid = self.quantize
+        duration = end - start
+        if grid:
+            start = round(start / grid) * grid
+            duration = max(grid, round(duration / grid) * grid)
+        else:
+            duration = max(1, round(duration))
+        if self.loop_length:
+            start %= self.loop_length
+        return (
+            TimeUnit(self.loop_start + round(start)),
+            NoteEvent(note, velocity, TimeUnit(duration)),
+        )
+
+    def message(
+        self, message: List[int], loop_index: int, time: float
+    ) -> List[Tuple[TimeUnit, NoteEvent]]:
+        """Handles a MIDI message and returns the (start time, NoteEvent) of
+        the note it ends, if any"""
+        if len(message) < 3:
+            return []
+        kind = message[0] & 0xF0
+        note, velocity = message[1], message[2]
+        offset = self.__offset(loop_index, time)
+        if kind == NOTE_ON and velocity > 0:
+            # a note played again before its release ends the previous one
+            notes = self.message([NOTE_OFF, note, 0], loop_index, time)
+            self.__held[note] = (offset, velocity)
+            return notes
+        if kind in (NOTE_ON, NOTE_OFF) and note in self.__held:
+            start, velocity = self.__held.pop(note)
+            return [self.__note(start, offset, note, velocity)]
+        return []
+
+    def flush(self, loop_index: int, time: float) -> List[Tuple[TimeUnit, NoteEvent]]:
+        """Ends the notes still held at the given position"""
+        offset = self.__offset(loop_index, time)
+        notes = [
+            self.__note(start, offset, note, velocity)
+            for note, (start, velocity) in self.__held.items()
+        ]
+        self.__held.clear()
+        return notes
@@ -15,7 +15,6 @@ from piano_roll import PianoRoll
 
 import rtmidi
 
-
 # from jalv2_host import JALVHost
 from carla_host import CarlaHost
 
@@ -114,6 +113,10 @@ class Utils(QObject):
 
 
 class StubHost(QObject):
+    parameterValueChanged = pyqtSignal(
+        str, str, float, arguments=["lv2_id", "parameter_name", "value"]
+    )
+
     def __init__(self, parent=None):
         super().__init__(parent)
 
@@ -143,6 +146,14 @@ class StubHost(QObject):
         # print(">>> getParameterValue", lv2_id, parameter_name, v)
         return v
 
+    @pyqtSlot(str, list, result=QVariant)
+    def getParameters(self, lv2_id, parameter_names):
+        return {name: self.getParameterValue(lv2_id, name) for name in parameter_names}
+
+    @pyqtSlot(str, QVariant)
+    def setParameters(self, lv2_id, values):
+        pass
+
     @pyqtSlot(str, int, int)
     def noteOn(self, lv2_id, note, velocity):
         print(">>> Note ON", lv2_id, note, velocity)
@@ -151,6 +162,15 @@ class StubHost(QObject):
     def noteOff(self, lv2_id, note):
         print(">>> Note OFF", lv2_id, note)
 
+    @pyqtSlot(list)
+    def sendNotes(self, notes):
+        for lv2_id, note, velocity in notes:
+            print(">>> Note", lv2_id, note, velocity)
+
+    @pyqtSlot(str, result=str)
+    def midiInputPort(self, lv2_id):
+        return ""
+
     @pyqtSlot(str, int)
     def set_program(self, lv2_id, program_id):
         pass
@@ -213,6 +233,12 @@ class MidiAPI(Enum):
 
 class Midi(QObject):
     midiReceived = pyqtSignal(QVariant, arguments=["message"])
+    # Message with the time it was received at, on the monotonic clock in ms
+    midiReceivedAt = pyqtSignal(list, float, arguments=["message", "time"])
+
+    # Message times are derived from the delta times of rtmidi, unless they
+    # drift from the time of the callback by more than this (in ms)
+    MAX_MIDI_LATENCY_MS = 50
 
     def __init__(self, api: MidiAPI, dev_pattern: str = None):
         super().__init__(None)
@@ -247,6 +273,8 @@ class Midi(QObject):
 
         self.__received_message = None
         self.__debug = False
+        # Time of the last message received, in ms
+        self.__last_message_ms = None
 
     def set_debug(self, debug):
         self.__debug = debug
@@ -256,10 +284,19 @@ class Midi(QObject):
 
     def __on_midi_msg(self, event, data=None):
         self.__received_message = event
-        msg, ts = event
+        msg, delta = event
+        # called from the thread of rtmidi: the time of the message is known
+        # before it crosses the Qt event loop
+        now = time.monotonic() * 1000
+        if self.__last_message_ms is not None:
+            message_ms = self.__last_message_ms + delta * 1000
+            if 0 <= now - message_ms <= self.MAX_MIDI_LATENCY_MS:
+                now = message_ms
+        self.__last_message_ms = now
         if self.__debug:
             print("MIDI Received", self.__to_hex(msg))
         self.midiReceived.emit(msg)
+        self.midiReceivedAt.emit(msg, now)
 
     @pyqtSlot(QVariant)
     def send_message(self, msg):
@@ -293,6 +330,19 @@ parser.add_argument(
     action="store_true",
     help="The MIDI device will be detected and configured at startup if set",
 )
+parser.add_argument(
+    "--lookahead",
+    type=int,
+    default=0,
+    help="Send sequencer events to JACK MIDI ports this many ms ahead of time "
+    "(frame accurate timing). 0 to disable",
+)
+parser.add_argument(
+    "--realtime-process",
+    action="store_true",
+    help="Run the sequencer playback in a dedicated real-time process "
+    "that sends notes to JACK MIDI ports",
+)
 
 args = parser.parse_args()
 
@@ -329,7 +379,13 @@ if args.init_dev:
 view.rootContext().setContextProperty("midi", midi)
 
 sequencer = QSequencer()
+if args.lookahead:
+    sequencer.setLookahead(args.lookahead)
+if args.realtime_process:
+    sequencer.setRealtimeProcess(True)
 view.rootContext().setContextProperty("gSequencer", sequencer)
+# notes are recorded with the time they were received at
+midi.midiReceivedAt.connect(sequencer.recordMidiMessage)
 
 qml_file = os.path.join(current_path, board_dir, "main.qml")
 view.setSource(QUrl.fromLocalFile(qml_file))
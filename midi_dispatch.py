@@ -0,0 +1,97 @@
+# Frame accurate MIDI output of the sequencer through JACK
+import heapq
+import threading
+from typing import Any, List, Tuple
+
+import jack
+
+NOTE_ON = 0x90
+NOTE_OFF = 0x80
+
+
+class JackMidiDispatcher:
+    """
+    Writes MIDI events to JACK output ports (one per voice) with a frame
+    accurate timestamp.
+
+    Events are queued ahead of time with a time expressed in ms since the
+    start of the playback. The JACK process callback then writes each event
+    in the period it belongs to, at the right frame offset, so that timing
+    does not depend on the Qt event loop.
+    """
+
+    def __init__(self, name: str = "NoisyQ sequencer", n_channels: int = 16):
+        self.__client = jack.Client(name)
+        self.__ports = [
+            self.__client.midi_outports.register("voice_{}".format(i))
+            for i in range(n_channels)
+        ]
+        # heap of (frame, sequence number, channel, midi bytes, payload)
+        self.__queue: List[Tuple[int, int, int, bytes, Any]] = []
+        self.__sequence = 0
+        self.__lock = threading.Lock()
+        # JACK frame that corresponds to the time origin of the playback
+        self.__origin_frame = 0
+        self.__client.set_process_callback(self.__process)
+        self.__client.activate()
+
+    def __process(self, n_frames: int) -> None:
+        """JACK process callback"""
+        for port in self.__ports:
+            port.clear_buffer()
+        start = self.__client.last_frame_time
+        end = start + n_frames
+        with self.__lock:
+            while self.__queue and self.__queue[0][0] < end:
+                frame, _, channel, data, _ = heapq.heappop(self.__queue)
+                # late events are sent at the beginning of the period
+                self.__ports[channel].write_midi_event(max(0, frame - start), data)
+
+    def __ms_to_frames(self, ms: float) -> int:
+        return int(ms * self.__client.samplerate / 1000)
+
+    def start(self, elapsed_ms: int) -> None:
+        """Anchors the time origin so that 'now' is elapsed_ms of playback.
+        One period is added so that events due now are not already late."""
+        self.__origin_frame = (
+            self.__client.frame_time
+            + self.__client.blocksize
+            - self.__ms_to_frames(elapsed_ms)
+        )
+
+    def schedule(self, ms: int, channel: int, data: bytes, payload: Any = None):
+        """Queues a MIDI message to be sent at the given playback time.
+        payload is returned by cancel() if the message has not been sent yet."""
+        frame = self.__origin_frame + self.__ms_to_frames(ms)
+        with self.__lock:
+            heapq.heappush(
+                self.__queue, (frame, self.__sequence, channel, data, payload)
+            )
+            self.__sequence += 1
+
+    def send_now(self, channel: int, data: bytes) -> None:
+        """Sends a MIDI message at the beginning of the next period"""
+        with self.__lock:
+            heapq.heappush(self.__queue, (0, self.__sequence, channel, data, None))
+            self.__sequence += 1
+
+    def cancel(self) -> List[Any]:
+        """Removes every pending scheduled message and returns their payloads,
+        in time order. Messages of send_now() are still sent"""
+        with self.__lock:
+            pending = sorted(m for m in self.__queue if m[4] is not None)
+            self.__queue = [m for m in self.__queue if m[4] is None]
+            heapq.heapify(self.__queue)
+        return [payload for _, _, _, _, payload in pending]
+
+    def connect(self, channel: int, port_name: str) -> None:
+        """Connects the output port of a voice to a MIDI input port"""
+        port = self.__ports[channel]
+        for connected in self.__client.get_all_connections(port):
+            self.__client.disconnect(port, connected)
+        if port_name:
+            self.__client.connect(port, port_name)
+
+    def close(self) -> None:
+        self.__client.deactivate()
+        self.__client.close()
@@ -0,0 +1,290 @@
+# Standard MIDI File import and export of the sequencer events
+import os
+import shutil
+import struct
+import tempfile
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+
+from arrangement import Arrangement
+from sequencer_engine import (
+    TIME_UNIT,
+    NoteEvent,
+    NoteOffEvent,
+    NoteOnEvent,
+    SequencerEngine,
+    TempoMap,
+    TimeUnit,
+)
+
+# MIDI ticks per quarter note: the time unit of the sequencer is used as is
+DIVISION = TIME_UNIT // 4
+# Tempo ramps are written as a tempo change every RAMP_STEP
+RAMP_STEP = DIVISION // 4
+# Number of MIDI messages read between two progress reports
+PROGRESS_INTERVAL = 4096
+
+
+def _variable_length(value: int) -> bytes:
+    """Encodes a delta time as a MIDI variable length quantity"""
+    data = [value & 0x7F]
+    value >>= 7
+    while value:
+        data.append(0x80 | (value & 0x7F))
+        value >>= 7
+    return bytes(reversed(data))
+
+
+class _Track:
+    """Track chunk data, spooled to a temporary file while it is written"""
+
+    def __init__(self) -> None:
+        self.file = tempfile.TemporaryFile()
+        self.last_time = 0
+        self.size = 0
+
+    def write(self, time: TimeUnit, data: bytes) -> None:
+        chunk = _variable_length(time - self.last_time) + data
+        self.file.write(chunk)
+        self.size += len(chunk)
+        self.last_time = time
+
+    def copy_to(self, fo: BinaryIO) -> None:
+        # end of track
+        self.write(self.last_time, b"\xff\x2f\x00")
+        fo.write(b"MTrk" + struct.pack(">I", self.size))
+        self.file.seek(0)
+        shutil.copyfileobj(self.file, fo)
+        self.file.close()
+
+
+def _tempo_times(
+    tempo_map: TempoMap, start_time: TimeUnit, stop_time: TimeUnit
+) -> List[TimeUnit]:
+    """Times between start_time and stop_time where the tempo must be written"""
+    times = {start_time}
+    previous = TimeUnit(0)
+    for time, _, ramp in tempo_map.changes():
+        if ramp:
+            times.update(range(previous, time, RAMP_STEP))
+        times.add(time)
+        previous = time
+    return sorted(time for time in times if start_time <= time < stop_time)
+
+
+def export_midi_file(
+    engine: SequencerEngine,
+    file_name: str,
+    bpm: float,
+    start_time: TimeUnit = 0,
+    stop_time: Optional[TimeUnit] = None,
+    n_loops: int = 1,
+    arrangement: Optional[Arrangement] = None,
+) -> None:
+    """
+    Writes the events between start_time and stop_time, repeated n_loops
+    times, to a format 1 Standard MIDI File, without playing them. If an
+    arrangement is given, its song is written instead of the pattern of
+    the engine.
+
+    The first track holds the tempo map, with bpm as its base tempo, and the
+    time signature, then each channel gets its own track. Like during a
+    playback, notes are cut at the end of each loop.
+    """
+    source = arrangement if arrangement is not None else engine
+    if stop_time is None:
+        stop_time = engine.max_time if arrangement is None else arrangement.length()
+    loop_length = stop_time - start_time
+
+    tracks: Dict[int, _Track] = {}
+    for loop in range(n_loops):
+        offset = loop * loop_length - start_time
+        for event_time, (channel, event) in source.iterate_scheduled_events(
+            start_time, stop_time
+        ):
+            if channel not in tracks:
+                tracks[channel] = _Track()
+            midi_channel = channel % 16
+            if isinstance(event, NoteOnEvent):
+                data = bytes((0x90 | midi_channel, event.note, event.velocity))
+            elif isinstance(event, NoteOffEvent):
+                event_time = min(event_time, stop_time)
+                data = bytes((0x80 | midi_channel, event.note, 0))
+            else:
+                continue
+            tracks[channel].write(event_time + offset, data)
+
+    number_of_notes, unit = engine.time_signature
+    tempo = _Track()
+    tempo.write(
+        0, bytes((0xFF, 0x58, 4, number_of_notes, unit.bit_length() - 1, 24, 8))
+    )
+    tempo_map = TempoMap(bpm, engine.tempo_map.changes())
+    tempo_times = _tempo_times(tempo_map, start_time, stop_time)
+    for loop in range(n_loops):
+        offset = loop * loop_length - start_time
+        last_tempo = None
+        for time in tempo_times:
+            # in microseconds per quarter note
+            midi_tempo = round(60_000_000 / tempo_map.bpm_at(time))
+            if midi_tempo != last_tempo:
+                tempo.write(
+                    time + offset, b"\xff\x51\x03" + midi_tempo.to_bytes(3, "big")
+                )
+                last_tempo = midi_tempo
+
+    with open(file_name, "wb") as fo:
+        fo.write(b"MThd" + struct.pack(">IHHH", 6, 1, len(tracks) + 1, DIVISION))
+        tempo.copy_to(fo)
+        for channel in sorted(tracks):
+            tracks[channel].copy_to(fo)
+
+
+class _ChunkReader:
+    """Reads the bytes of a chunk from a file, by blocks"""
+
+    BLOCK_SIZE = 65536
+
+    def __init__(self, fi: BinaryIO, length: int) -> None:
+        self.__fi = fi
+        self.__remaining = length
+        self.__block = b""
+        self.__pos = 0
+
+    def at_end(self) -> bool:
+        return self.__pos == len(self.__block) and self.__remaining == 0
+
+    def byte(self) -> int:
+        if self.__pos == len(self.__block):
+            if self.__remaining == 0:
+                raise ValueError("Truncated MIDI track")
+            self.__block = self.__fi.read(min(self.BLOCK_SIZE, self.__remaining))
+            if not self.__block:
+                raise ValueError("Truncated MIDI track")
+            self.__remaining -= len(self.__block)
+            self.__pos = 0
+        b = self.__block[self.__pos]
+        self.__pos += 1
+        return b
+
+    def variable_length(self) -> int:
+        value = 0
+        while True:
+            b = self.byte()
+            value = (value << 7) | (b & 0x7F)
+            if not b & 0x80:
+                return value
+
+    def skip(self, length: int) -> None:
+        for _ in range(length):
+            self.byte()
+
+
+def _read_track(reader: _ChunkReader) -> Iterator[Tuple[int, int, int, int]]:
+    """Yields the (tick, status, data1, data2) of the note on and note off
+    messages of a track, then (tick, 0, 0, 0) at the end of the track. Other
+    messages are skipped"""
+    tick = 0
+    status = 0
+    while not reader.at_end():
+        tick += reader.variable_length()
+        b = reader.byte()
+        if b == 0xFF:
+            # meta event, it cancels the running status
+            status = 0
+            reader.byte()
+            reader.skip(reader.variable_length())
+            continue
+        if b in (0xF0, 0xF7):
+            # sysex, it cancels the running status
+            status = 0
+            reader.skip(reader.variable_length())
+            continue
+        if b & 0x80:
+            status = b
+            data1 = reader.byte()
+        elif status:
+            # running status
+            data1 = b
+        else:
+            raise ValueError("MIDI data byte without status")
+        kind = status & 0xF0
+        if kind in (0xC0, 0xD0):
+            continue
+        data2 = reader.byte()
+        if kind in (0x80, 0x90):
+            yield tick, status, data1, data2
+    yield tick, 0, 0, 0
+
+
+def read_midi_file(
+    file_name: str,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> Iterator[Tuple[int, TimeUnit, NoteEvent]]:
+    """
+    Yields the notes of a Standard MIDI File as (MIDI channel, start time,
+    NoteEvent), track by track.
+
+    The file is read by blocks and each track is parsed as a stream: only
+    the notes still sounding are kept, so that memory does not grow with the
+    size of the file. Ticks are converted to the time unit of the sequencer
+    and tempo changes are ignored. progress(bytes read, file size) is called
+    regularly. A file that is not a valid MIDI file raises ValueError.
+    """
+    file_size = os.path.getsize(file_name)
+    with open(file_name, "rb") as fi:
+        header = fi.read(14)
+        if len(header) < 14 or header[:4] != b"MThd":
+            raise ValueError("{} is not a MIDI file".format(file_name))
+        length, _, _, division = struct.unpack(">IHHH", header[4:])
+        if length < 6:
+            raise ValueError("Invalid MIDI file header")
+        fi.seek(length - 6, os.SEEK_CUR)
+        if division & 0x8000:
+            raise ValueError("SMPTE time division is not supported")
+
+        def to_time(tick: int) -> TimeUnit:
+            return TimeUnit(round(tick * DIVISION / division))
+
+        while True:
+            header = fi.read(8)
+            if not header:
+                break
+            if len(header) < 8:
+                raise ValueError("Truncated MIDI chunk header")
+            chunk_type, length = struct.unpack(">4sI", header)
+            if chunk_type != b"MTrk":
+                fi.seek(length, os.SEEK_CUR)
+                continue
+            # (channel, note) -> list of (start tick, velocity)
+            sounding: Dict[Tuple[int, int], List[Tuple[int, int]]] = {}
+            tick = 0
+            for n, (tick, status, note, velocity) in enumerate(
+                _read_track(_ChunkReader(fi, length))
+            ):
+                if progress is not None and n % PROGRESS_INTERVAL == 0:
+                    progress(fi.tell(), file_size)
+                if status == 0:
+                    # end of the track
+                    break
+                channel = status & 0x0F
+                if status & 0xF0 == 0x90 and velocity > 0:
+                    sounding.setdefault((channel, note), []).append((tick, velocity))
+                    continue
+                started = sounding.get((channel, note))
+                if not started:
+                    continue
+                # the oldest note is released first
+                start_tick, start_velocity = started.pop(0)
+                if not started:
+                    del sounding[(channel, note)]
+                start = to_time(start_tick)
+                duration = max(1, to_time(tick) - start)
+                yield channel, start, NoteEvent(note, start_velocity, duration)
+            # notes never released last until the end of the track
+            for (channel, note), started in sounding.items():
+                for start_tick, start_velocity in started:
+                    start = to_time(start_tick)
+                    duration = max(1, to_time(tick) - start)
+                    yield channel, start, NoteEvent(note, start_velocity, duration)
+            if progress is not None:
+                progress(fi.tell(), file_size)
@@ -363,8 +363,9 @@ class PianoRoll(QQuickPaintedItem):
         dark_selected = QBrush(QColor("#ebde34"))  # HSV 56°, 78%, 92%
         painter.setPen(no_pen)
         stop = self._offset + steps_per_screen * TIME_UNIT
-        for event in self._sequencer.list_events(self._offset, stop):
-            if event["channel"] != self._channel:
+        for event in self._sequencer.list_events(self._offset, stop, self._channel):
+            # automation breakpoints are not drawn
+            if event["event"]["event_type"] != "note_event":
                 continue
             note = event["event"]["note"]
             if note - self._note_offset < 0:
@@ -1,6 +1,6 @@
 # Qt interface to sequencer
-from enum import Enum
-from typing import Any, Iterator, List, Optional, Set, Tuple, TypeVar, Generic
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
 
 from PyQt5.QtCore import (
     pyqtSignal,
@@ -8,270 +8,24 @@ from PyQt5.QtCore import (
     pyqtProperty,
     QObject,
     QTimer,
-    QElapsedTimer,
     QVariant,
 )
 from PyQt5.QtWidgets import QApplication
 from PyQt5.QtQml import QJSValue, QJSEngine
-from sortedcontainers import SortedList  # type: ignore
-
-TimeUnit = int
-
-# smallest time: 1/256
-TIME_UNIT = 256
-
-
-class ScheduledEvent:
-    """
-    A ScheduledEvent is a concrete event that can be
-    sent to instruments. It is closed to MIDI events.
-    """
-
-    def __init__(self, time: TimeUnit):
-        self.time = time
-
-
-class NoteOnEvent(ScheduledEvent):
-    def __init__(self, time: TimeUnit, note: int, velocity: int) -> None:
-        super().__init__(time)
-        self.note = note
-        self.velocity = velocity
-
-    def __repr__(self):
-        return "@{} - NOTE ON({}, {})".format(self.time, self.note, self.velocity)
-
-
-class NoteOffEvent(ScheduledEvent):
-    def __init__(self, time: TimeUnit, note: int) -> None:
-        super().__init__(time)
-        self.note = note
-
-    def __repr__(self):
-        return "@{} - NOTE OFF({})".format(self.time, self.note)
-
-
-class StopEvent(ScheduledEvent):
-    def __init__(self, time: TimeUnit) -> None:
-        super().__init__(time)
-
-    def __repr__(self):
-        return "@{} - STOP".format(self.time)
-
-
-class Event:
-    """
-    An Event is a high-level event manipulated by the user
-    in an editor and may be different from a ScheduledEvent.
-    For example a NoteEvent will lead to two ScheduledEvents
-    (a NoteOn followed by a NoteOff)
-    """
-
-    def schedule(self, start_time: TimeUnit) -> List[ScheduledEvent]:
-        """
-        Returns a list of ScheduledEvent
-        """
-        return []
-
-    def to_dict(self):
-        raise NotImplementedError
-
-    @classmethod
-    def from_dict(cls, d: dict) -> "Event":
-        if d.get("event_type") == "note_event":
-            return NoteEvent(
-                d["note"],
-                d["velocity"],
-                TimeUnit(d["duration"]),
-            )
-        return Event()
-
-
-class NoteEvent(Event):
-    def __init__(self, note: int, velocity: int, duration: TimeUnit):
-        self.note = note
-        self.velocity = velocity
-        self.duration = duration
-
-    def __repr__(self):
-        return "(N={}, V={}, D={})".format(self.note, self.velocity, self.duration)
-
-    def __eq__(self, other):
-        return (
-            self.note == other.note
-            and self.velocity == other.velocity
-            and self.duration == other.duration
-        )
-
-    def schedule(self, start_time: TimeUnit) -> List[ScheduledEvent]:
-        return [
-            NoteOnEvent(start_time, self.note, self.velocity),
-            NoteOffEvent(start_time + self.duration, self.note),
-        ]
-
-    def to_dict(self):
-        return {
-            "event_type": "note_event",
-            "note": self.note,
-            "velocity": self.velocity,
-            "duration": self.duration,
-        }
-
-
-class ParameterEvent(Event):
-    # TODO
-    pass
-
-
-class ChannelEvent:
-    """
-    A simple channel + Event wrapper
-    """
-
-    def __init__(self, channel: int, event: Event) -> None:
-        self.channel = channel
-        self.event = event
-
-    def __repr__(self):
-        return "ChannelEvent(channel={},event={})".format(self.channel, self.event)
-
-    def __eq__(self, other):
-        return self.channel == other.channel and self.event == other.event
-
-
-T = TypeVar("T")
-
-
-class EventList(Generic[T]):
-    """A list of events, indexed by time"""
-
-    def __init__(self) -> None:
-        # Events are stored in a SortedList that contains a Tuple[TimeUnit, T]
-        self.__events = SortedList(key=lambda x: x[0])
-
-    def add_event(self, event: T, start_time: TimeUnit) -> None:
-        self.__events.add((start_time, event))
-
-    def remove_event(self, event: T, start_time: TimeUnit) -> None:
-        self.__events.remove((start_time, event))
-
-    def __iter__(self) -> Iterator[Tuple[TimeUnit, T]]:
-        return self.__events.__iter__()
-
-    def irange(
-        self,
-        min_time: TimeUnit,
-        max_time: TimeUnit,
-        inclusive=(True, True),
-        reverse=False,
-    ):
-        return self.__events.irange(
-            (min_time, None), (max_time, None), inclusive, reverse
-        )
-
-    def __repr__(self):
-        return repr(self.__events)
-
-
-class State(Enum):
-    STOPPED = 0
-    PLAYING = 1
-    PAUSED = 2
-
-
-class ChronoMeter(QObject):
-    """
-    A chronometer can be started, paused, resumed and stopped.
-    It displays (here through elapsed()) the cumulative elasped time.
-
-    It can also trigger a signal after some given time, like a QTimer,
-    but with the ability to pause it.
-    """
-
-    timeout = pyqtSignal()
-
-    def __init__(self, parent=None):
-        super().__init__(parent)
-        self.__elapsed = 0
-        self.__etimer = QElapsedTimer()
-        self.__state = State.STOPPED
-
-        self.__timer = QTimer(self)
-        self.__timer.setSingleShot(True)
-        # forward the internal timeout
-        self.__timer.timeout.connect(self.__on_timeout)
-        self.__interval = 0
-        self.__single_shot = False
-
-    @pyqtSlot(result=bool)
-    def isSingleShot(self):
-        return self.__single_shot
-
-    @pyqtSlot(bool)
-    def setSingleShot(self, s):
-        self.__single_shot = s
-
-    @pyqtSlot(result=int)
-    def interval(self):
-        return self.__interval
-
-    @pyqtSlot(int)
-    def setInterval(self, n_interval):
-        self.__interval = n_interval
-
-    def __on_timeout(self):
-        """Called when the internal timer times out"""
-        if self.__single_shot:
-            self.__state = State.STOPPED
-        else:
-            # rearm
-            self.__timer.setInterval(self.__interval)
-            self.__timer.start()
-        self.timeout.emit()
-
-    @pyqtSlot()
-    def start(self):
-        if self.__state == State.STOPPED:
-            # print("interval", self.__interval)
-            self.__timer.setInterval(self.__interval)
-
-        if self.__state != State.PLAYING:
-            self.__etimer.start()
-            self.__timer.start()
-            self.__state = State.PLAYING
-
-    @pyqtSlot()
-    def stop(self):
-        self.__elapsed = 0
-        self.__etimer.invalidate()
-        self.__timer.stop()
-        self.__state = State.STOPPED
-
-    @pyqtSlot()
-    def pause(self):
-        if self.__state == State.PLAYING:
-            # pause
-            self.__elapsed += self.__etimer.elapsed()
-            self.__etimer.invalidate()
-            # the timer is stopped before the timeout,
-            self.__timer.setInterval(self.__timer.remainingTime())
-            self.__timer.stop()
-
-            self.__state = State.PAUSED
-
-    @pyqtSlot()
-    def elapsed(self) -> int:
-        """
-        Returns the accumulated elapsed time (in ms) since the last restart.
-        The accumulated time does not include time spent during pauses.
-        """
-        if self.__etimer.isValid():
-            return self.__elapsed + self.__etimer.elapsed()
-        else:
-            return self.__elapsed
-
-    def is_playing(self):
-        return self.__state == State.PLAYING
 
+from arrangement import Arrangement, Pattern, Placement
+from automation_recording import AutomationRecorder
+from edit_history import ADD, REMOVE, EditHistory
+from live_recording import NoteRecorder
+from sequencer_engine import (
+    TIME_UNIT,
+    Event,
+    NoteEvent,
+    ScheduledEvent,
+    SequencerEngine,
+    State,
+    TimeUnit,
+)
 
 ScheduledEventWithChannel = Tuple[int, ScheduledEvent]
 
@@ -279,60 +33,99 @@ ScheduledEventWithChannel = Tuple[int, ScheduledEvent]
 class QSequencer(QObject):
 
     """
+    Qt adapter of a SequencerEngine: slots for QML and timers that
+    drive the playback.
+
     1 step = 1 quarter note
     """
 
-    noteOn = pyqtSignal(int, int, int, arguments=["channel", "note", "velocity"])
-    noteOff = pyqtSignal(int, int, arguments=["channel", "note"])
+    # Notes to play at the same time, as a list of [channel, note, velocity].
+    # A velocity of 0 means note off
+    notes = pyqtSignal(list, arguments=["notes"])
     step = pyqtSignal(int, arguments=["step"])
     time_signature_set = pyqtSignal(
         int, int, arguments=["number_of_notes", "note_unit"]
     )
-
-    def __init__(self, parent=None):
+    # Values of automated plugin parameters, as a list of
+    # [channel, parameter name, value], at most once per control tick
+    parameters = pyqtSignal(list, arguments=["parameters"])
+    # Emitted when undo or redo become available or unavailable
+    historyChanged = pyqtSignal()
+    # Progress of a MIDI file import, in percent
+    importProgress = pyqtSignal(int, arguments=["percent"])
+
+    def __init__(self, parent=None, engine: Optional[SequencerEngine] = None):
         super().__init__(parent)
-        self.__events = EventList[Event]()
+        self.__engine = engine if engine is not None else SequencerEngine()
+        # Undo/redo journal of the event edits
+        self.__history = EditHistory(on_change=self.historyChanged.emit)
+        # Song made of placements of stored patterns
+        self.__arrangement = Arrangement()
 
+        # Timer armed on the next events
         self.__timer = QTimer()
         self.__timer.setSingleShot(True)
         self.__timer.timeout.connect(self.__on_timeout)
 
-        # Main chrono for events
-        self.__chrono = ChronoMeter()
-        # Second chrono, with fixed interval for UI update
-        self.__step_chrono = ChronoMeter()
-        self.__step_chrono.setSingleShot(False)
-        # Time signature
-        # self.steps_per_bar = 4
-        # self.__step_unit = 4  # quarter note (noire)
-        self.__time_signature = (4, 4)
-        # Current step
-        self.__step_number = 0
-        self.__step_chrono.timeout.connect(self._on_step_timeout)
-
-        # Length, in bars
-        self.__n_bars = 2
-
-        # Time after pause and before the next note
-        self.__remaining_time_after_pause = 0
-        self.__scheduled_events: EventList[ScheduledEventWithChannel]
-        self.__current_events = None
-        # Number of beats per minute for the quarter note
-        self.__bpm = 120
-
-        self.__looped = None
-
-        self.__state = State.STOPPED
-
-        # Notes that are being played, so that stop can stop them all
-        self.__sustained_notes: Set[Tuple[int, int]] = set()
+        # Timer armed on the next step boundary, for UI update
+        self.__step_timer = QTimer()
+        self.__step_timer.setSingleShot(True)
+        self.__step_timer.timeout.connect(self._on_step_timeout)
+
+        # Lookahead window, in ms. When > 0, events are sent ahead of time
+        # to a JackMidiDispatcher with a frame accurate timestamp instead
+        # of being emitted through the notes signal
+        self.__lookahead = 0
+        self.__dispatcher = None
+        # Depth of the edits that took back the lookahead, see __playback_edit
+        self.__edit_depth = 0
+        self.__lookahead_timer = QTimer()
+        self.__lookahead_timer.timeout.connect(self.__fill_lookahead)
+        # channel -> MIDI input port the channel must be connected to
+        self.__channel_ports: Dict[int, str] = {}
+
+        # When set, the playback runs in a SequencerProcess that gets a copy of
+        # every edit. The local engine is then only used for queries
+        self.__process = None
+        self.__feedback_timer = QTimer()
+        self.__feedback_timer.setInterval(10)
+        self.__feedback_timer.timeout.connect(self.__poll_process)
+
+        # One timer evaluates every automation lane at the control rate
+        self.__control_timer = QTimer()
+        self.__control_timer.timeout.connect(self.__on_control_timeout)
+
+        # Parameter values received while playing are recorded as automation
+        # when set. A recording take is one undo level
+        self.__recorder: Optional[AutomationRecorder] = None
+        self.__recording_take = False
+        # (channel, parameter) -> time of the last breakpoint recorded in the take
+        self.__last_recorded: Dict[Tuple[int, str], TimeUnit] = {}
+        # Channel notes received while playing are recorded to, if any, and
+        # quantization grid. Recorded notes are added by batches
+        self.__live_channel: Optional[int] = None
+        self.__live_quantize = TimeUnit(0)
+        self.__note_recorder: Optional[NoteRecorder] = None
+        self.__recorded_notes: List[Tuple[int, TimeUnit, Event]] = []
+        self.__record_timer = QTimer()
+        self.__record_timer.setSingleShot(True)
+        self.__record_timer.setInterval(50)
+        self.__record_timer.timeout.connect(self.__add_recorded_notes)
+
+    @property
+    def engine(self) -> SequencerEngine:
+        return self.__engine
 
     def _on_step_timeout(self):
-        self.__step_number += 1
-        self.step.emit(self.__step_number)
+        step_number, delay = self.__engine.step()
+        self.__step_timer.start(delay)
+        self.step.emit(step_number)
 
     def _add_event(self, channel: int, start_time: TimeUnit, event: Event) -> None:
-        self.__events.add_event(ChannelEvent(channel, event), start_time)
+        self.__engine.add_event(channel, start_time, event)
+        if self.__process is not None:
+            self.__process.add_event(channel, start_time, event)
+        self.__history.record(ADD, channel, start_time, event)
 
     @pyqtSlot(int, int, QVariant)
     def add_event(
@@ -344,14 +137,107 @@ class QSequencer(QObject):
         event = Event.from_dict(event_dict.toVariant())
         self._add_event(channel, TimeUnit(start_time), event)
 
+    @contextmanager
+    def __playback_edit(self, notes: bool = True) -> Iterator[None]:
+        """Takes back the events not sent yet during an edit, so that removed
+        notes are not played, and schedules them again after it. Edits can be
+        nested, the outermost one takes back the lookahead once. Edits of
+        automation only (notes False) do not touch the lookahead"""
+        refill = (
+            notes
+            and self.__edit_depth == 0
+            and self.__lookahead
+            and self.__process is None
+            and self.__engine.state == State.PLAYING
+        )
+        if refill:
+            self.__engine.rewind(self.__dispatcher.cancel())
+        self.__edit_depth += 1
+        try:
+            yield
+        finally:
+            self.__edit_depth -= 1
+            if refill:
+                self.__fill_lookahead()
+
     def _remove_event(self, channel: int, start_time: TimeUnit, event: Event) -> None:
-        self.__events.remove_event(ChannelEvent(channel, event), start_time)
+        with self.__playback_edit(isinstance(event, NoteEvent)):
+            notes = self.__engine.remove_event(channel, start_time, event)
+            if self.__process is not None:
+                self.__process.remove_event(channel, start_time, event)
+            self.__history.record(REMOVE, channel, start_time, event)
+            # the note off of a note being played is removed with it
+            self.__send_notes(notes)
 
     @pyqtSlot(int, int, QVariant)
     def remove_event(self, channel: int, start_time: int, event_dict) -> None:
         event = Event.from_dict(event_dict.toVariant())
         self._remove_event(channel, TimeUnit(start_time), event)
 
+    @staticmethod
+    def __unpack_note_events(
+        channels: list,
+        times: list,
+        notes: list,
+        velocities: list,
+        durations: list,
+    ) -> List[Tuple[int, TimeUnit, Event]]:
+        """Converts parallel arrays coming from QML into (channel, time, event)"""
+        return [
+            (
+                int(channel),
+                TimeUnit(time),
+                NoteEvent(int(note), int(velocity), TimeUnit(duration)),
+            )
+            for channel, time, note, velocity, duration in zip(
+                channels, times, notes, velocities, durations
+            )
+        ]
+
+    def _add_events(self, events: List[Tuple[int, TimeUnit, Event]]) -> None:
+        self.__engine.add_events(events)
+        if self.__process is not None:
+            for channel, start_time, event in events:
+                self.__process.add_event(channel, start_time, event)
+        with self.__history.edit():
+            for channel, start_time, event in events:
+                self.__history.record(ADD, channel, start_time, event)
+
+    @pyqtSlot(list, list, list, list, list)
+    def add_events(self, channels, times, notes, velocities, durations) -> None:
+        """Adds note events given as parallel arrays, in one call and one bulk
+        insertion. Useful to load a pattern"""
+        self._add_events(
+            self.__unpack_note_events(channels, times, notes, velocities, durations)
+        )
+
+    @pyqtSlot(list, list, list, list, list)
+    def remove_events(self, channels, times, notes, velocities, durations) -> None:
+        """Removes note events given as parallel arrays"""
+        with self.__history.edit(), self.__playback_edit():
+            for channel, start_time, event in self.__unpack_note_events(
+                channels, times, notes, velocities, durations
+            ):
+                self._remove_event(channel, start_time, event)
+
+    @pyqtSlot(int, list, list, list, list)
+    def replace_channel_events(self, channel, times, notes, velocities, durations):
+        """Replaces every event of a channel by the note events given as
+        parallel arrays"""
+        with self.__history.edit(), self.__playback_edit():
+            for _, start_time, event in self.__engine.iterate_all_events(channel):
+                if isinstance(event, NoteEvent):
+                    self.__history.record(REMOVE, channel, start_time, event)
+            released = self.__engine.remove_channel(channel)
+            if self.__process is not None:
+                self.__process.remove_channel(channel)
+            self.__send_notes(released)
+            self._add_events(
+                self.__unpack_note_events(
+                    [channel] * len(times), times, notes, velocities, durations
+                )
+            )
+
     @pyqtSlot(int, int, int)
     def remove_events_in_range(
         self,
@@ -359,92 +245,129 @@ class QSequencer(QObject):
         start_time: int,
         end_time: int,
     ):
-        to_remove = []
-        start_time = TimeUnit(start_time)
-        for event_channel, event_time, event in self.iterate_events(
-            start_time, TimeUnit(end_time)
-        ):
-            if event_channel == channel:
-                to_remove.append((channel, event_time, event))
-        for channel, start_time, event in to_remove:
-            self._remove_event(channel, start_time, event)
+        with self.__history.edit():
+            for _, event_time, event in self.iterate_events(
+                TimeUnit(start_time), TimeUnit(end_time), channel
+            ):
+                if isinstance(event, NoteEvent):
+                    self.__history.record(REMOVE, channel, event_time, event)
+        with self.__playback_edit():
+            notes = self.__engine.remove_events_in_range(
+                channel, TimeUnit(start_time), TimeUnit(end_time)
+            )
+            if self.__process is not None:
+                self.__process.remove_events_in_range(channel, start_time, end_time)
+            self.__send_notes(notes)
+
+    @pyqtSlot()
+    def undo(self) -> None:
+        """Reverts the last edit of the events"""
+        with self.__playback_edit():
+            self.__history.undo(self._add_event, self._remove_event)
+
+    @pyqtSlot()
+    def redo(self) -> None:
+        with self.__playback_edit():
+            self.__history.redo(self._add_event, self._remove_event)
+
+    @pyqtSlot()
+    def beginEdit(self) -> None:
+        """Groups the next edits into one undo level, until endEdit()"""
+        self.__history.begin()
+
+    @pyqtSlot()
+    def endEdit(self) -> None:
+        self.__history.end()
+
+    @pyqtProperty(bool, notify=historyChanged)
+    def can_undo(self) -> bool:
+        return self.__history.can_undo()
+
+    @pyqtProperty(bool, notify=historyChanged)
+    def can_redo(self) -> bool:
+        return self.__history.can_redo()
 
     @pyqtProperty(int)
     def n_bars(self) -> int:
-        return self.__n_bars
+        return self.__engine.n_bars
 
     @pyqtProperty(int)
     def n_steps(self) -> int:
-        return self.__n_bars * self.__time_signature[0] * 256 / self.__time_signature[1]
+        number_of_notes, unit = self.__engine.time_signature
+        return self.__engine.n_bars * number_of_notes * 256 / unit
 
     @n_bars.setter
     def n_bars(self, n_bars: int) -> None:
-        self.__n_bars = n_bars
+        self.__engine.n_bars = n_bars
+        if self.__process is not None:
+            self.__process.set_n_bars(n_bars)
 
     @pyqtProperty(int)
     def bpm(self) -> int:
-        return self.__bpm
+        return self.__engine.bpm
 
     @pyqtSlot(int, int)
     def setTimeSignature(self, number_of_notes, unit):
-        self.__time_signature = (number_of_notes, unit)
+        self.__engine.time_signature = (number_of_notes, unit)
+        self.__arrangement.time_signature = (number_of_notes, unit)
+        if self.__process is not None:
+            self.__process.set_time_signature(number_of_notes, unit)
         self.time_signature_set.emit(number_of_notes, unit)
 
     def time_signature(self) -> Tuple[int]:
-        return self.__time_signature
+        return self.__engine.time_signature
+
+    @pyqtSlot(int, float, bool)
+    def setTempoChange(self, time: int, bpm: float, ramp: bool) -> None:
+        """Changes the tempo at a given time. With ramp, the tempo goes
+        linearly from the previous change to this one. A change at time 0
+        replaces the tempo given to play()"""
+        self.__engine.set_tempo_change(TimeUnit(time), bpm, ramp)
+        if self.__process is not None:
+            self.__process.set_tempo_change(TimeUnit(time), bpm, ramp)
+
+    @pyqtSlot(int)
+    def removeTempoChange(self, time: int) -> None:
+        self.__engine.remove_tempo_change(TimeUnit(time))
+        if self.__process is not None:
+            self.__process.remove_tempo_change(TimeUnit(time))
+
+    @pyqtSlot()
+    def clearTempoChanges(self) -> None:
+        self.__engine.clear_tempo_changes()
+        if self.__process is not None:
+            self.__process.clear_tempo_changes()
 
     def iterate_events(
         self,
         start_time: Optional[TimeUnit] = None,
         stop_time: Optional[TimeUnit] = None,
+        channel: Optional[int] = None,
     ) -> Iterator[Tuple[int, TimeUnit, Event]]:
-        # iterate events, by advancing time
-        # max_time = TimeUnit(
-        #    self.__n_steps * self.steps_per_bar * TIME_UNIT / self.__step_unit
-        # )
-        max_time = TimeUnit(
-            self.__n_bars
-            * self.__time_signature[0]
-            * TIME_UNIT
-            / self.__time_signature[1]
-        )
-        if stop_time is None or stop_time > max_time:
-            stop_time = max_time
-        for event_time, ch_event in self.__events.irange(
-            start_time, stop_time, inclusive=[True, False]
-        ):
-            yield ch_event.channel, event_time, ch_event.event
+        """Iterates over events between start_time and stop_time,
+        of all channels or of the given channel"""
+        return self.__engine.iterate_events(start_time, stop_time, channel)
 
     def iterate_scheduled_events(
         self,
         start_time: Optional[TimeUnit] = None,
         stop_time: Optional[TimeUnit] = None,
         add_stop_event: bool = False,
-    ) -> Iterator[Tuple[TimeUnit, Tuple[int, ScheduledEvent]]]:
-        # First schedule events to obtain ScheduleEvents
-        scheduled_events = EventList[ScheduledEventWithChannel]()
-
-        for channel, event_time, event in self.iterate_events(start_time, stop_time):
-            events = event.schedule(event_time)
-            for e in events:
-                scheduled_events.add_event((channel, e), e.time)
-
-        # Then iterate over the list of scheduled events
-        for event_time, ee in scheduled_events:
-            # print("Adding event @{} {}".format(event_time, ee))
-            yield event_time, ee
-
-        if stop_time and add_stop_event:
-            # print("Adding stop event @{} {}".format(stop_time, StopEvent(stop_time)))
-            for channel in range(16):
-                yield stop_time, (channel, StopEvent(stop_time))
+    ) -> Iterator[Tuple[TimeUnit, ScheduledEventWithChannel]]:
+        """Yields the ScheduledEvents of the events between start_time and
+        stop_time, by time"""
+        return self.__engine.iterate_scheduled_events(
+            start_time, stop_time, add_stop_event
+        )
 
+    @pyqtSlot(int, int, int, result=list)
     @pyqtSlot(int, int, result=list)
     @pyqtSlot(result=list)
     def list_events(
         self,
         start_time: Optional[int] = None,
         stop_time: Optional[int] = None,
+        channel: Optional[int] = None,
     ):
         start = TimeUnit(start_time) if start_time is not None else None
         stop = TimeUnit(stop_time) if stop_time is not None else None
@@ -454,154 +377,506 @@ class QSequencer(QObject):
                 "time": event_time,
                 "event": event.to_dict(),
             }
-            for channel, event_time, event in self.iterate_events(start, stop)
+            for channel, event_time, event in self.iterate_events(start, stop, channel)
         ]
 
     @pyqtSlot(int, int, result=QVariant)
-    def get_event(self, channel: int, time: int):
-        # FIXME get_events ??
-        for e_channel, event_time, event in self.iterate_events(TimeUnit(time)):
-            if channel == e_channel and event_time == TimeUnit(time):
-                return event.to_dict()
-
-        return None
+    @pyqtSlot(int, int, int, result=QVariant)
+    def get_event(self, channel: int, time: int, note: Optional[int] = None):
+        """Returns the event of a channel at a given time.
+        If note is given, the event is looked up in the (channel, time, note) index
+        """
+        event = self.__engine.get_event(channel, TimeUnit(time), note)
+        return event.to_dict() if event is not None else None
 
     @pyqtSlot(int, int, QVariant)
-    def set_event(self, channel: int, time: int, event):
-        # FIXME set_events ??
-        for evt in self.__events.get(TimeUnit(time_amount), []):
-            if evt.channel == channel:
-                evt.event = Event.from_dict(event.toVariant())
+    def set_event(self, channel: int, time: int, event_dict):
+        """Replaces the event with the same (channel, time, note) by a new one,
+        or adds it if there is none"""
+        event = Event.from_dict(event_dict.toVariant())
+        start_time = TimeUnit(time)
+        replaced = self.__engine.get_event(channel, start_time, event.key())
+        with self.__playback_edit(isinstance(event, NoteEvent)):
+            notes = self.__engine.set_event(channel, start_time, event)
+            if self.__process is not None:
+                self.__process.set_event(channel, start_time, event)
+            with self.__history.edit():
+                if replaced is not None:
+                    self.__history.record(REMOVE, channel, start_time, replaced)
+                self.__history.record(ADD, channel, start_time, event)
+            self.__send_notes(notes)
+
+    @pyqtSlot(str, int, int, int, int)
+    def exportMidiFile(
+        self, file_name: str, bpm: int, start_time: int, stop_time: int, n_loops: int
+    ) -> None:
+        """Writes the pattern between start_time and stop_time, repeated n_loops
+        times, to a Standard MIDI File, with one track per channel"""
+        from midi_file import export_midi_file
+
+        export_midi_file(
+            self.__engine,
+            file_name,
+            bpm,
+            TimeUnit(start_time),
+            TimeUnit(stop_time),
+            n_loops,
+        )
+
+    @pyqtSlot(str, int)
+    def importMidiFile(self, file_name: str, channel: int) -> None:
+        """Adds the notes of a Standard MIDI File, in one bulk insertion.
+        Notes go to the channel of their MIDI channel, or all to the given
+        channel if it is not -1"""
+        from midi_file import read_midi_file
+
+        def progress(done: int, total: int) -> None:
+            self.importProgress.emit(done * 100 // total)
+
+        self._add_events(
+            [
+                (midi_channel if channel == -1 else channel, start_time, event)
+                for midi_channel, start_time, event in read_midi_file(
+                    file_name, progress
+                )
+            ]
+        )
+        self.importProgress.emit(100)
+
+    @pyqtSlot(str, int, int)
+    def storePattern(self, name: str, start_time: int, stop_time: int) -> None:
+        """Stores the events between start_time and stop_time as a pattern of
+        the song, replacing the pattern of the same name"""
+        pattern = Pattern(TimeUnit(stop_time - start_time))
+        for channel, event_time, event in self.iterate_events(
+            TimeUnit(start_time), TimeUnit(stop_time)
+        ):
+            pattern.add_event(channel, event_time - start_time, event)
+        self.__arrangement.set_pattern(name, pattern)
+
+    @pyqtSlot(str)
+    def removePattern(self, name: str) -> None:
+        """Removes a pattern and its placements from the song"""
+        self.__arrangement.remove_pattern(name)
+
+    @pyqtSlot(str, int, QVariant, int, result=int)
+    def addPlacement(self, name: str, start_bar: int, channel_map, transpose: int):
+        """Plays a pattern from a bar of the song. channel_map maps channels of
+        the pattern to other channels. Returns the index of the placement, -1
+        if the pattern does not exist"""
+        if name not in self.__arrangement.patterns:
+            print("** cannot place unknown pattern", name)
+            return -1
+        channel_map = channel_map.toVariant() or {}
+        return self.__arrangement.add_placement(
+            Placement(
+                name,
+                start_bar,
+                {int(k): int(v) for k, v in channel_map.items()},
+                transpose,
+            )
+        )
+
+    @pyqtSlot(int)
+    def removePlacement(self, index: int) -> None:
+        self.__arrangement.remove_placement(index)
+
+    @pyqtSlot()
+    def clearSong(self) -> None:
+        self.__arrangement.clear()
+
+    @pyqtProperty(int)
+    def song_length(self) -> int:
+        return self.__arrangement.length()
+
+    @pyqtSlot(str, int)
+    def exportSongMidiFile(self, file_name: str, bpm: int) -> None:
+        """Writes the whole song to a Standard MIDI File"""
+        from midi_file import export_midi_file
+
+        export_midi_file(self.__engine, file_name, bpm, arrangement=self.__arrangement)
+
+    @pyqtProperty(bool)
+    def recording(self) -> bool:
+        return self.__recorder is not None
+
+    @pyqtSlot(bool)
+    def setRecording(self, enabled: bool) -> None:
+        if enabled and self.__recorder is None:
+            self.__recorder = AutomationRecorder()
+        elif not enabled and self.__recorder is not None:
+            self.__end_take()
+            self.__recorder = None
+
+    @pyqtSlot(float)
+    def setRecordingTolerance(self, tolerance: float) -> None:
+        """Maximum error of the recorded curves, relative to the range of
+        each parameter"""
+        if self.__recorder is not None:
+            self.__recorder.tolerance = tolerance
+
+    @pyqtSlot(int, str, float, float, float)
+    def recordParameter(
+        self,
+        channel: int,
+        parameter: str,
+        value: float,
+        minimum: float,
+        maximum: float,
+    ) -> None:
+        """Records the value of a parameter ranging from minimum to maximum at
+        the current position, when recording and playing. Only the
+        breakpoints of the curve are kept"""
+        if self.__recorder is None or self.__engine.state != State.PLAYING:
+            return
+        self.__begin_take()
+        time = TimeUnit(round(self.__engine.position()[1]))
+        self.__add_recorded(
+            self.__recorder.add(channel, parameter, time, value, minimum, maximum)
+        )
+
+    def __add_recorded(self, events: List[Tuple[int, TimeUnit, Event]]) -> None:
+        for channel, start_time, event in events:
+            # the breakpoints of the lane in the span of the new segment are
+            # replaced, the segment starts at the last recorded breakpoint
+            key = (channel, event.key())
+            last = self.__last_recorded.get(key)
+            if last is None or last >= start_time:
+                # start of the curve or the playback looped
+                last = TimeUnit(start_time - 1)
+            self.__last_recorded[key] = start_time
+            replaced = [
+                (time, breakpoint)
+                for _, time, breakpoint in self.__engine.iterate_events(
+                    TimeUnit(last + 1), TimeUnit(start_time + 1), channel
+                )
+                if breakpoint.key() == event.key()
+            ]
+            for time, breakpoint in replaced:
+                self._remove_event(channel, time, breakpoint)
+            self._add_event(channel, start_time, event)
+
+    @pyqtSlot(int, int)
+    def startLiveRecording(self, channel: int, quantize: int) -> None:
+        """Records the notes received while playing to a channel. Start times
+        and durations are rounded to quantize, if not 0"""
+        self.__live_channel = channel
+        self.__live_quantize = TimeUnit(quantize)
+
+    @pyqtSlot()
+    def stopLiveRecording(self) -> None:
+        self.__end_take()
+        self.__live_channel = None
+
+    @pyqtSlot(list, float)
+    def recordMidiMessage(self, message: list, clock_ms: float) -> None:
+        """Records a MIDI message received at a time of the clock of the
+        engine (in ms), when live recording and playing"""
+        if self.__live_channel is None or self.__engine.state != State.PLAYING:
+            return
+        self.__begin_take()
+        if self.__note_recorder is None:
+            self.__note_recorder = NoteRecorder(
+                *self.__engine.loop_range, self.__live_quantize
+            )
+        loop_index, time = self.__engine.position(clock_ms)
+        for start_time, event in self.__note_recorder.message(
+            message, loop_index, time
+        ):
+            self.__recorded_notes.append((self.__live_channel, start_time, event))
+        if self.__recorded_notes and not self.__record_timer.isActive():
+            self.__record_timer.start()
+
+    def __add_recorded_notes(self) -> None:
+        self.__record_timer.stop()
+        if self.__recorded_notes:
+            self._add_events(self.__recorded_notes)
+            self.__recorded_notes = []
+
+    def __begin_take(self) -> None:
+        if not self.__recording_take:
+            self.__recording_take = True
+            self.__history.begin()
+
+    def __end_take(self) -> None:
+        """Adds what is still being recorded and closes the undo level of
+        the take"""
+        if not self.__recording_take:
+            return
+        if self.__recorder is not None:
+            self.__add_recorded(self.__recorder.flush())
+        if self.__note_recorder is not None:
+            for start_time, event in self.__note_recorder.flush(
+                *self.__engine.position()
+            ):
+                self.__recorded_notes.append((self.__live_channel, start_time, event))
+            self.__note_recorder = None
+        self.__add_recorded_notes()
+        self.__last_recorded.clear()
+        self.__recording_take = False
+        self.__history.end()
+
+    @pyqtProperty(int)
+    def lookahead(self) -> int:
+        return self.__lookahead
+
+    @pyqtSlot(int)
+    def setLookahead(self, lookahead_ms: int) -> None:
+        """Sets the lookahead window (in ms) of the JACK MIDI dispatch mode.
+        0 disables it, events are then emitted through the notes signal"""
+        assert self.__engine.state == State.STOPPED
+        self.__lookahead = lookahead_ms
+        if lookahead_ms > 0 and self.__dispatcher is None:
+            from midi_dispatch import JackMidiDispatcher
+
+            self.__dispatcher = JackMidiDispatcher()
+            for channel, port_name in self.__channel_ports.items():
+                self.__dispatcher.connect(channel, port_name)
+
+    @pyqtSlot(int, str)
+    def connectChannel(self, channel: int, port_name: str) -> None:
+        """Routes a channel to a MIDI input port, in lookahead mode"""
+        if self.__process is not None:
+            # first, as it rejects names that are too long
+            self.__process.connect(channel, port_name)
+        self.__channel_ports[channel] = port_name
+        if self.__dispatcher is not None:
+            self.__dispatcher.connect(channel, port_name)
+
+    @pyqtProperty(bool)
+    def realtime_process(self) -> bool:
+        return self.__process is not None
+
+    @pyqtSlot(bool)
+    def setRealtimeProcess(self, enabled: bool) -> None:
+        """Runs the playback in a dedicated process with a real-time priority,
+        that sends notes to JACK MIDI ports. GUI stalls then do not delay notes
+        """
+        assert self.__engine.state == State.STOPPED
+        if enabled and self.__process is None:
+            from sequencer_process import SequencerProcess
+
+            self.__process = SequencerProcess()
+            # the process starts with a copy of the current state
+            self.__process.set_n_bars(self.__engine.n_bars)
+            self.__process.set_time_signature(*self.__engine.time_signature)
+            self.__process.set_coalescing_window(self.__engine.coalescing_window)
+            for time, bpm, ramp in self.__engine.tempo_map.changes():
+                self.__process.set_tempo_change(time, bpm, ramp)
+            for channel, port_name in self.__channel_ports.items():
+                self.__process.connect(channel, port_name)
+            for channel, start_time, event in self.__engine.iterate_all_events():
+                self.__process.add_event(channel, start_time, event)
+        elif not enabled and self.__process is not None:
+            self.__process.close()
+            self.__process = None
+
+    def __poll_process(self):
+        """Handles the step updates and the end of the playback sent back
+        by the sequencer process"""
+        from sequencer_process import STEP, STOPPED
+
+        for kind, value, _ in self.__process.poll():
+            if kind == STEP:
+                self.step.emit(value)
+            elif kind == STOPPED:
+                self.stop(auto_stop=True)
                 break
 
-    stateChanged = pyqtSignal()
+    @pyqtProperty(int)
+    def coalescing_window(self) -> int:
+        return self.__engine.coalescing_window
 
-    def __state_change(self, new_state: State) -> None:
-        self.__state = new_state
-        self.stateChanged.emit()
+    @pyqtSlot(int)
+    def setCoalescingWindow(self, window_ms: int) -> None:
+        """Events that are less than window_ms apart are dispatched in one batch"""
+        self.__engine.coalescing_window = window_ms
+        if self.__process is not None:
+            self.__process.set_coalescing_window(window_ms)
+
+    @pyqtProperty(QVariant)
+    def timing_statistics(self) -> dict:
+        """Lateness of the events dispatched since the last play (in ms):
+        count, p50, p95, p99 and max, plus loop boundary errors
+        (loops, loop_max, loop_last). Only available without lookahead"""
+        return self.__engine.timing_stats.summary()
+
+    @pyqtSlot(result=QVariant)
+    def timingStatistics(self) -> dict:
+        return self.__engine.timing_stats.summary()
+
+    @pyqtSlot(str)
+    def dumpTimingStatistics(self, file_name: str) -> None:
+        """Writes the scheduled and actual times of the last events to a CSV file"""
+        self.__engine.timing_stats.dump_csv(file_name)
+
+    @pyqtProperty(int)
+    def control_rate(self) -> int:
+        return self.__engine.control_rate
+
+    @pyqtSlot(int)
+    def setControlRate(self, rate: int) -> None:
+        """Number of automation evaluations per second"""
+        self.__engine.control_rate = max(1, rate)
+        if self.__control_timer.isActive():
+            self.__control_timer.start(self.__control_interval())
+
+    def __control_interval(self) -> int:
+        return max(1, round(1000 / self.__engine.control_rate))
+
+    def __on_control_timeout(self):
+        values = self.__engine.automation()
+        if values:
+            self.parameters.emit([list(v) for v in values])
+
+    def __send_notes(self, notes: List[Tuple[int, int, int]]) -> None:
+        """Sends a batch of (channel, note, velocity), velocity 0 is a note off"""
+        if not notes:
+            return
+        if self.__lookahead:
+            from midi_dispatch import NOTE_ON, NOTE_OFF
+
+            for channel, note, velocity in notes:
+                status = NOTE_ON if velocity else NOTE_OFF
+                self.__dispatcher.send_now(channel, bytes((status, note, velocity)))
+        else:
+            self.notes.emit([list(n) for n in notes])
+
+    def __fill_lookahead(self):
+        """Sends the events that fall in the lookahead window to the dispatcher"""
+        from midi_dispatch import NOTE_ON, NOTE_OFF
+
+        horizon = self.__engine.elapsed() + self.__lookahead
+        for event_ms, position, channel, note, velocity in self.__engine.lookahead(
+            horizon
+        ):
+            status = NOTE_ON if velocity else NOTE_OFF
+            self.__dispatcher.schedule(
+                event_ms,
+                channel,
+                bytes((status, note, velocity)),
+                (position, channel, note, velocity),
+            )
+        if self.__engine.stop_pending() and not self.__timer.isActive():
+            # the end of the pattern is still handled by the timer
+            self.__lookahead_timer.stop()
+            self.__arm_next_event()
+
+    def __cancel_lookahead(self):
+        """Takes back the events not sent yet by the dispatcher"""
+        self.__lookahead_timer.stop()
+        self.__engine.rewind(self.__dispatcher.cancel())
+
+    def __start_lookahead(self):
+        self.__dispatcher.start(self.__engine.elapsed())
+        self.__fill_lookahead()
+        if not self.__timer.isActive():
+            self.__lookahead_timer.start(max(1, self.__lookahead // 2))
+
+    stateChanged = pyqtSignal()
 
     def __on_timeout(self):
-        # We rearm the timeout. Make sure self.__current_events is copied
-        # otherwise it could be overwritten while not processed yet
-        events = [self.__current_events]
-        self.__arm_next_event()
-
-        # The following tasks should not take more time than allocated !
-        print("Timeout @", self.__chrono.elapsed(), events)
-        for channel, event in events:
-            if isinstance(event, NoteOnEvent):
-                self.__sustained_notes.add((channel, event.note))
-                self.noteOn.emit(channel, event.note, event.velocity)
-            elif isinstance(event, NoteOffEvent):
-                self.__sustained_notes.remove((channel, event.note))
-                self.noteOff.emit(channel, event.note)
-            elif isinstance(event, StopEvent):
-                # print("!!!STOP!!!")
-                self.stop(auto_stop=True)
-            else:
-                raise TypeError("Unknown event type!")
+        notes, stopped = self.__engine.dispatch()
+        # We rearm the timeout before sending the notes
+        if not stopped:
+            self.__arm_next_event()
+        # Notes of the batch are sent all at once
+        self.__send_notes(notes)
+        if stopped:
+            self.stop(auto_stop=True)
 
     def __arm_next_event(self):
-        if self.__scheduled_events:
-            if not self.__current_events:
-                e_ms = 0
-                self.__chrono.start()
-            else:
-                e_ms = self.__chrono.elapsed()
-            event_time, self.__current_events = self.__scheduled_events.pop(0)
-            next_ms = int(event_time * 60 * 1000 / TIME_UNIT / self.__bpm * 4)
-            d = next_ms - e_ms
+        """Arms the timer on the next events"""
+        next_ms = self.__engine.next_event_ms()
+        if next_ms is not None:
             # do not schedule in the past
-            d = d if d >= 0 else 0
-            self.__timer.start(d)
-        else:
-            # print("***STOP")
-            self.__state_change(State.STOPPED)
-            self.__chrono.stop()
-            self.__step_chrono.stop()
+            self.__timer.start(max(0, next_ms - self.__engine.elapsed()))
 
-    def play(self, bpm: int, start_time: int, stop_time: int, is_looped: bool):
-        # print("***PLAY", start_time, stop_time)
-        assert self.__state == State.STOPPED
-        self.__bpm = bpm
-        self.__step_chrono.setInterval(int(60.0 / bpm * 1000))
-        if is_looped:
-            self.__looped = (bpm, start_time, stop_time)
+    def __start_timers(self):
+        self.__control_timer.start(self.__control_interval())
+        self.__on_control_timeout()
+        if self.__process is not None:
+            self.__feedback_timer.start()
+            return
+        if self.__lookahead:
+            self.__start_lookahead()
         else:
-            self.__looped = None
-
-        # Play
-        self.__scheduled_events = list(
-            self.iterate_scheduled_events(
-                TimeUnit(start_time),
-                TimeUnit(stop_time),
-                add_stop_event=True,
-            )
-        )
-        print("\n".join([repr(e) for e in self.__scheduled_events]))
+            self.__arm_next_event()
+        self._on_step_timeout()
 
-        self.__current_events = None
-        self.__arm_next_event()
+    def play(self, bpm: int, start_time: int, stop_time: int, is_looped: bool):
+        self.__engine.play(bpm, TimeUnit(start_time), TimeUnit(stop_time), is_looped)
+        if self.__process is not None:
+            self.__process.play(bpm, start_time, stop_time, is_looped)
+        self.__start_timers()
+        self.stateChanged.emit()
 
-        self.__chrono.start()
-        self.__step_chrono.start()
-        self.__state_change(State.PLAYING)
-        self.step.emit(self.__step_number)
+    @pyqtSlot(int, bool)
+    def playSong(self, bpm: int, is_looped: bool) -> None:
+        """Plays the song from its start. Pause, resume and stop are the same
+        as for a pattern"""
+        if self.__process is not None:
+            print("Songs are not played by the real-time process")
+            return
+        self.__engine.play(
+            bpm, 0, self.__arrangement.length(), is_looped, self.__arrangement
+        )
+        self.__start_timers()
+        self.stateChanged.emit()
 
     def pause(self):
-        # print("***PAUSE")
-        assert self.__state == State.PLAYING
-        self.__remaining_time_after_pause = self.__timer.remainingTime()
+        self.__end_take()
+        self.__engine.pause()
+        if self.__process is not None:
+            self.__process.pause()
+            self.__feedback_timer.stop()
+        elif self.__lookahead:
+            self.__cancel_lookahead()
         self.__timer.stop()
-        self.__chrono.pause()
-        self.__step_chrono.pause()
-        self.__state_change(State.PAUSED)
+        self.__step_timer.stop()
+        self.__control_timer.stop()
+        self.stateChanged.emit()
 
     def resume(self):
-        # print("***RESUME")
-        assert self.__state == State.PAUSED
-
-        # Resume from pause
-        self.__timer.start(self.__remaining_time_after_pause)
-        self.__chrono.start()
-        self.__step_chrono.start()
-        self.__state_change(State.PLAYING)
-        self.step.emit(self.__step_number)
+        self.__engine.resume()
+        if self.__process is not None:
+            self.__process.resume()
+        self.__start_timers()
+        self.stateChanged.emit()
 
     @pyqtSlot(bool)
     def stop(self, auto_stop=False):
         """auto_stop: True if stop() is called automatcally at the end of a pattern
         False if stop() is called "manually" from the UI"""
-        # print("***STOP")
         self.__timer.stop()
-        self.__remaining_time_after_pause = 0
-        self.__chrono.stop()
-        self.__step_chrono.stop()
-        self.__step_number = 0
-        self.__state_change(State.STOPPED)
-        if self.__looped and auto_stop:
-            bpm, start_time, stop_time = self.__looped
-            # recurse on play, but without actual recursion
-            QTimer.singleShot(0, lambda: self.play(bpm, start_time, stop_time, True))
-            return
-
+        self.__step_timer.stop()
+        self.__control_timer.stop()
+        if self.__process is not None:
+            self.__feedback_timer.stop()
+            if not auto_stop:
+                self.__process.stop()
+        elif self.__lookahead:
+            # note offs not sent yet are released below
+            self.__cancel_lookahead()
         # Send note off to notes currently playing !
-        while len(self.__sustained_notes):
-            channel, note = self.__sustained_notes.pop()
-            self.noteOff.emit(channel, note)
+        self.__end_take()
+        notes = self.__engine.stop()
+        self.stateChanged.emit()
+        self.__send_notes(notes)
 
     @pyqtSlot(int, int, int, bool)
     def toggle_play_pause(self, bpm, start_time, stop_time, is_looped):
-        if self.__state == State.STOPPED:
+        state = self.__engine.state
+        if state == State.STOPPED:
             self.play(bpm, start_time, stop_time, is_looped)
-        elif self.__state == State.PLAYING:
+        elif state == State.PLAYING:
             self.pause()
-        elif self.__state == State.PAUSED:
+        elif state == State.PAUSED:
             self.resume()
 
     @pyqtSlot(result=bool)
     def is_playing(self):
-        return self.__state == State.PLAYING
+        return self.__engine.state == State.PLAYING
 
 
 if __name__ == "__main__":
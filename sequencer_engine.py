@@ -0,0 +1,1474 @@
+# Sequencer engine, independent of Qt
+from array import array
+from enum import Enum
+import bisect
+import heapq
+import itertools
+import math
+import time
+from typing import (
+    Any,
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from sortedcontainers import SortedList  # type: ignore
+
+TimeUnit = int
+
+# smallest time: 1/256
+TIME_UNIT = 256
+
+
+class ScheduledEvent:
+    """
+    A ScheduledEvent is a concrete event that can be
+    sent to instruments. It is closed to MIDI events.
+    """
+
+    __slots__ = ["time"]
+
+    def __init__(self, time: TimeUnit):
+        self.time = time
+
+
+class NoteOnEvent(ScheduledEvent):
+    __slots__ = ["note", "velocity"]
+
+    def __init__(self, time: TimeUnit, note: int, velocity: int) -> None:
+        super().__init__(time)
+        self.note = note
+        self.velocity = velocity
+
+    def __repr__(self):
+        return "@{} - NOTE ON({}, {})".format(self.time, self.note, self.velocity)
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, NoteOnEvent)
+            and self.time == other.time
+            and self.note == other.note
+            and self.velocity == other.velocity
+        )
+
+    def __hash__(self):
+        return hash((self.time, self.note, self.velocity))
+
+
+class NoteOffEvent(ScheduledEvent):
+    __slots__ = ["note"]
+
+    def __init__(self, time: TimeUnit, note: int) -> None:
+        super().__init__(time)
+        self.note = note
+
+    def __repr__(self):
+        return "@{} - NOTE OFF({})".format(self.time, self.note)
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, NoteOffEvent)
+            and self.time == other.time
+            and self.note == other.note
+        )
+
+    def __hash__(self):
+        return hash((self.time, self.note))
+
+
+class StopEvent(ScheduledEvent):
+    __slots__ = []
+
+    def __init__(self, time: TimeUnit) -> None:
+        super().__init__(time)
+
+    def __repr__(self):
+        return "@{} - STOP".format(self.time)
+
+
+class LoopEvent(ScheduledEvent):
+    """Marks the end of a looped pattern"""
+
+    __slots__ = []
+
+    def __init__(self, time: TimeUnit) -> None:
+        super().__init__(time)
+
+    def __repr__(self):
+        return "@{} - LOOP".format(self.time)
+
+
+class Event:
+    """
+    An Event is a high-level event manipulated by the user
+    in an editor and may be different from a ScheduledEvent.
+    For example a NoteEvent will lead to two ScheduledEvents
+    (a NoteOn followed by a NoteOff)
+    """
+
+    # Events are numerous, they do not have a __dict__
+    __slots__ = []
+
+    def schedule(self, start_time: TimeUnit) -> List[ScheduledEvent]:
+        """
+        Returns a list of ScheduledEvent
+        """
+        return []
+
+    def key(self) -> Hashable:
+        """
+        Identifies the event among the events of a channel at a given time
+        """
+        return None
+
+    def to_dict(self):
+        raise NotImplementedError
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Event":
+        if d.get("event_type") == "note_event":
+            return NoteEvent(
+                d["note"],
+                d["velocity"],
+                TimeUnit(d["duration"]),
+            )
+        if d.get("event_type") == "parameter_event":
+            return ParameterEvent(
+                d["parameter"],
+                float(d["value"]),
+                d.get("curve", LINEAR),
+            )
+        return Event()
+
+
+class NoteEvent(Event):
+    __slots__ = ["note", "velocity", "duration"]
+
+    def __init__(self, note: int, velocity: int, duration: TimeUnit):
+        self.note = note
+        self.velocity = velocity
+        self.duration = duration
+
+    def __repr__(self):
+        return "(N={}, V={}, D={})".format(self.note, self.velocity, self.duration)
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, NoteEvent)
+            and self.note == other.note
+            and self.velocity == other.velocity
+            and self.duration == other.duration
+        )
+
+    def __hash__(self):
+        return hash((self.note, self.velocity, self.duration))
+
+    def key(self) -> Hashable:
+        return self.note
+
+    def schedule(self, start_time: TimeUnit) -> List[ScheduledEvent]:
+        return [
+            NoteOnEvent(start_time, self.note, self.velocity),
+            NoteOffEvent(start_time + self.duration, self.note),
+        ]
+
+    def to_dict(self):
+        return {
+            "event_type": "note_event",
+            "note": self.note,
+            "velocity": self.velocity,
+            "duration": self.duration,
+        }
+
+
+LINEAR = "linear"
+EXPONENTIAL = "exponential"
+
+
+class ParameterEvent(Event):
+    """
+    A breakpoint of the automation lane of a plugin parameter.
+
+    The curve is the one followed from the previous breakpoint of the lane
+    to this one. An exponential curve needs values of the same sign,
+    otherwise it is linear.
+    """
+
+    __slots__ = ["parameter", "value", "curve"]
+
+    def __init__(self, parameter: str, value: float, curve: str = LINEAR):
+        self.parameter = parameter
+        self.value = value
+        self.curve = curve
+
+    def __repr__(self):
+        return "(P={}, V={}, C={})".format(self.parameter, self.value, self.curve)
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, ParameterEvent)
+            and self.parameter == other.parameter
+            and self.value == other.value
+            and self.curve == other.curve
+        )
+
+    def __hash__(self):
+        return hash((self.parameter, self.value, self.curve))
+
+    def key(self) -> Hashable:
+        return self.parameter
+
+    def to_dict(self):
+        return {
+            "event_type": "parameter_event",
+            "parameter": self.parameter,
+            "value": self.value,
+            "curve": self.curve,
+        }
+
+
+class ChannelEvent:
+    """
+    A simple channel + Event wrapper
+    """
+
+    __slots__ = ["channel", "event"]
+
+    def __init__(self, channel: int, event: Event) -> None:
+        self.channel = channel
+        self.event = event
+
+    def __repr__(self):
+        return "ChannelEvent(channel={},event={})".format(self.channel, self.event)
+
+    def __eq__(self, other):
+        return self.channel == other.channel and self.event == other.event
+
+    def __hash__(self):
+        return hash((self.channel, self.event))
+
+
+class _Columns:
+    """Events of a channel as parallel arrays, sorted by time then sequence
+    number. Events that are not notes have a note of -1"""
+
+    __slots__ = ["times", "sequences", "notes", "velocities", "durations"]
+
+    def __init__(self, rows: Iterable[Tuple[int, int, int, int, int]] = ()) -> None:
+        self.times = array("i")
+        self.sequences = array("i")
+        self.notes = array("b")
+        self.velocities = array("b")
+        self.durations = array("i")
+        self.extend(rows)
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def rows(self) -> Iterator[Tuple[int, int, int, int, int]]:
+        return zip(
+            self.times, self.sequences, self.notes, self.velocities, self.durations
+        )
+
+    def insert(self, i: int, row: Tuple[int, int, int, int, int]) -> None:
+        time, sequence, note, velocity, duration = row
+        self.times.insert(i, time)
+        self.sequences.insert(i, sequence)
+        self.notes.insert(i, note)
+        self.velocities.insert(i, velocity)
+        self.durations.insert(i, duration)
+
+    def extend(self, rows: Iterable[Tuple[int, int, int, int, int]]) -> None:
+        for time, sequence, note, velocity, duration in rows:
+            self.times.append(time)
+            self.sequences.append(sequence)
+            self.notes.append(note)
+            self.velocities.append(velocity)
+            self.durations.append(duration)
+
+    def delete(self, i: int) -> None:
+        del self.times[i]
+        del self.sequences[i]
+        del self.notes[i]
+        del self.velocities[i]
+        del self.durations[i]
+
+
+class EventList:
+    """A list of ChannelEvents, indexed by time and partitioned by channel
+
+    The events of each channel are stored as parallel typed arrays (time,
+    sequence number, note, velocity, duration) sorted by time, so that a note
+    takes a few bytes instead of several Python objects, and range queries
+    are slices of these arrays. ChannelEvents are built when events are read.
+    Events other than NoteEvents, e.g. automation breakpoints, are few and
+    are kept as objects.
+
+    Events can be looked up by (channel, time, key of the event).
+
+    Each event gets a sequence number, unique in the list, returned by
+    add_event and remove_event. Events of the same time keep their
+    insertion order.
+    """
+
+    def __init__(self) -> None:
+        # channel -> events of the channel
+        self.__partitions: Dict[int, _Columns] = {}
+        # sequence number -> Event, for events that are not NoteEvents
+        self.__objects: Dict[int, Event] = {}
+        self.__sequence = 0
+
+    def __row(self, event: Event, start_time: TimeUnit) -> Tuple[int, ...]:
+        sequence = self.__sequence
+        self.__sequence += 1
+        if isinstance(event, NoteEvent):
+            return (start_time, sequence, event.note, event.velocity, event.duration)
+        self.__objects[sequence] = event
+        return (start_time, sequence, -1, -1, 0)
+
+    def __event(self, columns: _Columns, i: int) -> Event:
+        note = columns.notes[i]
+        if note < 0:
+            return self.__objects[columns.sequences[i]]
+        return NoteEvent(note, columns.velocities[i], columns.durations[i])
+
+    def __partition(self, channel: int) -> _Columns:
+        columns = self.__partitions.get(channel)
+        if columns is None:
+            columns = self.__partitions[channel] = _Columns()
+        return columns
+
+    def add_event(self, event: ChannelEvent, start_time: TimeUnit) -> int:
+        columns = self.__partition(event.channel)
+        row = self.__row(event.event, start_time)
+        # after the events of the same time, that have a lower sequence number
+        columns.insert(bisect.bisect_right(columns.times, start_time), row)
+        return row[1]
+
+    def add_events(self, events: Iterable[Tuple[ChannelEvent, TimeUnit]]) -> List[int]:
+        """Adds (event, start_time) pairs, sorting each channel only once"""
+        sequences = []
+        by_channel: Dict[int, list] = {}
+        for event, start_time in events:
+            row = self.__row(event.event, start_time)
+            by_channel.setdefault(event.channel, []).append(row)
+            sequences.append(row[1])
+        for channel, rows in by_channel.items():
+            rows.sort()
+            columns = self.__partition(channel)
+            if columns.times and rows[0][0] < columns.times[-1]:
+                self.__partitions[channel] = _Columns(
+                    sorted(itertools.chain(columns.rows(), rows))
+                )
+            else:
+                columns.extend(rows)
+        return sequences
+
+    def remove_notes(self, channel: int) -> None:
+        """Removes every NoteEvent of a channel at once, other events are
+        kept"""
+        columns = self.__partitions.pop(channel, None)
+        if columns is None:
+            return
+        kept = [row for row in columns.rows() if row[2] < 0]
+        if kept:
+            self.__partitions[channel] = _Columns(kept)
+
+    def __find(self, channel: int, start_time: TimeUnit) -> Tuple[_Columns, range]:
+        """Columns of a channel and indices of its events at a given time"""
+        columns = self.__partitions.get(channel)
+        if columns is None:
+            return _Columns(), range(0)
+        start = bisect.bisect_left(columns.times, start_time)
+        return columns, range(start, bisect.bisect_right(columns.times, start_time))
+
+    def remove_event(self, event: ChannelEvent, start_time: TimeUnit) -> int:
+        columns, indices = self.__find(event.channel, start_time)
+        for i in indices:
+            if self.__event(columns, i) == event.event:
+                sequence = columns.sequences[i]
+                self.__objects.pop(sequence, None)
+                columns.delete(i)
+                return sequence
+        raise ValueError("{} not in list".format(event))
+
+    def lookup(
+        self, key: Tuple[int, TimeUnit, Hashable]
+    ) -> List[Tuple[TimeUnit, ChannelEvent]]:
+        """Returns the (time, event) whose (channel, time, key of the event)
+        is the given one"""
+        channel, time, event_key = key
+        columns, indices = self.__find(channel, time)
+        found = []
+        for i in indices:
+            event = self.__event(columns, i)
+            if event.key() == event_key:
+                found.append((time, ChannelEvent(channel, event)))
+        return found
+
+    def __iter__(self) -> Iterator[Tuple[TimeUnit, ChannelEvent]]:
+        return self.irange(None, None)
+
+    def __len__(self) -> int:
+        return sum(len(columns) for columns in self.__partitions.values())
+
+    def __slice(
+        self,
+        channel: int,
+        min_time: Optional[TimeUnit],
+        max_time: Optional[TimeUnit],
+        inclusive,
+        reverse: bool,
+    ) -> Iterator[Tuple[TimeUnit, int, ChannelEvent]]:
+        """(time, sequence number, event) of the events of a channel between
+        min_time and max_time"""
+        columns = self.__partitions[channel]
+        times = columns.times
+        if min_time is None:
+            start = 0
+        elif inclusive[0]:
+            start = bisect.bisect_left(times, min_time)
+        else:
+            start = bisect.bisect_right(times, min_time)
+        if max_time is None:
+            stop = len(times)
+        elif inclusive[1]:
+            stop = bisect.bisect_right(times, max_time)
+        else:
+            stop = bisect.bisect_left(times, max_time)
+        indices = range(start, stop)
+        for i in reversed(indices) if reverse else indices:
+            event = ChannelEvent(channel, self.__event(columns, i))
+            yield times[i], columns.sequences[i], event
+
+    def irange(
+        self,
+        min_time: Optional[TimeUnit],
+        max_time: Optional[TimeUnit],
+        inclusive=(True, True),
+        reverse=False,
+        partition: Optional[int] = None,
+    ) -> Iterator[Tuple[TimeUnit, ChannelEvent]]:
+        """Iterates over events between min_time and max_time.
+        If partition (a channel) is given, only events of this channel are
+        considered. Otherwise, channels are merged"""
+        if partition is None:
+            channels = list(self.__partitions)
+        elif partition in self.__partitions:
+            channels = [partition]
+        else:
+            return
+        slices = [
+            self.__slice(channel, min_time, max_time, inclusive, reverse)
+            for channel in channels
+        ]
+        merged = (
+            slices[0]
+            if len(slices) == 1
+            else heapq.merge(*slices, key=lambda e: e[:2], reverse=reverse)
+        )
+        for time, _, event in merged:
+            yield time, event
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+# (time, order, sequence number, channel, ScheduledEvent)
+TimelineEntry = Tuple[TimeUnit, int, int, int, ScheduledEvent]
+
+
+class ScheduledTimeline:
+    """
+    The ScheduledEvents of every Event, sorted by time.
+
+    It is kept up to date incrementally each time an Event is added or removed,
+    so that playback can start without scheduling the whole pattern.
+
+    Entries are TimelineEntry tuples, where the sequence number is the one
+    of the Event in its EventList. At a given time, note offs come before
+    other events and ties are broken by insertion order. Since entries are
+    unique, an entry can be used as a cursor that stays valid while
+    the timeline is edited.
+
+    Entries are stored as parallel typed arrays, a TimelineEntry and its
+    ScheduledEvent are only built when the entry is read.
+    """
+
+    def __init__(self) -> None:
+        self.__times = array("i")
+        self.__orders = array("b")
+        self.__sequences = array("i")
+        self.__channels = array("B")
+        self.__notes = array("B")
+        self.__velocities = array("B")
+
+    @staticmethod
+    def __rows_of(
+        channel: int, start_time: TimeUnit, event: Event, sequence: int
+    ) -> List[Tuple[int, int, int, int, int, int]]:
+        """(time, order, sequence number, channel, note, velocity) of the
+        ScheduledEvents of an Event"""
+        rows = []
+        for e in event.schedule(start_time):
+            if isinstance(e, NoteOffEvent):
+                rows.append((e.time, 0, sequence, channel, e.note, 0))
+            else:
+                rows.append((e.time, 1, sequence, channel, e.note, e.velocity))
+        return rows
+
+    def __columns(self) -> Tuple[array, ...]:
+        return (
+            self.__times,
+            self.__orders,
+            self.__sequences,
+            self.__channels,
+            self.__notes,
+            self.__velocities,
+        )
+
+    def __rows(self) -> Iterator[Tuple[int, ...]]:
+        return zip(*self.__columns())
+
+    def __set_rows(self, rows: Iterable[Tuple[int, ...]]) -> None:
+        columns = [array(c.typecode) for c in self.__columns()]
+        for row in rows:
+            for column, value in zip(columns, row):
+                column.append(value)
+        (
+            self.__times,
+            self.__orders,
+            self.__sequences,
+            self.__channels,
+            self.__notes,
+            self.__velocities,
+        ) = columns
+
+    def __bisect(self, key: tuple) -> int:
+        """Index of the first entry whose (time, order, sequence number) is
+        not lower than key, a (time,) or (time, order, sequence number, ...)
+        tuple"""
+        times = self.__times
+        i = bisect.bisect_left(times, key[0])
+        if len(key) > 1:
+            rank = key[1:3]
+            stop = bisect.bisect_right(times, key[0], i)
+            while i < stop and (self.__orders[i], self.__sequences[i]) < rank:
+                i += 1
+        return i
+
+    def __after(self, cursor: tuple) -> int:
+        """Index of the first entry after cursor"""
+        i = self.__bisect(cursor)
+        if (
+            len(cursor) > 1
+            and i < len(self.__times)
+            and self.__times[i] == cursor[0]
+            and (self.__orders[i], self.__sequences[i]) == cursor[1:3]
+        ):
+            i += 1
+        return i
+
+    def __entry(self, i: int) -> TimelineEntry:
+        time = self.__times[i]
+        if self.__orders[i] == 0:
+            event: ScheduledEvent = NoteOffEvent(time, self.__notes[i])
+        else:
+            event = NoteOnEvent(time, self.__notes[i], self.__velocities[i])
+        return (time, self.__orders[i], self.__sequences[i], self.__channels[i], event)
+
+    def add(
+        self, channel: int, start_time: TimeUnit, event: Event, sequence: int
+    ) -> None:
+        for row in self.__rows_of(channel, start_time, event, sequence):
+            i = self.__bisect(row)
+            for column, value in zip(self.__columns(), row):
+                column.insert(i, value)
+
+    def add_events(self, events: Iterable[Tuple[int, TimeUnit, Event, int]]) -> None:
+        """Adds (channel, start_time, event, sequence) with one sort"""
+        rows = []
+        for channel, start_time, event, sequence in events:
+            rows.extend(self.__rows_of(channel, start_time, event, sequence))
+        if not rows:
+            return
+        rows.sort()
+        if self.__times and rows[0][:3] < self.__entry(-1)[:3]:
+            self.__set_rows(sorted(itertools.chain(self.__rows(), rows)))
+        else:
+            for row in rows:
+                for column, value in zip(self.__columns(), row):
+                    column.append(value)
+
+    def remove_channel(self, channel: int) -> None:
+        """Removes the entries of every event of a channel at once"""
+        self.__set_rows([row for row in self.__rows() if row[3] != channel])
+
+    def remove(
+        self, channel: int, start_time: TimeUnit, event: Event, sequence: int
+    ) -> None:
+        for row in self.__rows_of(channel, start_time, event, sequence):
+            # (time, order, sequence) identifies an entry
+            i = self.__bisect(row)
+            for column in self.__columns():
+                del column[i]
+
+    def next_entry(self, cursor: tuple, end_time: TimeUnit) -> Optional[TimelineEntry]:
+        """Returns the first entry after cursor and before end_time.
+        cursor is either an entry or a (time,) tuple"""
+        i = self.__after(cursor)
+        if i < len(self.__times) and self.__times[i] < end_time:
+            return self.__entry(i)
+        return None
+
+    def entries_after(self, cursor: tuple) -> Iterator[TimelineEntry]:
+        """Iterates over the entries after cursor, an entry or a (time,) tuple"""
+        for i in range(self.__after(cursor), len(self.__times)):
+            yield self.__entry(i)
+
+    def __len__(self) -> int:
+        return len(self.__times)
+
+
+# Sorts after any sequence number
+_LAST = math.inf
+
+
+class AutomationLane:
+    """
+    Breakpoints (ParameterEvents) of a parameter of a channel, sorted by time.
+    """
+
+    def __init__(self) -> None:
+        # (time, sequence number, ParameterEvent)
+        self.__breakpoints = SortedList()
+
+    def add(self, time: TimeUnit, sequence: int, event: ParameterEvent) -> None:
+        self.__breakpoints.add((time, sequence, event))
+
+    def remove(self, time: TimeUnit, sequence: int) -> None:
+        del self.__breakpoints[self.__breakpoints.bisect_left((time, sequence))]
+
+    def __len__(self) -> int:
+        return len(self.__breakpoints)
+
+    def value(self, time: float) -> float:
+        """Value of the lane at a time. Before the first breakpoint and after
+        the last one, the value is held"""
+        breakpoints = self.__breakpoints
+        i = breakpoints.bisect_right((time, _LAST))
+        if i == 0:
+            return breakpoints[0][2].value
+        t0, _, start = breakpoints[i - 1]
+        if i == len(breakpoints):
+            return start.value
+        t1, _, end = breakpoints[i]
+        v0, v1 = start.value, end.value
+        ratio = (time - t0) / (t1 - t0)
+        if end.curve == EXPONENTIAL and v0 * v1 > 0:
+            return v0 * (v1 / v0) ** ratio
+        return v0 + (v1 - v0) * ratio
+
+
+class TimingStats:
+    """
+    Dispatch timing of the last events, in a fixed size ring buffer.
+
+    For each event, the scheduled and actual dispatch times (in ms) are
+    recorded, so that lateness percentiles can be computed. Errors at loop
+    boundaries are recorded separately.
+    """
+
+    def __init__(self, size: int = 4096) -> None:
+        self.__size = size
+        self.__scheduled = array("l", [0]) * size
+        self.__actual = array("l", [0]) * size
+        # total number of recorded events
+        self.__count = 0
+        self.__loop_errors = array("l", [0]) * size
+        self.__loop_count = 0
+
+    def clear(self) -> None:
+        self.__count = 0
+        self.__loop_count = 0
+
+    def record(self, scheduled_ms: int, actual_ms: int) -> None:
+        i = self.__count % self.__size
+        self.__scheduled[i] = scheduled_ms
+        self.__actual[i] = actual_ms
+        self.__count += 1
+
+    def record_loop(self, scheduled_ms: int, actual_ms: int) -> None:
+        self.__loop_errors[self.__loop_count % self.__size] = actual_ms - scheduled_ms
+        self.__loop_count += 1
+
+    def __recorded(self) -> range:
+        """Ring buffer indices, from the oldest to the newest record"""
+        n = min(self.__count, self.__size)
+        start = self.__count - n
+        return range(start, start + n)
+
+    def lateness(self) -> List[int]:
+        return [
+            self.__actual[i % self.__size] - self.__scheduled[i % self.__size]
+            for i in self.__recorded()
+        ]
+
+    @staticmethod
+    def __percentile(values: List[int], p: float) -> int:
+        """Nearest-rank percentile of sorted values"""
+        return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+    def summary(self) -> Dict[str, int]:
+        lateness = sorted(self.lateness())
+        loop_errors = [
+            self.__loop_errors[i % self.__size]
+            for i in range(
+                self.__loop_count - min(self.__loop_count, self.__size),
+                self.__loop_count,
+            )
+        ]
+        summary = {"count": self.__count, "loops": self.__loop_count}
+        if lateness:
+            summary.update(
+                {
+                    "p50": self.__percentile(lateness, 50),
+                    "p95": self.__percentile(lateness, 95),
+                    "p99": self.__percentile(lateness, 99),
+                    "max": lateness[-1],
+                }
+            )
+        if loop_errors:
+            summary["loop_max"] = max(loop_errors, key=abs)
+            summary["loop_last"] = loop_errors[-1]
+        return summary
+
+    def dump_csv(self, file_name: str) -> None:
+        """Writes scheduled and actual dispatch times of the recorded events"""
+        import csv
+
+        with open(file_name, "w", newline="") as fo:
+            writer = csv.writer(fo)
+            writer.writerow(["scheduled_ms", "actual_ms", "lateness_ms"])
+            for i in self.__recorded():
+                scheduled = self.__scheduled[i % self.__size]
+                actual = self.__actual[i % self.__size]
+                writer.writerow([scheduled, actual, actual - scheduled])
+
+
+class State(Enum):
+    STOPPED = 0
+    PLAYING = 1
+    PAUSED = 2
+
+
+# ms per TimeUnit at 1 bpm (bpm are quarter notes per minute)
+_MS_PER_UNIT_BPM = 60 * 1000 * 4 / TIME_UNIT
+
+
+class TempoMap:
+    """
+    Tempo along the timeline: a base tempo and tempo changes.
+
+    A change is either a jump or a ramp: with a ramp, the tempo goes linearly
+    (in TimeUnit) from the tempo of the previous change to the new one.
+
+    The cumulative time in ms of each change is precomputed, so that
+    conversions between TimeUnit and ms are a binary search on the changes
+    plus a closed form on one segment.
+    """
+
+    def __init__(
+        self,
+        bpm: float = 120,
+        changes: Iterable[Tuple[TimeUnit, float, bool]] = (),
+    ) -> None:
+        self.__bpm = bpm
+        # time -> (bpm, ramp)
+        self.__changes: Dict[TimeUnit, Tuple[float, bool]] = {
+            time: (change_bpm, ramp) for time, change_bpm, ramp in changes
+        }
+        self.__update()
+
+    def __update(self) -> None:
+        points = [(TimeUnit(0), self.__bpm, False)]
+        for time in sorted(self.__changes):
+            change_bpm, ramp = self.__changes[time]
+            if time == 0:
+                points[0] = (time, change_bpm, False)
+            else:
+                points.append((time, change_bpm, ramp))
+        # Segment i starts at self.__times[i], with a tempo that goes from
+        # self.__start_bpms[i] to self.__end_bpms[i]
+        self.__times = [time for time, _, _ in points]
+        self.__start_bpms = [point_bpm for _, point_bpm, _ in points]
+        self.__end_bpms = [
+            next_bpm if ramp else point_bpm
+            for (_, point_bpm, _), (_, next_bpm, ramp) in zip(points, points[1:])
+        ] + [points[-1][1]]
+        self.__ms = [0.0]
+        for i in range(len(points) - 1):
+            length = self.__times[i + 1] - self.__times[i]
+            self.__ms.append(self.__ms[i] + self.__segment_ms(i, length))
+
+    def __slope(self, i: int) -> float:
+        """Tempo change per TimeUnit of a ramp segment"""
+        length = self.__times[i + 1] - self.__times[i]
+        return (self.__end_bpms[i] - self.__start_bpms[i]) / length
+
+    def __segment_ms(self, i: int, delta: float) -> float:
+        bpm = self.__start_bpms[i]
+        if bpm == self.__end_bpms[i]:
+            return delta * _MS_PER_UNIT_BPM / bpm
+        slope = self.__slope(i)
+        return _MS_PER_UNIT_BPM / slope * math.log((bpm + slope * delta) / bpm)
+
+    def __segment_time(self, i: int, ms: float) -> float:
+        bpm = self.__start_bpms[i]
+        if bpm == self.__end_bpms[i]:
+            return ms * bpm / _MS_PER_UNIT_BPM
+        slope = self.__slope(i)
+        return bpm * (math.exp(ms * slope / _MS_PER_UNIT_BPM) - 1) / slope
+
+    @property
+    def bpm(self) -> float:
+        """Base tempo, used until the first change"""
+        return self.__bpm
+
+    @bpm.setter
+    def bpm(self, bpm: float) -> None:
+        self.__bpm = bpm
+        self.__update()
+
+    def set_change(self, time: TimeUnit, bpm: float, ramp: bool = False) -> None:
+        self.__changes[time] = (bpm, ramp)
+        self.__update()
+
+    def remove_change(self, time: TimeUnit) -> None:
+        self.__changes.pop(time, None)
+        self.__update()
+
+    def clear(self) -> None:
+        self.__changes.clear()
+        self.__update()
+
+    def changes(self) -> List[Tuple[TimeUnit, float, bool]]:
+        return [(time, *self.__changes[time]) for time in sorted(self.__changes)]
+
+    def bpm_at(self, time: float) -> float:
+        i = bisect.bisect_right(self.__times, time) - 1
+        if i + 1 == len(self.__times) or self.__start_bpms[i] == self.__end_bpms[i]:
+            return self.__start_bpms[i]
+        return self.__start_bpms[i] + self.__slope(i) * (time - self.__times[i])
+
+    def time_to_ms(self, time: float) -> float:
+        i = max(0, bisect.bisect_right(self.__times, time) - 1)
+        return self.__ms[i] + self.__segment_ms(i, time - self.__times[i])
+
+    def ms_to_time(self, ms: float) -> float:
+        i = max(0, bisect.bisect_right(self.__ms, ms) - 1)
+        return self.__times[i] + self.__segment_time(i, ms - self.__ms[i])
+
+
+class Clock:
+    """Source of time of the engine, in ms"""
+
+    def now(self) -> float:
+        raise NotImplementedError
+
+
+class MonotonicClock(Clock):
+    """Real time clock, not affected by system clock changes"""
+
+    def now(self) -> float:
+        return time.monotonic() * 1000
+
+
+class SimulatedClock(Clock):
+    """Clock that only moves when told to, for deterministic tests and
+    benchmarks"""
+
+    def __init__(self, start_ms: float = 0) -> None:
+        self.__now = start_ms
+
+    def now(self) -> float:
+        return self.__now
+
+    def advance(self, ms: float) -> None:
+        self.__now += ms
+
+    def set(self, ms: float) -> None:
+        self.__now = ms
+
+
+# (channel, note, velocity), a velocity of 0 means note off
+Note = Tuple[int, int, int]
+
+
+class SequencerEngine:
+    """
+    Events of every channel and their playback against a Clock.
+
+    The engine does not own any timer: its owner asks for the time of the
+    next events with next_event_ms() and calls dispatch() when they are due,
+    or calls process() periodically. Times given to or returned by the
+    engine are in ms of playback, which does not include pauses.
+
+    1 step = 1 quarter note
+    """
+
+    def __init__(self, clock: Optional[Clock] = None) -> None:
+        self.clock = clock if clock is not None else MonotonicClock()
+        # Events, also indexed by (channel, time, note) and partitioned by channel
+        self.__events = EventList()
+        # Scheduled events, kept in sync with self.__events
+        self.__timeline = ScheduledTimeline()
+        # Timeline being played
+        self.__source: Any = self.__timeline
+
+        self.time_signature = (4, 4)
+        # Length, in bars
+        self.n_bars = 2
+        # Tempo along the timeline, play() sets its base tempo
+        self.tempo_map = TempoMap()
+        # Events closer than this (in ms) are dispatched together
+        self.coalescing_window = 0
+        # Scheduled vs actual dispatch times
+        self.timing_stats = TimingStats()
+        # Automation lanes, by (channel, parameter), kept in sync with
+        # self.__events
+        self.__lanes: Dict[Tuple[int, str], AutomationLane] = {}
+        # Automation is evaluated control_rate times per second
+        self.control_rate = 100
+        # Last control tick evaluated and last values of the lanes
+        self.__control_tick = -1
+        self.__parameter_values: Dict[Tuple[int, str], float] = {}
+
+        self.__state = State.STOPPED
+        # Clock time of the playback origin, while playing
+        self.__origin = 0.0
+        # Playback time, while paused
+        self.__paused_elapsed = 0.0
+
+        self.__looped = False
+        # Start time and length of the played pattern
+        self.__loop_start = TimeUnit(0)
+        self.__loop_length = TimeUnit(0)
+        # Position of the pattern start in the tempo map and duration of
+        # the pattern, in ms
+        self.__start_ms = 0.0
+        self.__loop_ms = 0.0
+        # Playback position: last timeline entry played (None when the
+        # playback is over) and number of the current loop iteration
+        self.__cursor: Optional[tuple] = None
+        self.__loop_index = 0
+        # Sequence numbers of the events added at the time of the cursor,
+        # which are not played before the next loop
+        self.__played_sequences: Set[int] = set()
+        # Event that marks the end of the played pattern (LoopEvent or StopEvent)
+        self.__end_entry: Optional[TimelineEntry] = None
+
+        # Notes that are being played, so that stop can stop them all
+        self.__sustained_notes: Set[Tuple[int, int]] = set()
+
+    @property
+    def state(self) -> State:
+        return self.__state
+
+    @property
+    def bpm(self) -> float:
+        return self.tempo_map.bpm
+
+    @property
+    def max_time(self) -> TimeUnit:
+        return TimeUnit(
+            self.n_bars * self.time_signature[0] * TIME_UNIT / self.time_signature[1]
+        )
+
+    def add_event(self, channel: int, start_time: TimeUnit, event: Event) -> None:
+        sequence = self.__events.add_event(ChannelEvent(channel, event), start_time)
+        self.__timeline.add(channel, start_time, event, sequence)
+        self.__skip_if_played(start_time, sequence)
+        if isinstance(event, ParameterEvent):
+            self.__lane(channel, event.parameter).add(start_time, sequence, event)
+
+    def __lane(self, channel: int, parameter: str) -> AutomationLane:
+        lane = self.__lanes.get((channel, parameter))
+        if lane is None:
+            lane = self.__lanes[(channel, parameter)] = AutomationLane()
+        return lane
+
+    def add_events(self, events: List[Tuple[int, TimeUnit, Event]]) -> None:
+        """Adds (channel, start_time, event) in one bulk insertion"""
+        sequences = self.__events.add_events(
+            (ChannelEvent(channel, event), start_time)
+            for channel, start_time, event in events
+        )
+        self.__timeline.add_events(
+            (channel, start_time, event, sequence)
+            for (channel, start_time, event), sequence in zip(events, sequences)
+        )
+        for (channel, start_time, event), sequence in zip(events, sequences):
+            self.__skip_if_played(start_time, sequence)
+            if isinstance(event, ParameterEvent):
+                self.__lane(channel, event.parameter).add(start_time, sequence, event)
+
+    def __skip_if_played(self, start_time: TimeUnit, sequence: int) -> None:
+        """Entries added at the time of the cursor sort after it, but this time
+        was played already: they wait for the next loop"""
+        cursor = self.__cursor
+        if (
+            self.__source is self.__timeline
+            and cursor is not None
+            and len(cursor) > 1
+            and cursor[0] == start_time
+        ):
+            self.__played_sequences.add(sequence)
+
+    def __release_removed(
+        self, channel: int, start_time: TimeUnit, event: Event, sequence: int
+    ) -> List[Note]:
+        """Returns a note off if the removed event is a note being played,
+        as its note off entry is removed with it"""
+        if (
+            not isinstance(event, NoteEvent)
+            or self.__source is not self.__timeline
+            or self.__cursor is None
+        ):
+            return []
+        key = (channel, event.note)
+        note_on = (start_time, 1, sequence)
+        note_off = (start_time + event.duration, 0, sequence)
+        if key in self.__sustained_notes and note_on <= self.__cursor < note_off:
+            self.__sustained_notes.remove(key)
+            return [(channel, event.note, 0)]
+        return []
+
+    def remove_event(
+        self, channel: int, start_time: TimeUnit, event: Event
+    ) -> List[Note]:
+        """Removes an event and returns the note off to send if it was being
+        played"""
+        sequence = self.__events.remove_event(ChannelEvent(channel, event), start_time)
+        self.__timeline.remove(channel, start_time, event, sequence)
+        if isinstance(event, ParameterEvent):
+            lane = self.__lanes[(channel, event.parameter)]
+            lane.remove(start_time, sequence)
+            if not len(lane):
+                del self.__lanes[(channel, event.parameter)]
+        return self.__release_removed(channel, start_time, event, sequence)
+
+    def remove_channel(self, channel: int) -> List[Note]:
+        """Removes every note of a channel and returns note offs for its
+        notes being played. The automation of the channel is kept"""
+        self.__events.remove_notes(channel)
+        self.__timeline.remove_channel(channel)
+        if self.__source is not self.__timeline:
+            return []
+        released = [key for key in self.__sustained_notes if key[0] == channel]
+        self.__sustained_notes.difference_update(released)
+        return [(channel, note, 0) for channel, note in released]
+
+    def remove_events_in_range(
+        self, channel: int, start_time: TimeUnit, end_time: TimeUnit
+    ) -> List[Note]:
+        """Removes the notes of a channel in a time range, its automation is
+        kept. Returns note offs for the removed notes being played"""
+        to_remove = [
+            (channel, time, event)
+            for channel, time, event in self.iterate_events(
+                start_time, end_time, channel
+            )
+            if isinstance(event, NoteEvent)
+        ]
+        notes: List[Note] = []
+        for channel, start_time, event in to_remove:
+            notes.extend(self.remove_event(channel, start_time, event))
+        return notes
+
+    def get_event(
+        self, channel: int, time: TimeUnit, key: Hashable = None
+    ) -> Optional[Event]:
+        """Returns the event of a channel at a given time.
+        If key is given, the event is looked up in the (channel, time, key) index
+        """
+        if key is not None:
+            for _, ch_event in self.__events.lookup((channel, time, key)):
+                return ch_event.event
+            return None
+
+        for _, ch_event in self.__events.irange(time, time, partition=channel):
+            return ch_event.event
+        return None
+
+    def set_event(self, channel: int, start_time: TimeUnit, event: Event) -> List[Note]:
+        """Replaces the event with the same (channel, time, key) by a new one,
+        or adds it if there is none. Returns the note off to send if the
+        replaced event was being played"""
+        notes: List[Note] = []
+        for _, ch_event in self.__events.lookup((channel, start_time, event.key())):
+            notes = self.remove_event(channel, start_time, ch_event.event)
+            break
+        self.add_event(channel, start_time, event)
+        return notes
+
+    def iterate_events(
+        self,
+        start_time: Optional[TimeUnit] = None,
+        stop_time: Optional[TimeUnit] = None,
+        channel: Optional[int] = None,
+    ) -> Iterator[Tuple[int, TimeUnit, Event]]:
+        """Iterates over events between start_time and stop_time,
+        of all channels or of the given channel"""
+        max_time = self.max_time
+        if stop_time is None or stop_time > max_time:
+            stop_time = max_time
+        for event_time, ch_event in self.__events.irange(
+            start_time, stop_time, inclusive=[True, False], partition=channel
+        ):
+            yield ch_event.channel, event_time, ch_event.event
+
+    def iterate_all_events(
+        self, channel: Optional[int] = None
+    ) -> Iterator[Tuple[int, TimeUnit, Event]]:
+        """Iterates over every event, even the ones after the last bar,
+        of all channels or of the given channel"""
+        for event_time, ch_event in self.__events.irange(None, None, partition=channel):
+            yield ch_event.channel, event_time, ch_event.event
+
+    def iterate_scheduled_events(
+        self,
+        start_time: Optional[TimeUnit] = None,
+        stop_time: Optional[TimeUnit] = None,
+        add_stop_event: bool = False,
+    ) -> Iterator[Tuple[TimeUnit, Tuple[int, ScheduledEvent]]]:
+        """Yields the ScheduledEvents of the events between start_time and
+        stop_time, by time. Events are scheduled lazily while walking the
+        event list: only the scheduled events that are still pending (e.g. note
+        offs of the notes being played) are kept, in a heap. At a given time,
+        note offs come first, like in the ScheduledTimeline"""
+        # heap of (time, order, sequence number, channel, ScheduledEvent)
+        pending: List[TimelineEntry] = []
+        sequence = 0
+        for channel, event_time, event in self.iterate_events(start_time, stop_time):
+            # pending events before this event cannot be preceded by another one
+            while pending and pending[0][0] < event_time:
+                e_time, _, _, e_channel, e = heapq.heappop(pending)
+                yield e_time, (e_channel, e)
+            for e in event.schedule(event_time):
+                order = 0 if isinstance(e, NoteOffEvent) else 1
+                heapq.heappush(pending, (e.time, order, sequence, channel, e))
+                sequence += 1
+
+        while pending:
+            e_time, _, _, e_channel, e = heapq.heappop(pending)
+            yield e_time, (e_channel, e)
+
+        if stop_time and add_stop_event:
+            for channel in range(16):
+                yield stop_time, (channel, StopEvent(stop_time))
+
+    def elapsed(self) -> int:
+        """Playback time, in ms"""
+        if self.__state == State.PLAYING:
+            return int(self.clock.now() - self.__origin)
+        return int(self.__paused_elapsed)
+
+    def __update_loop(self) -> None:
+        self.__start_ms = self.tempo_map.time_to_ms(self.__loop_start)
+        self.__loop_ms = (
+            self.tempo_map.time_to_ms(self.__loop_start + self.__loop_length)
+            - self.__start_ms
+        )
+
+    def set_tempo_change(self, time: TimeUnit, bpm: float, ramp: bool = False):
+        self.tempo_map.set_change(time, bpm, ramp)
+        self.__update_loop()
+
+    def remove_tempo_change(self, time: TimeUnit) -> None:
+        self.tempo_map.remove_change(time)
+        self.__update_loop()
+
+    def clear_tempo_changes(self) -> None:
+        self.tempo_map.clear()
+        self.__update_loop()
+
+    def __time_to_ms(self, loop_index: int, event_time: float) -> float:
+        """Playback time (in ms) of a time of the pattern, in a loop iteration"""
+        # All loop iterations share the same time base:
+        # loop N starts exactly at N * loop duration
+        return (
+            loop_index * self.__loop_ms
+            + self.tempo_map.time_to_ms(event_time)
+            - self.__start_ms
+        )
+
+    def step(self) -> Tuple[int, int]:
+        """Returns the current step number and the time (in ms) until the next
+        step boundary. Steps are derived from the playback time and the tempo
+        map, so that they do not drift"""
+        step_time = TIME_UNIT // 4
+        elapsed = self.elapsed()
+        loop_index, loop_elapsed = 0, elapsed
+        if self.__looped and self.__loop_ms:
+            loop_index, loop_elapsed = divmod(elapsed, self.__loop_ms)
+        time = (
+            self.tempo_map.ms_to_time(self.__start_ms + loop_elapsed)
+            - self.__loop_start
+        )
+        # nearest boundary, since timers may fire a bit early
+        n_steps = int((time + step_time / 2) // step_time)
+
+        next_time = (n_steps + 1) * step_time
+        if self.__looped and next_time >= self.__loop_length:
+            next_time -= self.__loop_length
+            loop_index += 1
+        next_ms = self.__time_to_ms(int(loop_index), self.__loop_start + next_time)
+        delay = max(1, int(next_ms - elapsed))
+
+        ticks = n_steps * step_time
+        if self.__looped and self.__loop_length:
+            ticks %= self.__loop_length
+        return ticks * 4 // TIME_UNIT, delay
+
+    def __playback_position(self, elapsed: float) -> Tuple[int, float]:
+        """Loop iteration and time of the pattern played at a playback time
+        (in ms)"""
+        loop_index = 0
+        if self.__looped and self.__loop_ms:
+            loop_index, elapsed = divmod(elapsed, self.__loop_ms)
+        return int(loop_index), min(
+            self.tempo_map.ms_to_time(self.__start_ms + elapsed),
+            self.__loop_start + self.__loop_length,
+        )
+
+    @property
+    def loop_range(self) -> Tuple[TimeUnit, TimeUnit]:
+        """Start and stop times of the pattern played"""
+        return self.__loop_start, self.__loop_start + self.__loop_length
+
+    def position(self, clock_ms: Optional[float] = None) -> Tuple[int, float]:
+        """Loop iteration and time of the pattern played now, or at a time of
+        the clock (in ms), e.g. to record events"""
+        if clock_ms is None or self.__state != State.PLAYING:
+            elapsed = self.elapsed()
+        else:
+            elapsed = max(0.0, clock_ms - self.__origin)
+        return self.__playback_position(elapsed)
+
+    def automation(self) -> List[Tuple[int, str, float]]:
+        """Evaluates every automation lane at the current control tick and
+        returns the (channel, parameter, value) that changed since the last
+        call. Nothing is returned twice for the same tick. Songs are not
+        automated"""
+        if self.__state != State.PLAYING or self.__source is not self.__timeline:
+            return []
+        period = 1000 / self.control_rate
+        tick = int(self.elapsed() // period)
+        if tick == self.__control_tick:
+            return []
+        self.__control_tick = tick
+        _, time = self.__playback_position(tick * period)
+        changed = []
+        for key, lane in self.__lanes.items():
+            value = lane.value(time)
+            if self.__parameter_values.get(key) != value:
+                self.__parameter_values[key] = value
+                changed.append((key[0], key[1], value))
+        return changed
+
+    def play(
+        self,
+        bpm: int,
+        start_time: TimeUnit,
+        stop_time: TimeUnit,
+        looped: bool,
+        timeline: Any = None,
+    ):
+        """Starts the playback of the events of the engine, or of another
+        timeline with a next_entry() method, like an Arrangement"""
+        assert self.__state == State.STOPPED
+        self.__source = timeline if timeline is not None else self.__timeline
+        self.tempo_map.bpm = bpm
+        self.__loop_start = start_time
+        self.__loop_length = stop_time - start_time
+        self.__update_loop()
+        self.__looped = looped and self.__loop_length > 0
+
+        # Play from the cached timeline. The end of the pattern is marked by
+        # a LoopEvent or a StopEvent
+        end_event = (LoopEvent if self.__looped else StopEvent)(stop_time)
+        self.__end_entry = (stop_time, 2, -1, 0, end_event)
+        self.__cursor = (start_time,)
+        self.__loop_index = 0
+        self.__played_sequences.clear()
+
+        self.timing_stats.clear()
+        self.__control_tick = -1
+        self.__parameter_values.clear()
+        self.__origin = self.clock.now()
+        self.__state = State.PLAYING
+
+    def pause(self) -> None:
+        assert self.__state == State.PLAYING
+        self.__paused_elapsed = self.elapsed()
+        self.__state = State.PAUSED
+
+    def resume(self) -> None:
+        assert self.__state == State.PAUSED
+        self.__origin = self.clock.now() - self.__paused_elapsed
+        self.__state = State.PLAYING
+
+    def stop(self) -> List[Note]:
+        """Stops the playback and returns note offs for the notes being played"""
+        self.__state = State.STOPPED
+        self.__cursor = None
+        self.__paused_elapsed = 0
+        return self.__release_notes()
+
+    def __release_notes(self) -> List[Note]:
+        """Returns note offs for every sustained note"""
+        notes = [(channel, note, 0) for channel, note in self.__sustained_notes]
+        self.__sustained_notes.clear()
+        return notes
+
+    def __next_entry(self) -> Optional[TimelineEntry]:
+        """Returns the next timeline entry to play, or None at the end of the playback.
+        The end of the pattern is marked by self.__end_entry"""
+        if self.__cursor is None:
+            return None
+        end_time = self.__loop_start + self.__loop_length
+        entry = self.__source.next_entry(self.__cursor, end_time)
+        while (
+            entry is not None
+            and entry[0] == self.__cursor[0]
+            and entry[2] in self.__played_sequences
+        ):
+            entry = self.__source.next_entry(entry, end_time)
+        return entry if entry is not None else self.__end_entry
+
+    def __entry_ms(self, entry: TimelineEntry) -> int:
+        """Dispatch time (in ms) of an entry in the current loop iteration"""
+        return int(self.__time_to_ms(self.__loop_index, entry[0]))
+
+    def __advance_cursor(self, entry: TimelineEntry) -> None:
+        if self.__cursor is not None and entry[0] != self.__cursor[0]:
+            self.__played_sequences.clear()
+        if entry is not self.__end_entry:
+            self.__cursor = entry
+        elif self.__looped:
+            # wrap around, without rebuilding anything
+            self.__cursor = (self.__loop_start,)
+            self.__loop_index += 1
+        else:
+            self.__cursor = None
+
+    def next_event_ms(self) -> Optional[int]:
+        """Playback time (in ms) of the next events, None at the end of the
+        playback"""
+        entry = self.__next_entry()
+        return self.__entry_ms(entry) if entry is not None else None
+
+    def stop_pending(self) -> bool:
+        """True if the next event is the end of a pattern that is not looped"""
+        entry = self.__next_entry()
+        return entry is not None and isinstance(entry[4], StopEvent)
+
+    def dispatch(self) -> Tuple[List[Note], bool]:
+        """Plays the next events, with the ones that fall in the coalescing
+        window. Returns the notes to send, all at once, and whether the
+        playback is over"""
+        now = self.elapsed()
+        entry = self.__next_entry()
+        if entry is None:
+            return [], True
+        first_ms = self.__entry_ms(entry)
+        notes: List[Note] = []
+        while entry is not None:
+            event_ms = self.__entry_ms(entry)
+            if event_ms > first_ms + self.coalescing_window:
+                break
+            self.__advance_cursor(entry)
+            _, _, _, channel, event = entry
+            self.timing_stats.record(event_ms, now)
+            if isinstance(event, NoteOnEvent):
+                self.__sustained_notes.add((channel, event.note))
+                notes.append((channel, event.note, event.velocity))
+            elif isinstance(event, NoteOffEvent):
+                # the note may have started before the playback start
+                if (channel, event.note) in self.__sustained_notes:
+                    self.__sustained_notes.remove((channel, event.note))
+                    notes.append((channel, event.note, 0))
+            elif isinstance(event, LoopEvent):
+                # notes are cut at the loop boundary
+                notes.extend(self.__release_notes())
+                self.timing_stats.record_loop(event_ms, now)
+            elif isinstance(event, StopEvent):
+                notes.extend(self.stop())
+                return notes, True
+            else:
+                raise TypeError("Unknown event type!")
+            entry = self.__next_entry()
+        return notes, False
+
+    def process(self) -> Tuple[List[Note], bool]:
+        """Plays every event that is due. Meant to be called periodically,
+        e.g. from a dedicated thread or with a SimulatedClock"""
+        notes: List[Note] = []
+        while self.__state == State.PLAYING:
+            next_ms = self.next_event_ms()
+            if next_ms is None or next_ms > self.elapsed():
+                break
+            batch, stopped = self.dispatch()
+            notes.extend(batch)
+            if stopped:
+                return notes, True
+        return notes, False
+
+    def lookahead(self, horizon_ms: int) -> List[Tuple[int, tuple, int, int, int]]:
+        """Plays the events until horizon_ms ahead of time and returns them as
+        (ms, position, channel, note, velocity). Events that are not sent in
+        the end can be taken back with rewind(). The end of a pattern that is
+        not looped is left to dispatch()"""
+        played = []
+        while True:
+            entry = self.__next_entry()
+            if entry is None:
+                break
+            event_ms = self.__entry_ms(entry)
+            _, _, _, channel, event = entry
+            if event_ms > horizon_ms or isinstance(event, StopEvent):
+                break
+            position = (self.__loop_index, self.__cursor)
+            self.__advance_cursor(entry)
+            if isinstance(event, LoopEvent):
+                # notes are cut at the loop boundary
+                for channel, note, _ in self.__release_notes():
+                    played.append((event_ms, position, channel, note, 0))
+            elif isinstance(event, NoteOnEvent):
+                self.__sustained_notes.add((channel, event.note))
+                played.append((event_ms, position, channel, event.note, event.velocity))
+            elif (channel, event.note) in self.__sustained_notes:
+                self.__sustained_notes.remove((channel, event.note))
+                played.append((event_ms, position, channel, event.note, 0))
+        return played
+
+    def rewind(self, cancelled: List[Tuple[tuple, int, int, int]]) -> None:
+        """Takes back (position, channel, note, velocity) returned by
+        lookahead() and not sent, in their original order"""
+        if not cancelled:
+            return
+        self.__loop_index, self.__cursor = cancelled[0][0]
+        self.__played_sequences.clear()
+        # undone from the last one, as a note may be played several times
+        for _, channel, note, velocity in reversed(cancelled):
+            if velocity:
+                self.__sustained_notes.discard((channel, note))
+            else:
+                self.__sustained_notes.add((channel, note))
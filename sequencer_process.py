@@ -0,0 +1,340 @@
+# Sequencer engine running in a dedicated process
+import os
+import struct
+import subprocess
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import Iterator, Optional, Tuple
+
+from sequencer_engine import Event, NoteEvent, SequencerEngine, State, TimeUnit
+
+# Commands, sent as (opcode, 5 integer arguments, string argument)
+NAME_SIZE = 64
+COMMAND = struct.Struct("<B5i{}s".format(NAME_SIZE))
+ADD_NOTE = 1
+REMOVE_NOTE = 2
+SET_NOTE = 3
+REMOVE_CHANNEL = 4
+REMOVE_RANGE = 5
+SET_N_BARS = 6
+SET_TIME_SIGNATURE = 7
+SET_COALESCING_WINDOW = 8
+CONNECT = 9
+PLAY = 10
+PAUSE = 11
+RESUME = 12
+STOP = 13
+QUIT = 14
+SET_TEMPO_CHANGE = 15
+REMOVE_TEMPO_CHANGE = 16
+CLEAR_TEMPO_CHANGES = 17
+
+# Tempos are sent in thousandths of bpm
+BPM_SCALE = 1000
+
+# Feedback, sent as (kind, 2 integer arguments)
+FEEDBACK = struct.Struct("<Bii")
+# step number, playback time in ms
+STEP = 1
+# end of a pattern that is not looped
+STOPPED = 2
+
+# Maximum time (in ms) the process sleeps before looking for new commands
+POLL_MS = 1
+# Real-time priority of the process, when allowed
+RT_PRIORITY = 70
+
+
+class ShmRing:
+    """
+    Ring of fixed size records in shared memory, with one producer and one
+    consumer, that can be in different processes.
+
+    The header holds the number of records written and read so far. Each
+    counter is only written by one side, so that no lock is needed.
+    """
+
+    HEADER = struct.Struct("<QQ")
+
+    def __init__(
+        self, record_size: int, n_records: int = 4096, name: Optional[str] = None
+    ) -> None:
+        self.__record_size = record_size
+        self.__n_records = n_records
+        self.__owner = name is None
+        self.__shm = shared_memory.SharedMemory(
+            name=name,
+            create=self.__owner,
+            size=self.HEADER.size + record_size * n_records,
+        )
+        if self.__owner:
+            self.HEADER.pack_into(self.__shm.buf, 0, 0, 0)
+        else:
+            # the memory belongs to the other process, which unlinks it
+            resource_tracker.unregister(self.__shm._name, "shared_memory")
+
+    @property
+    def name(self) -> str:
+        return self.__shm.name
+
+    def __offset(self, count: int) -> int:
+        return self.HEADER.size + (count % self.__n_records) * self.__record_size
+
+    def push(self, record: bytes) -> bool:
+        """Returns False if the ring is full"""
+        written, read = self.HEADER.unpack_from(self.__shm.buf, 0)
+        if written - read >= self.__n_records:
+            return False
+        offset = self.__offset(written)
+        self.__shm.buf[offset : offset + self.__record_size] = record
+        # the record is published once it is complete
+        struct.pack_into("<Q", self.__shm.buf, 0, written + 1)
+        return True
+
+    def pop(self) -> Optional[bytes]:
+        """Returns None if the ring is empty"""
+        written, read = self.HEADER.unpack_from(self.__shm.buf, 0)
+        if read == written:
+            return None
+        offset = self.__offset(read)
+        record = bytes(self.__shm.buf[offset : offset + self.__record_size])
+        struct.pack_into("<Q", self.__shm.buf, 8, read + 1)
+        return record
+
+    def close(self) -> None:
+        self.__shm.close()
+        if self.__owner:
+            self.__shm.unlink()
+
+
+def _raise_priority() -> None:
+    """Asks for a real-time scheduling, or at least a higher priority"""
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(RT_PRIORITY))
+    except (AttributeError, OSError):
+        try:
+            os.nice(-10)
+        except OSError:
+            print("Cannot raise the priority of the sequencer process")
+
+
+def _apply(engine: SequencerEngine, dispatcher, command: tuple) -> None:
+    """Applies a command to the engine of the sequencer process"""
+    opcode, a, b, c, d, e, name = command
+    if opcode in (ADD_NOTE, REMOVE_NOTE, SET_NOTE):
+        event = NoteEvent(c, d, TimeUnit(e))
+        if opcode == ADD_NOTE:
+            engine.add_event(a, TimeUnit(b), event)
+        elif opcode == REMOVE_NOTE:
+            _send_notes(dispatcher, engine.remove_event(a, TimeUnit(b), event))
+        else:
+            _send_notes(dispatcher, engine.set_event(a, TimeUnit(b), event))
+    elif opcode == REMOVE_CHANNEL:
+        _send_notes(dispatcher, engine.remove_channel(a))
+    elif opcode == REMOVE_RANGE:
+        _send_notes(
+            dispatcher, engine.remove_events_in_range(a, TimeUnit(b), TimeUnit(c))
+        )
+    elif opcode == SET_N_BARS:
+        engine.n_bars = a
+    elif opcode == SET_TIME_SIGNATURE:
+        engine.time_signature = (a, b)
+    elif opcode == SET_COALESCING_WINDOW:
+        engine.coalescing_window = a
+    elif opcode == SET_TEMPO_CHANGE:
+        engine.set_tempo_change(TimeUnit(a), b / BPM_SCALE, bool(c))
+    elif opcode == REMOVE_TEMPO_CHANGE:
+        engine.remove_tempo_change(TimeUnit(a))
+    elif opcode == CLEAR_TEMPO_CHANGES:
+        engine.clear_tempo_changes()
+    elif opcode == CONNECT:
+        dispatcher.connect(a, name.rstrip(b"\0").decode())
+    # Transport commands may cross the end of a pattern that is not looped,
+    # the ones that do not fit the state of the engine are ignored
+    elif opcode == PLAY:
+        if engine.state != State.STOPPED:
+            _send_notes(dispatcher, engine.stop())
+        engine.play(a, TimeUnit(b), TimeUnit(c), bool(d))
+    elif opcode == PAUSE:
+        if engine.state == State.PLAYING:
+            engine.pause()
+    elif opcode == RESUME:
+        if engine.state == State.PAUSED:
+            engine.resume()
+    elif opcode == STOP:
+        _send_notes(dispatcher, engine.stop())
+
+
+def _send_notes(dispatcher, notes) -> None:
+    from midi_dispatch import NOTE_ON, NOTE_OFF
+
+    for channel, note, velocity in notes:
+        status = NOTE_ON if velocity else NOTE_OFF
+        dispatcher.send_now(channel, bytes((status, note, velocity)))
+
+
+def _run(command_ring: str, feedback_ring: str, n_records: int) -> None:
+    """Main loop of the sequencer process"""
+    from midi_dispatch import JackMidiDispatcher
+
+    _raise_priority()
+    commands = ShmRing(COMMAND.size, n_records, command_ring)
+    feedback = ShmRing(FEEDBACK.size, n_records, feedback_ring)
+    engine = SequencerEngine()
+    dispatcher = JackMidiDispatcher()
+    # playback time of the next step boundary
+    next_step_ms: Optional[int] = None
+    parent = os.getppid()
+
+    # stop with the parent process
+    while os.getppid() == parent:
+        record = commands.pop()
+        while record is not None:
+            command = COMMAND.unpack(record)
+            if command[0] == QUIT:
+                dispatcher.close()
+                commands.close()
+                feedback.close()
+                return
+            _apply(engine, dispatcher, command)
+            if command[0] in (PLAY, RESUME):
+                next_step_ms = engine.elapsed()
+            record = commands.pop()
+
+        if engine.state != State.PLAYING:
+            time.sleep(POLL_MS * 5 / 1000)
+            continue
+
+        notes, stopped = engine.process()
+        _send_notes(dispatcher, notes)
+        elapsed = engine.elapsed()
+        if stopped:
+            feedback.push(FEEDBACK.pack(STOPPED, 0, elapsed))
+            continue
+        if elapsed >= next_step_ms:
+            step_number, delay = engine.step()
+            feedback.push(FEEDBACK.pack(STEP, step_number, elapsed))
+            next_step_ms = elapsed + delay
+
+        wake_ms = min(engine.next_event_ms(), next_step_ms) - engine.elapsed()
+        if wake_ms > 0:
+            time.sleep(min(wake_ms, POLL_MS) / 1000)
+
+
+class SequencerProcess:
+    """
+    Runs a SequencerEngine in a child process with a real-time priority, so
+    that the GUI thread (garbage collection, QML bindings, painting) does not
+    delay notes.
+
+    Edits and transport commands are sent over a shared memory ring. Notes
+    are sent by the process itself to JACK MIDI ports, one per channel. Step
+    updates and the end of the playback come back over a second ring, see
+    poll().
+    """
+
+    def __init__(self, n_records: int = 4096) -> None:
+        self.__commands = ShmRing(COMMAND.size, n_records)
+        self.__feedback = ShmRing(FEEDBACK.size, n_records)
+        # a fresh interpreter, that does not inherit the Qt application
+        # nor re-run the main module
+        self.__process = subprocess.Popen(
+            [
+                sys.executable,
+                os.path.abspath(__file__),
+                self.__commands.name,
+                self.__feedback.name,
+                str(n_records),
+            ]
+        )
+
+    def __send(self, opcode: int, *args: int, name: str = "") -> None:
+        args = args + (0,) * (5 - len(args))
+        encoded = name.encode()
+        if len(encoded) > NAME_SIZE:
+            raise ValueError("Name longer than {} bytes: {}".format(NAME_SIZE, name))
+        record = COMMAND.pack(opcode, *args, encoded)
+        # the process empties the ring every POLL_MS
+        while not self.__commands.push(record):
+            if self.__process.poll() is not None:
+                raise RuntimeError("The sequencer process has exited")
+            time.sleep(POLL_MS / 1000)
+
+    def __send_event(self, opcode: int, channel: int, time: TimeUnit, event: Event):
+        # only note events are played
+        if isinstance(event, NoteEvent):
+            self.__send(
+                opcode, channel, time, event.note, event.velocity, event.duration
+            )
+
+    def add_event(self, channel: int, start_time: TimeUnit, event: Event) -> None:
+        self.__send_event(ADD_NOTE, channel, start_time, event)
+
+    def remove_event(self, channel: int, start_time: TimeUnit, event: Event) -> None:
+        self.__send_event(REMOVE_NOTE, channel, start_time, event)
+
+    def set_event(self, channel: int, start_time: TimeUnit, event: Event) -> None:
+        self.__send_event(SET_NOTE, channel, start_time, event)
+
+    def remove_channel(self, channel: int) -> None:
+        self.__send(REMOVE_CHANNEL, channel)
+
+    def remove_events_in_range(
+        self, channel: int, start_time: TimeUnit, end_time: TimeUnit
+    ) -> None:
+        self.__send(REMOVE_RANGE, channel, start_time, end_time)
+
+    def set_n_bars(self, n_bars: int) -> None:
+        self.__send(SET_N_BARS, n_bars)
+
+    def set_time_signature(self, number_of_notes: int, unit: int) -> None:
+        self.__send(SET_TIME_SIGNATURE, number_of_notes, unit)
+
+    def set_coalescing_window(self, window_ms: int) -> None:
+        self.__send(SET_COALESCING_WINDOW, window_ms)
+
+    def set_tempo_change(self, time: TimeUnit, bpm: float, ramp: bool) -> None:
+        self.__send(SET_TEMPO_CHANGE, time, round(bpm * BPM_SCALE), int(ramp))
+
+    def remove_tempo_change(self, time: TimeUnit) -> None:
+        self.__send(REMOVE_TEMPO_CHANGE, time)
+
+    def clear_tempo_changes(self) -> None:
+        self.__send(CLEAR_TEMPO_CHANGES)
+
+    def connect(self, channel: int, port_name: str) -> None:
+        self.__send(CONNECT, channel, name=port_name)
+
+    def play(self, bpm: int, start_time: TimeUnit, stop_time: TimeUnit, looped: bool):
+        self.__send(PLAY, bpm, start_time, stop_time, int(looped))
+
+    def pause(self) -> None:
+        self.__send(PAUSE)
+
+    def resume(self) -> None:
+        self.__send(RESUME)
+
+    def stop(self) -> None:
+        self.__send(STOP)
+
+    def poll(self) -> Iterator[Tuple[int, int, int]]:
+        """Yields the (kind, value, playback time) sent back by the process,
+        where kind is STEP or STOPPED"""
+        record = self.__feedback.pop()
+        while record is not None:
+            yield FEEDBACK.unpack(record)
+            record = self.__feedback.pop()
+
+    def close(self) -> None:
+        self.__send(QUIT)
+        try:
+            self.__process.wait(1)
+        except subprocess.TimeoutExpired:
+            self.__process.kill()
+        self.__commands.close()
+        self.__feedback.close()
+
+
+if __name__ == "__main__":
+    _run(sys.argv[1], sys.argv[2], int(sys.argv[3]))
@@ -0,0 +1,157 @@
+# Tests of the expansion of a song arrangement
+import unittest
+
+from arrangement import Arrangement, Pattern, Placement
+from sequencer_engine import (
+    NoteEvent,
+    NoteOnEvent,
+    SequencerEngine,
+    SimulatedClock,
+    TimeUnit,
+)
+
+STEP = TimeUnit(64)
+BAR = TimeUnit(256)
+
+
+class TestArrangement(unittest.TestCase):
+    def setUp(self):
+        self.arrangement = Arrangement()
+        pattern = Pattern(BAR)
+        pattern.add_event(0, TimeUnit(0), NoteEvent(60, 100, STEP))
+        pattern.add_event(1, 2 * STEP, NoteEvent(40, 90, STEP))
+        self.arrangement.set_pattern("A", pattern)
+
+    def notes(self, start_time=None, stop_time=None):
+        """(time, channel, note, velocity) of the scheduled events, with a
+        velocity of 0 for note offs"""
+        return [
+            (
+                time,
+                channel,
+                event.note,
+                event.velocity if isinstance(event, NoteOnEvent) else 0,
+            )
+            for time, (channel, event) in self.arrangement.iterate_scheduled_events(
+                start_time, stop_time
+            )
+        ]
+
+    def test_placements(self):
+        self.arrangement.add_placement(Placement("A", 0))
+        self.arrangement.add_placement(Placement("A", 2, {0: 3}, 12))
+        self.assertEqual(self.arrangement.length(), 3 * BAR)
+        self.assertEqual(
+            self.notes(),
+            [
+                (0, 0, 60, 100),
+                (64, 0, 60, 0),
+                (128, 1, 40, 90),
+                (192, 1, 40, 0),
+                (512, 3, 72, 100),
+                (576, 3, 72, 0),
+                (640, 1, 52, 90),
+                (704, 1, 52, 0),
+            ],
+        )
+
+    def test_overlapping_placements(self):
+        self.arrangement.add_placement(Placement("A", 1))
+        self.arrangement.add_placement(Placement("A", 1, transpose=7))
+        self.assertEqual(
+            [(time, note) for time, _, note, velocity in self.notes() if velocity],
+            [(256, 60), (256, 67), (384, 40), (384, 47)],
+        )
+
+    def test_iterate_range(self):
+        self.arrangement.add_placement(Placement("A", 0))
+        self.arrangement.add_placement(Placement("A", 1))
+        # notes started before the range are not released, notes started in
+        # the range are
+        self.assertEqual(
+            self.notes(STEP, BAR + STEP // 2),
+            [(128, 1, 40, 90), (192, 1, 40, 0), (256, 0, 60, 100), (320, 0, 60, 0)],
+        )
+
+    def test_notes_cut_at_placement_end(self):
+        pattern = Pattern(BAR)
+        pattern.add_event(0, 3 * STEP, NoteEvent(62, 100, 2 * STEP))
+        pattern.add_event(0, 2 * STEP, NoteEvent(60, 100, 4 * STEP))
+        self.arrangement.set_pattern("B", pattern)
+        self.arrangement.add_placement(Placement("B", 0))
+        self.arrangement.add_placement(Placement("B", 1))
+        self.assertEqual(
+            self.notes(),
+            [
+                (128, 0, 60, 100),
+                (192, 0, 62, 100),
+                (256, 0, 62, 0),
+                (256, 0, 60, 0),
+                (384, 0, 60, 100),
+                (448, 0, 62, 100),
+                (512, 0, 62, 0),
+                (512, 0, 60, 0),
+            ],
+        )
+        entries = list(self.arrangement.entries_after((TimeUnit(200),)))
+        self.assertEqual(
+            [(time, event.note) for time, _, _, _, event in entries],
+            [(256, 62), (256, 60), (384, 60), (448, 62), (512, 62), (512, 60)],
+        )
+        # from a cursor between the cut note offs
+        self.assertEqual(list(self.arrangement.entries_after(entries[0])), entries[1:])
+
+    def test_transpose_out_of_range(self):
+        self.arrangement.add_placement(Placement("A", 0, transpose=70))
+        self.arrangement.add_placement(Placement("A", 1, transpose=-50))
+        self.assertEqual(
+            self.notes(),
+            [(128, 1, 110, 90), (192, 1, 110, 0), (256, 0, 10, 100), (320, 0, 10, 0)],
+        )
+
+    def test_edits(self):
+        index = self.arrangement.add_placement(Placement("A", 0))
+        self.arrangement.add_placement(Placement("A", 1))
+        self.arrangement.remove_placement(index)
+        self.assertEqual([p.start_bar for p in self.arrangement.placements()], [1])
+        with self.assertRaises(ValueError):
+            self.arrangement.add_placement(Placement("B", 0))
+        self.arrangement.remove_pattern("A")
+        self.assertEqual(self.arrangement.placements(), [])
+        self.assertEqual(self.arrangement.length(), 0)
+
+    def test_playback(self):
+        self.arrangement.add_placement(Placement("A", 0))
+        self.arrangement.add_placement(Placement("A", 1, {1: 2}))
+        clock = SimulatedClock()
+        engine = SequencerEngine(clock)
+        engine.play(
+            120, TimeUnit(0), self.arrangement.length(), False, self.arrangement
+        )
+        played = []
+        while True:
+            ms = engine.next_event_ms()
+            if ms is None:
+                break
+            clock.set(ms)
+            notes, stopped = engine.process()
+            played.extend((ms, note) for note in notes)
+            if stopped:
+                break
+        self.assertEqual(
+            played,
+            [
+                (0, (0, 60, 100)),
+                (500, (0, 60, 0)),
+                (1000, (1, 40, 90)),
+                (1500, (1, 40, 0)),
+                (2000, (0, 60, 100)),
+                (2500, (0, 60, 0)),
+                (3000, (2, 40, 90)),
+                (3500, (2, 40, 0)),
+            ],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
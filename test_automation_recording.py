@@ -0,0 +1,76 @@
+# Tests of the thinning of recorded controller streams
+import math
+import unittest
+
+from automation_recording import AutomationRecorder, CurveThinner
+from sequencer_engine import ParameterEvent, TimeUnit
+
+
+def _interpolate(breakpoints, time):
+    for (t0, v0), (t1, v1) in zip(breakpoints, breakpoints[1:]):
+        if t0 <= time <= t1:
+            return v0 + (v1 - v0) * (time - t0) / (t1 - t0)
+    raise ValueError(time)
+
+
+class TestCurveThinner(unittest.TestCase):
+    def thin(self, thinner, points):
+        breakpoints = []
+        for time, value in points:
+            breakpoints.extend(thinner.add(TimeUnit(time), value))
+        return breakpoints + thinner.flush()
+
+    def test_line(self):
+        points = [(t, 0.5 * t) for t in range(50)]
+        self.assertEqual(self.thin(CurveThinner(0.01), points), [(0, 0), (49, 24.5)])
+
+    def test_corner(self):
+        points = [(t, min(t, 25)) for t in range(50)]
+        self.assertEqual(
+            self.thin(CurveThinner(0.01), points), [(0, 0), (25, 25), (49, 25)]
+        )
+
+    def test_error_bound(self):
+        points = [(t, math.sin(t / 20)) for t in range(500)]
+        breakpoints = self.thin(CurveThinner(0.01), points)
+        self.assertLess(len(breakpoints), len(points) // 5)
+        for time, value in points:
+            self.assertLessEqual(abs(_interpolate(breakpoints, time) - value), 0.01)
+
+    def test_window_is_bounded(self):
+        points = [(t, 0.0) for t in range(100)]
+        self.assertEqual(
+            self.thin(CurveThinner(0.01, max_window=40), points),
+            [(0, 0.0), (40, 0.0), (80, 0.0), (99, 0.0)],
+        )
+
+    def test_loop(self):
+        # same time points are merged and going back in time starts a new curve
+        points = [(0, 0.0), (10, 1.0), (10, 2.0), (5, 3.0), (6, 3.0)]
+        self.assertEqual(
+            self.thin(CurveThinner(0.01), points),
+            [(0, 0.0), (10, 2.0), (5, 3.0), (6, 3.0)],
+        )
+
+
+class TestAutomationRecorder(unittest.TestCase):
+    def test_tolerance_relative_to_range(self):
+        recorder = AutomationRecorder(0.01)
+        events = []
+        for t in range(50):
+            # a line with noise below 1% of the range of each parameter
+            noise = 0.5 if t % 2 else -0.5
+            events += recorder.add(0, "cutoff", TimeUnit(t), t + noise, 0, 200)
+            events += recorder.add(1, "gain", TimeUnit(t), (t + noise) / 200, 0, 1)
+        events += recorder.flush()
+        self.assertEqual(recorder.n_values, 100)
+        self.assertEqual(recorder.n_breakpoints, 4)
+        self.assertEqual(
+            sorted((channel, time, event.parameter) for channel, time, event in events),
+            [(0, 0, "cutoff"), (0, 49, "cutoff"), (1, 0, "gain"), (1, 49, "gain")],
+        )
+        self.assertIn((0, 49, ParameterEvent("cutoff", 49.5)), events)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+# Tests of the undo/redo history of the sequencer edits
+import unittest
+
+from edit_history import ADD, REMOVE, EditHistory
+from sequencer_engine import NoteEvent, TimeUnit
+
+STEP = TimeUnit(64)
+
+
+class TestEditHistory(unittest.TestCase):
+    def setUp(self):
+        self.changes = 0
+        self.history = EditHistory(on_change=self.changed)
+        # (channel, time, note) of the events, edited through the history
+        self.events = set()
+
+    def changed(self):
+        self.changes += 1
+
+    def add(self, channel, time, event):
+        self.events.add((channel, time, event.note))
+        self.history.record(ADD, channel, time, event)
+
+    def remove(self, channel, time, event):
+        self.events.remove((channel, time, event.note))
+        self.history.record(REMOVE, channel, time, event)
+
+    def undo(self):
+        return self.history.undo(self.add, self.remove)
+
+    def redo(self):
+        return self.history.redo(self.add, self.remove)
+
+    def test_undo_redo(self):
+        self.add(0, TimeUnit(0), NoteEvent(60, 100, STEP))
+        self.add(0, STEP, NoteEvent(62, 100, STEP))
+        self.assertTrue(self.undo())
+        self.assertEqual(self.events, {(0, 0, 60)})
+        self.assertTrue(self.undo())
+        self.assertEqual(self.events, set())
+        self.assertFalse(self.undo())
+        self.assertTrue(self.redo())
+        self.assertEqual(self.events, {(0, 0, 60)})
+        self.assertTrue(self.history.can_redo())
+        # a new edit forgets the undone ones
+        self.remove(0, TimeUnit(0), NoteEvent(60, 100, STEP))
+        self.assertFalse(self.history.can_redo())
+        self.assertFalse(self.redo())
+        self.assertTrue(self.undo())
+        self.assertEqual(self.events, {(0, 0, 60)})
+
+    def test_grouped_edit(self):
+        with self.history.edit():
+            self.add(0, TimeUnit(0), NoteEvent(60, 100, STEP))
+            # nested groups make a single level
+            self.history.begin()
+            self.remove(0, TimeUnit(0), NoteEvent(60, 100, STEP))
+            self.add(0, STEP, NoteEvent(62, 100, STEP))
+            self.history.end()
+            self.assertFalse(self.history.can_undo())
+        self.assertEqual(self.changes, 1)
+        self.assertTrue(self.undo())
+        self.assertEqual(self.events, set())
+        self.assertFalse(self.history.can_undo())
+        self.assertTrue(self.redo())
+        self.assertEqual(self.events, {(0, 64, 62)})
+
+    def test_empty_edit(self):
+        with self.history.edit():
+            pass
+        self.assertFalse(self.history.can_undo())
+        self.assertEqual(self.changes, 0)
+
+    def test_limits(self):
+        history = EditHistory(max_levels=3, max_operations=4)
+        for i in range(5):
+            history.record(ADD, 0, TimeUnit(i), NoteEvent(60, 100, STEP))
+        undone = []
+        while history.undo(None, lambda *operation: undone.append(operation[1])):
+            pass
+        self.assertEqual(undone, [4, 3, 2])
+        with history.edit():
+            for i in range(6):
+                history.record(ADD, 0, TimeUnit(i), NoteEvent(60, 100, STEP))
+        # the last level is kept even if it is too big
+        self.assertTrue(history.can_undo())
+        history.record(ADD, 0, TimeUnit(6), NoteEvent(60, 100, STEP))
+        undone = []
+        while history.undo(None, lambda *operation: undone.append(operation[1])):
+            pass
+        self.assertEqual(undone, [6])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+# Tests of the Standard MIDI File export and import
+import os
+import struct
+import tempfile
+import unittest
+
+from midi_file import DIVISION, _variable_length, export_midi_file, read_midi_file
+from sequencer_engine import NoteEvent, SequencerEngine, SimulatedClock, TimeUnit
+
+STEP = TimeUnit(64)
+LOOP = TimeUnit(256)
+
+
+def _track(data: bytes) -> bytes:
+    return b"MTrk" + struct.pack(">I", len(data)) + data
+
+
+class TestMidiFile(unittest.TestCase):
+    def setUp(self):
+        fd, self.file_name = tempfile.mkstemp(suffix=".mid")
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.file_name)
+
+    def write(self, *chunks: bytes) -> None:
+        with open(self.file_name, "wb") as fo:
+            fo.write(b"MThd" + struct.pack(">IHHH", 6, 1, len(chunks), DIVISION))
+            fo.write(b"".join(chunks))
+
+    def read(self):
+        return sorted(
+            (channel, time, event.note, event.velocity, event.duration)
+            for channel, time, event in read_midi_file(self.file_name)
+        )
+
+    def test_round_trip(self):
+        engine = SequencerEngine(SimulatedClock())
+        engine.add_event(0, TimeUnit(0), NoteEvent(60, 100, STEP))
+        engine.add_event(0, STEP, NoteEvent(60, 90, STEP))
+        engine.add_event(1, 2 * STEP, NoteEvent(40, 80, 2 * STEP))
+        engine.set_tempo_change(2 * STEP, 60, True)
+        export_midi_file(engine, self.file_name, 120, TimeUnit(0), LOOP)
+        self.assertEqual(
+            self.read(),
+            [(0, 0, 60, 100, STEP), (0, STEP, 60, 90, STEP), (1, 128, 40, 80, 128)],
+        )
+
+    def test_loops_cut_notes(self):
+        engine = SequencerEngine(SimulatedClock())
+        engine.add_event(0, 3 * STEP, NoteEvent(60, 100, 2 * STEP))
+        export_midi_file(engine, self.file_name, 120, TimeUnit(0), LOOP, n_loops=2)
+        self.assertEqual(
+            self.read(), [(0, 3 * STEP, 60, 100, STEP), (0, 7 * STEP, 60, 100, STEP)]
+        )
+
+    def test_running_status(self):
+        self.write(
+            _track(
+                bytes((0, 0x90, 60, 100))
+                # running status
+                + bytes((DIVISION, 60, 0))
+                + bytes((0, 0xFF, 0x2F, 0))
+            )
+        )
+        self.assertEqual(self.read(), [(0, 0, 60, 100, STEP)])
+
+    def test_meta_event_cancels_running_status(self):
+        self.write(
+            _track(
+                bytes((0, 0x90, 60, 100))
+                + bytes((0, 0xFF, 0x01, 0))
+                + bytes((0, 61, 100))
+                + bytes((0, 0xFF, 0x2F, 0))
+            )
+        )
+        with self.assertRaises(ValueError):
+            self.read()
+
+    def test_unreleased_note_ends_with_track(self):
+        self.write(
+            _track(
+                bytes((0, 0x91, 60, 100))
+                + bytes((DIVISION, 0x91, 62, 100))
+                + bytes((DIVISION, 0x81, 62, 0))
+                + _variable_length(2 * DIVISION)
+                + bytes((0xFF, 0x2F, 0))
+            )
+        )
+        self.assertEqual(
+            self.read(), [(1, 0, 60, 100, 4 * STEP), (1, STEP, 62, 100, STEP)]
+        )
+
+    def test_invalid_files(self):
+        for data in (
+            b"",
+            b"MThd",
+            b"RIFF" + bytes(10),
+            b"MThd" + struct.pack(">IHHH", 6, 1, 1, DIVISION) + b"MTr",
+            b"MThd"
+            + struct.pack(">IHHH", 6, 1, 1, DIVISION)
+            + b"MTrk"
+            + struct.pack(">I", 100)
+            + bytes((0, 0x90, 60, 100)),
+        ):
+            with open(self.file_name, "wb") as fo:
+                fo.write(data)
+            with self.assertRaises(ValueError):
+                self.read()
+
+
+if __name__ == "__main__":
+    unittest.main()
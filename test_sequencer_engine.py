@@ -0,0 +1,278 @@
+# Tests of the playback of SequencerEngine, against a SimulatedClock
+import math
+import unittest
+
+from sequencer_engine import (
+    ChannelEvent,
+    EventList,
+    NoteEvent,
+    ParameterEvent,
+    SequencerEngine,
+    SimulatedClock,
+    TempoMap,
+    TimeUnit,
+)
+
+# At 120 bpm, a step (64) lasts 500 ms and a pattern of 256 lasts 2000 ms
+BPM = 120
+STEP = TimeUnit(64)
+LOOP = TimeUnit(256)
+
+
+class TestSequencerEngine(unittest.TestCase):
+    def setUp(self):
+        self.clock = SimulatedClock()
+        self.engine = SequencerEngine(self.clock)
+
+    def play_until(self, ms):
+        """Plays the events due until ms and returns them as (ms, note)"""
+        played = []
+        while True:
+            next_ms = self.engine.next_event_ms()
+            if next_ms is None or next_ms > ms:
+                break
+            self.clock.advance(next_ms - self.engine.elapsed())
+            notes, stopped = self.engine.process()
+            played.extend((next_ms, note) for note in notes)
+            if stopped:
+                break
+        self.clock.advance(ms - self.engine.elapsed())
+        return played
+
+    def test_loop_timing(self):
+        self.engine.add_event(0, TimeUnit(0), NoteEvent(60, 100, STEP))
+        self.engine.add_event(0, 3 * STEP, NoteEvent(62, 90, STEP))
+        self.engine.play(BPM, TimeUnit(0), LOOP, True)
+        self.assertEqual(
+            self.play_until(4500),
+            [
+                (0, (0, 60, 100)),
+                (500, (0, 60, 0)),
+                (1500, (0, 62, 90)),
+                (2000, (0, 62, 0)),
+                (2000, (0, 60, 100)),
+                (2500, (0, 60, 0)),
+                (3500, (0, 62, 90)),
+                (4000, (0, 62, 0)),
+                (4000, (0, 60, 100)),
+                (4500, (0, 60, 0)),
+            ],
+        )
+        self.assertEqual(self.engine.position(), (2, STEP))
+
+    def test_stop_at_pattern_end(self):
+        self.engine.add_event(0, TimeUnit(0), NoteEvent(60, 100, 2 * LOOP))
+        self.engine.play(BPM, TimeUnit(0), LOOP, False)
+        self.assertEqual(self.play_until(3000), [(0, (0, 60, 100)), (2000, (0, 60, 0))])
+        self.assertIsNone(self.engine.next_event_ms())
+
+    def test_pause_resume(self):
+        self.engine.add_event(0, STEP, NoteEvent(60, 100, STEP))
+        self.engine.play(BPM, TimeUnit(0), LOOP, True)
+        self.play_until(250)
+        self.engine.pause()
+        self.clock.advance(1000)
+        self.engine.resume()
+        # playback time does not include the pause
+        self.assertEqual(self.engine.elapsed(), 250)
+        self.assertEqual(self.play_until(600), [(500, (0, 60, 100))])
+
+    def test_lookahead_rewind(self):
+        self.engine.add_event(0, TimeUnit(0), NoteEvent(60, 100, STEP))
+        self.engine.add_event(0, 2 * STEP, NoteEvent(62, 100, STEP))
+        self.engine.play(BPM, TimeUnit(0), LOOP, True)
+        played = self.engine.lookahead(2200)
+        self.assertEqual(
+            [(ms, note, velocity) for ms, _, _, note, velocity in played],
+            [
+                (0, 60, 100),
+                (500, 60, 0),
+                (1000, 62, 100),
+                (1500, 62, 0),
+                (2000, 60, 100),
+            ],
+        )
+        # only the first event was sent before a pause
+        self.engine.rewind([entry[1:] for entry in played[1:]])
+        self.assertEqual(self.engine.lookahead(2200), played[1:])
+
+    def test_rewind_note_played_again(self):
+        # note 60 is released and played again in the cancelled events
+        self.engine.add_event(0, TimeUnit(0), NoteEvent(60, 100, STEP))
+        self.engine.add_event(0, STEP, NoteEvent(60, 100, STEP))
+        self.engine.play(BPM, TimeUnit(0), LOOP, True)
+        played = self.engine.lookahead(600)
+        self.assertEqual(len(played), 3)
+        self.engine.rewind([entry[1:] for entry in played[1:]])
+        # the note sent before the stop is still released
+        self.assertEqual(self.engine.stop(), [(0, 60, 0)])
+
+    def test_remove_sounding_note(self):
+        note = NoteEvent(60, 100, 2 * STEP)
+        self.engine.add_event(0, TimeUnit(0), note)
+        self.engine.play(BPM, TimeUnit(0), LOOP, True)
+        self.play_until(100)
+        self.assertEqual(self.engine.remove_event(0, TimeUnit(0), note), [(0, 60, 0)])
+        self.assertEqual(self.engine.stop(), [])
+
+    def test_remove_note_not_played(self):
+        note = NoteEvent(60, 100, STEP)
+        self.engine.add_event(0, STEP, note)
+        self.engine.play(BPM, TimeUnit(0), LOOP, True)
+        self.play_until(100)
+        self.assertEqual(self.engine.remove_event(0, STEP, note), [])
+        self.assertEqual(self.play_until(1500), [])
+
+    def test_set_sounding_note(self):
+        self.engine.add_event(0, TimeUnit(0), NoteEvent(60, 100, 2 * STEP))
+        self.engine.play(BPM, TimeUnit(0), LOOP, True)
+        self.play_until(100)
+        released = self.engine.set_event(0, TimeUnit(0), NoteEvent(60, 80, STEP))
+        self.assertEqual(released, [(0, 60, 0)])
+        # the new note is played from the next loop
+        self.assertEqual(
+            self.play_until(2600), [(2000, (0, 60, 80)), (2500, (0, 60, 0))]
+        )
+
+    def test_add_at_played_time(self):
+        self.engine.add_event(0, TimeUnit(0), NoteEvent(60, 100, STEP))
+        self.engine.play(BPM, TimeUnit(0), LOOP, True)
+        self.assertEqual(self.play_until(100), [(0, (0, 60, 100))])
+        self.engine.add_event(0, TimeUnit(0), NoteEvent(64, 100, STEP))
+        self.assertEqual(
+            self.play_until(2100),
+            [
+                (500, (0, 60, 0)),
+                (2000, (0, 60, 100)),
+                (2000, (0, 64, 100)),
+            ],
+        )
+
+    def test_add_ahead_of_cursor(self):
+        self.engine.play(BPM, TimeUnit(0), LOOP, True)
+        self.play_until(100)
+        self.engine.add_event(0, STEP, NoteEvent(64, 100, STEP))
+        self.assertEqual(self.play_until(600), [(500, (0, 64, 100))])
+
+
+class TestTempoMap(unittest.TestCase):
+    def test_jump(self):
+        tempo_map = TempoMap(BPM, [(LOOP, 60, False)])
+        self.assertEqual(tempo_map.bpm_at(STEP), BPM)
+        self.assertEqual(tempo_map.bpm_at(LOOP), 60)
+        self.assertAlmostEqual(tempo_map.time_to_ms(LOOP), 2000)
+        # a step lasts twice as long after the change
+        self.assertAlmostEqual(tempo_map.time_to_ms(LOOP + STEP), 3000)
+        self.assertAlmostEqual(tempo_map.ms_to_time(3000), LOOP + STEP)
+
+    def test_ramp(self):
+        tempo_map = TempoMap(BPM, [(LOOP, 60, True)])
+        self.assertAlmostEqual(tempo_map.bpm_at(LOOP / 2), 90)
+        self.assertEqual(tempo_map.bpm_at(LOOP), 60)
+        # integral of the time per unit along a linear tempo
+        self.assertAlmostEqual(tempo_map.time_to_ms(LOOP), 4000 * math.log(2))
+        self.assertAlmostEqual(
+            tempo_map.time_to_ms(LOOP + STEP), 4000 * math.log(2) + 1000
+        )
+        for time in (0, 10, STEP, LOOP / 2, LOOP, LOOP + STEP):
+            ms = tempo_map.time_to_ms(time)
+            self.assertAlmostEqual(tempo_map.ms_to_time(ms), time)
+
+    def test_edit_changes(self):
+        tempo_map = TempoMap(BPM)
+        tempo_map.set_change(LOOP, 60, True)
+        tempo_map.set_change(2 * LOOP, 120)
+        self.assertEqual(
+            tempo_map.changes(), [(LOOP, 60, True), (2 * LOOP, 120, False)]
+        )
+        tempo_map.remove_change(LOOP)
+        self.assertAlmostEqual(tempo_map.time_to_ms(2 * LOOP), 4000)
+        # a change at 0 replaces the base tempo
+        tempo_map.set_change(TimeUnit(0), 60)
+        self.assertEqual(tempo_map.bpm_at(STEP), 60)
+
+
+class TestEventList(unittest.TestCase):
+    def setUp(self):
+        self.events = EventList()
+
+    def add(self, channel, time, event):
+        return self.events.add_event(ChannelEvent(channel, event), TimeUnit(time))
+
+    def test_insertion_order(self):
+        self.add(0, 64, NoteEvent(62, 100, STEP))
+        self.add(0, 0, NoteEvent(60, 100, STEP))
+        self.add(0, 64, NoteEvent(61, 100, STEP))
+        self.assertEqual(
+            [(time, e.event.note) for time, e in self.events],
+            [(0, 60), (64, 62), (64, 61)],
+        )
+
+    def test_lookup_by_key(self):
+        self.add(0, 64, NoteEvent(60, 100, STEP))
+        self.add(0, 64, ParameterEvent("cutoff", 0.5))
+        self.add(1, 64, NoteEvent(60, 90, STEP))
+        self.assertEqual(
+            self.events.lookup((0, TimeUnit(64), 60)),
+            [(64, ChannelEvent(0, NoteEvent(60, 100, STEP)))],
+        )
+        self.assertEqual(
+            self.events.lookup((0, TimeUnit(64), "cutoff")),
+            [(64, ChannelEvent(0, ParameterEvent("cutoff", 0.5)))],
+        )
+        self.assertEqual(self.events.lookup((0, TimeUnit(0), 60)), [])
+        self.assertEqual(self.events.lookup((2, TimeUnit(64), 60)), [])
+
+    def test_partitions(self):
+        self.add(1, 128, NoteEvent(64, 100, STEP))
+        self.add(0, 0, NoteEvent(60, 100, STEP))
+        self.add(1, 0, NoteEvent(62, 100, STEP))
+        self.add(0, 256, NoteEvent(65, 100, STEP))
+        self.assertEqual(
+            [(time, e.channel) for time, e in self.events.irange(0, 256)],
+            [(0, 0), (0, 1), (128, 1), (256, 0)],
+        )
+        self.assertEqual(
+            [time for time, _ in self.events.irange(0, 256, partition=1)], [0, 128]
+        )
+        self.assertEqual(list(self.events.irange(0, 256, partition=2)), [])
+        self.assertEqual(
+            [time for time, _ in self.events.irange(0, 256, (False, False))], [128]
+        )
+        self.assertEqual(
+            [time for time, _ in self.events.irange(None, 128, reverse=True)],
+            [128, 0, 0],
+        )
+
+    def test_bulk_add(self):
+        self.add(0, 128, NoteEvent(60, 100, STEP))
+        self.events.add_events(
+            [
+                (ChannelEvent(0, NoteEvent(61, 100, STEP)), TimeUnit(192)),
+                (ChannelEvent(0, NoteEvent(62, 100, STEP)), TimeUnit(0)),
+                (ChannelEvent(1, NoteEvent(63, 100, STEP)), TimeUnit(64)),
+            ]
+        )
+        self.assertEqual(len(self.events), 4)
+        self.assertEqual(
+            [(time, e.event.note) for time, e in self.events],
+            [(0, 62), (64, 63), (128, 60), (192, 61)],
+        )
+
+    def test_remove(self):
+        sequence = self.add(0, 0, NoteEvent(60, 100, STEP))
+        self.add(0, 0, ParameterEvent("cutoff", 0.5))
+        self.add(0, 64, NoteEvent(62, 100, STEP))
+        note = ChannelEvent(0, NoteEvent(60, 100, STEP))
+        self.assertEqual(self.events.remove_event(note, TimeUnit(0)), sequence)
+        with self.assertRaises(ValueError):
+            self.events.remove_event(note, TimeUnit(0))
+        # automation is kept
+        self.events.remove_notes(0)
+        self.assertEqual(
+            list(self.events), [(0, ChannelEvent(0, ParameterEvent("cutoff", 0.5)))]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()